@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+"""agents.py: Fast heuristic agents to benchmark against
+
+Agents are policies in the sim.py sense: agent(game, player) returns a Direction. They work
+on packed cells (y * width + x) with neighbour tables built once per board size, and reuse
+the same search buffers for every decision.
+"""
+
+from array import array
+import time
+
+from snake import *
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+STEPS = ((Direction.UP, 0, -1), (Direction.DOWN, 0, 1), (Direction.LEFT, -1, 0), (Direction.RIGHT, 1, 0))
+
+
+class Agent:
+    def __init__(self):
+        self.width = None
+        self.height = None
+        self.decisions = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def prepare(self, width, height):
+        self.width = width
+        self.height = height
+        area = width * height
+        # neighbours[cell] lists (direction, cell) for every move that stays on the board
+        self.neighbours = []
+        for cell in range(area):
+            x = cell % width
+            y = cell // width
+            self.neighbours.append([(direction, (y + dy) * width + x + dx) for direction, dx, dy in STEPS
+                                    if 0 <= x + dx < width and 0 <= y + dy < height])
+        self.queue = [0] * area
+        self.seen = [0] * area
+        self.first = [0] * area
+        self.depth = [0] * area
+        self.parent = [0] * area
+        self.stamp = 0
+        self.found_depth = 0
+        self.found_from = 0
+        # Scratch counts for the board as it would be after a planned path
+        self.virtual = array("B", bytes(area))
+
+    def __call__(self, game, player):
+        if game.width != self.width or game.height != self.height:
+            self.prepare(game.width, game.height)
+        start = time.perf_counter()
+        direction = self.decide(game, player)
+        elapsed = time.perf_counter() - start
+        self.decisions += 1
+        self.total_seconds += elapsed
+        if elapsed > self.max_seconds:
+            self.max_seconds = elapsed
+        return direction
+
+    def decide(self, game, player):
+        raise NotImplementedError
+
+    def mean_latency(self):
+        return self.total_seconds / self.decisions if self.decisions else 0.0
+
+    def cell(self, pos):
+        return pos[1] * self.width + pos[0]
+
+    def search(self, start, target, counts, vacated=-1, blocked=-1):
+        """Breadth-first search from start over free cells.
+
+        vacated is treated as free and blocked as occupied on top of counts; target is
+        always enterable. Returns the first cell of a shortest path to target, or -1 if
+        it can't be reached, and leaves the path length in found_depth and the cell before
+        target in found_from, for path(). With target -1 the whole area is explored and the
+        number of cells reached is returned instead.
+        """
+        self.stamp += 1
+        stamp = self.stamp
+        seen = self.seen
+        first = self.first
+        depth = self.depth
+        queue = self.queue
+        parent = self.parent
+        neighbours = self.neighbours
+
+        seen[start] = stamp
+        head = 0
+        tail = 0
+        for _, cell in neighbours[start]:
+            if seen[cell] == stamp:
+                continue
+            if cell != target and cell != vacated and (counts[cell] or cell == blocked):
+                continue
+            if cell == target:
+                self.found_depth = 1
+                self.found_from = start
+                return cell
+            seen[cell] = stamp
+            first[cell] = cell
+            depth[cell] = 1
+            parent[cell] = start
+            queue[tail] = cell
+            tail += 1
+
+        while head < tail:
+            current = queue[head]
+            head += 1
+            for _, cell in neighbours[current]:
+                if seen[cell] == stamp:
+                    continue
+                if cell != target and cell != vacated and (counts[cell] or cell == blocked):
+                    continue
+                if cell == target:
+                    self.found_depth = depth[current] + 1
+                    self.found_from = current
+                    return first[current]
+                seen[cell] = stamp
+                first[cell] = first[current]
+                depth[cell] = depth[current] + 1
+                parent[cell] = current
+                queue[tail] = cell
+                tail += 1
+
+        return tail if target == -1 else -1
+
+    def path(self, start, target):
+        # The cells of the path the last successful search found, from its first step to target
+        cells = [target]
+        cell = self.found_from
+        while cell != start:
+            cells.append(cell)
+            cell = self.parent[cell]
+        cells.reverse()
+        return cells
+
+    def load_counts(self, counts):
+        # Copy the board's counts into the scratch board, from a dict for sparse boards
+        virtual = self.virtual
+        if isinstance(counts, array):
+            virtual[:] = counts
+        else:
+            virtual[:] = array("B", bytes(len(virtual)))
+            for cell, count in counts.items():
+                virtual[cell] = count
+        return virtual
+
+    def direction_to(self, start, cell):
+        for direction, neighbour in self.neighbours[start]:
+            if neighbour == cell:
+                return direction
+        return False
+
+    def vacated_tail(self, snake):
+        # The tail cell frees up on the next move, unless it is doubled up after eating
+        positions = snake.get_positions()
+        if positions[-1] == positions[-2]:
+            return -1
+        return self.cell(positions[-1])
+
+    def roomiest_move(self, head, counts, tail):
+        # Last resort: the free neighbour with the most space behind it
+        best = False
+        best_room = -1
+        for direction, cell in self.neighbours[head]:
+            if counts[cell] and cell != tail:
+                continue
+            room = self.search(cell, -1, counts, tail, head)
+            if room > best_room:
+                best = direction
+                best_room = room
+        return best
+
+
+class BFSAgent(Agent):
+    """Takes the shortest path to the nearest apple when the snake could still reach its own tail
+    once it has eaten there, otherwise stalls along a safe way back to its tail, otherwise heads
+    for the most open space.
+
+    While stalling it prefers the cells it has been on least since it last ate, so the body
+    keeps changing shape instead of chasing its tail round the same loop for ever.
+    """
+
+    def prepare(self, width, height):
+        super().prepare(width, height)
+        self.visits = [0] * (width * height)
+        self.length = 0
+
+    def decide(self, game, player):
+        snake = game.get_snake(player - 1) if isinstance(game, MultiPlayerGame) else game.get_snake()
+        counts = game.board.counts
+        head = self.cell(snake.get_head_position())
+        vacated = self.vacated_tail(snake)
+        apple = self.cell(game.nearest_apple(snake.get_head_position()).get_position())
+        if snake.get_length() != self.length:
+            self.length = snake.get_length()
+            self.visits = [0] * len(self.visits)
+        visits = self.visits
+        visits[head] += 1
+
+        step = self.search(head, apple, counts, vacated)
+        if step != -1 and self.safe_to_eat(snake, self.path(head, apple), counts):
+            return self.direction_to(head, step)
+
+        # Stall for time: take the least visited safe move, then the one leaving the longest
+        # way back to the tail, which changes the body's shape until the apple is safe to go for
+        best = False
+        best_visits = 0
+        best_distance = -1
+        for direction, cell in self.neighbours[head]:
+            if counts[cell] and cell != vacated:
+                continue
+            distance = self.tail_distance(snake, cell, counts, vacated)
+            if distance == -1:
+                continue
+            if not best or visits[cell] < best_visits or (visits[cell] == best_visits and distance > best_distance):
+                best = direction
+                best_visits = visits[cell]
+                best_distance = distance
+        if best:
+            return best
+
+        return self.roomiest_move(head, counts, vacated)
+
+    def safe_to_eat(self, snake, path, counts):
+        """Whether, after following path to the apple at its end, the snake could still reach
+        its tail, with the body where it would be by then."""
+        body = [self.cell(pos) for pos in snake.get_positions()]
+        length = len(body)
+        # Head first, as the body will be: the path backwards and then what is left of the old
+        # body, the last segment doubled up by eating
+        moved = path[::-1] + body
+        new_head = moved[0]
+        new_tail = moved[length - 1]
+        if new_tail == new_head:
+            return True
+        virtual = self.load_counts(counts)
+        for cell in body:
+            virtual[cell] -= 1
+        for cell in moved[:length]:
+            virtual[cell] += 1
+        return self.search(new_head, new_tail, virtual) != -1
+
+    def tail_distance(self, snake, step, counts, vacated):
+        # Length of the shortest path from step to where the tail will be after moving
+        # there, or -1 if the snake would cut itself off from its tail
+        new_tail = self.cell(snake.get_positions()[-2])
+        if new_tail == step:
+            return 0
+        if self.search(step, new_tail, counts, vacated, -1) == -1:
+            return -1
+        return self.found_depth
+
+
+class HamiltonianAgent(Agent):
+    """Follows a Hamiltonian cycle of the board, cutting ahead along it towards the nearest apple
+    when the jump stays clear of the snake's own tail.
+
+    Boards with an odd width and height have no such cycle; BFSAgent is used on those.
+    """
+
+    def __init__(self, margin=3):
+        super().__init__()
+        self.margin = margin
+        self.fallback = BFSAgent()
+
+    def prepare(self, width, height):
+        super().prepare(width, height)
+        self.order = build_cycle(width, height)
+        self.index = [0] * (width * height)
+        if self.order is not None:
+            for i, cell in enumerate(self.order):
+                self.index[cell] = i
+
+    def distance(self, a, b):
+        # Steps from a to b going forward along the cycle
+        return (self.index[b] - self.index[a]) % len(self.order)
+
+    def decide(self, game, player):
+        if self.order is None:
+            return self.fallback(game, player)
+
+        snake = game.get_snake(player - 1) if isinstance(game, MultiPlayerGame) else game.get_snake()
+        counts = game.board.counts
+        area = len(self.order)
+        head = self.cell(snake.get_head_position())
+        tail = self.cell(snake.get_tail_position())
+        apple = self.cell(game.nearest_apple(snake.get_head_position()).get_position())
+
+        following = self.order[(self.index[head] + 1) % area]
+        if snake.get_length() < area // 2:
+            # The body lies behind the head along the cycle, so any cell ahead of the head and
+            # short of the tail is free to jump to
+            room = self.distance(head, tail) - self.margin
+            best = -1
+            best_distance = area
+            for _, cell in self.neighbours[head]:
+                if counts[cell] or self.distance(head, cell) >= room:
+                    continue
+                to_apple = self.distance(cell, apple)
+                if to_apple < best_distance:
+                    best = cell
+                    best_distance = to_apple
+            if best != -1:
+                return self.direction_to(head, best)
+
+        if not counts[following] or following == tail:
+            return self.direction_to(head, following)
+        return self.roomiest_move(head, counts, self.vacated_tail(snake))
+
+
+def build_cycle(width, height):
+    """Cells of a Hamiltonian cycle of the board in order, or None if there is none."""
+    if width < 2 or height < 2:
+        return None
+    if height % 2 == 0:
+        # Zig-zag through columns 1.. row by row, then come back up column 0
+        order = []
+        for y in range(height):
+            columns = range(1, width) if y % 2 == 0 else range(width - 1, 0, -1)
+            order.extend(y * width + x for x in columns)
+        order.extend(y * width for y in range(height - 1, -1, -1))
+        return order
+    if width % 2 == 0:
+        transposed = build_cycle(height, width)
+        return [(cell % height) * width + cell // height for cell in transposed]
+    return None
+
+
+def bfs_policy(rng):
+    return BFSAgent()
+
+
+def hamiltonian_policy(rng):
+    return HamiltonianAgent()
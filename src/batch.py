@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""batch.py: Runs many single player games in lockstep on NumPy arrays"""
+
+import numpy as np
+
+from observe import APPLE, OWN_BODY, OWN_HEAD
+from snake import Direction, NO_DIRECTION
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+# Indexed by Direction.value
+DX = np.array([0, 0, -1, 1], dtype=np.int32)
+DY = np.array([-1, 1, 0, 0], dtype=np.int32)
+OPPOSITE = np.array([1, 0, 3, 2], dtype=np.int8)
+
+
+class BatchSinglePlayerGame:
+    """N copies of SinglePlayerGame advanced together by step().
+
+    Every board keeps the snake as a ring buffer of packed cells (y * width + x) with the
+    head at head_ptr, plus a grid counting how many segments sit on each cell. A tick
+    only touches the new head, the old tail and the apple, so the cost does not depend
+    on the length of the snakes.
+    """
+
+    def __init__(self, n, width, height, seed=None):
+        self.n = n
+        self.width = width
+        self.height = height
+        self.area = width * height
+        # The tail is duplicated for one tick after eating, so a full board needs area + 1 slots
+        self.capacity = self.area + 1
+
+        self.rng = np.random.default_rng(seed)
+
+        self.body = np.zeros((n, self.capacity), dtype=np.int32)
+        self.head_ptr = np.zeros(n, dtype=np.int64)
+        self.length = np.zeros(n, dtype=np.int64)
+        self.head_x = np.zeros(n, dtype=np.int32)
+        self.head_y = np.zeros(n, dtype=np.int32)
+        self.grid = np.zeros((n, self.area), dtype=np.int16)
+        self.apple = np.zeros(n, dtype=np.int32)
+        self.apple_triggered = np.zeros(n, dtype=bool)
+        self.last_direction = np.zeros(n, dtype=np.int8)
+        self.alive = np.zeros(n, dtype=bool)
+        self.won = np.zeros(n, dtype=bool)
+        self.rows = np.arange(n)
+
+        self.reset()
+
+    def reset(self, indices=None):
+        if indices is None:
+            indices = np.arange(self.n)
+        else:
+            indices = np.asarray(indices)
+            if indices.dtype == bool:
+                indices = np.flatnonzero(indices)
+        if len(indices) == 0:
+            return
+
+        # Same starting position as snake.Snake: head first, body trailing to the right
+        startx = int(self.width / 2)
+        starty = int(self.height / 2)
+        start = [starty * self.width + startx + i for i in (2, 1, 0)]
+
+        self.body[indices] = 0
+        self.body[indices, :3] = start
+        self.head_ptr[indices] = 2
+        self.length[indices] = 3
+        self.head_x[indices] = startx
+        self.head_y[indices] = starty
+        self.grid[indices] = 0
+        for cell in start:
+            self.grid[indices, cell] += 1
+        self.apple_triggered[indices] = False
+        self.last_direction[indices] = Direction.LEFT.value
+        self.alive[indices] = True
+        self.won[indices] = False
+
+        self.place_apples(indices)
+
+    def place_apples(self, indices):
+        # Uniform choice among the free cells of every board in indices
+        free = self.grid[indices] == 0
+        counts = free.sum(axis=1)
+        full = counts == 0
+        if full.any():
+            self.won[indices[full]] = True
+            indices = indices[~full]
+            free = free[~full]
+            counts = counts[~full]
+        if len(indices) == 0:
+            return
+        picks = (self.rng.random(len(indices)) * counts).astype(np.int64)
+        self.apple[indices] = (free.cumsum(axis=1) > picks[:, None]).argmax(axis=1)
+
+    def set_apple(self, index, x, y):
+        self.apple[index] = y * self.width + x
+
+    def step(self, directions):
+        """Advance every running board by one tick.
+
+        directions holds one Direction value per board, or NO_DIRECTION to keep
+        going the same way. Any other value, like the -1 that stood for no input
+        before, is taken as no input too. Returns the alive flags.
+        """
+        idx = np.flatnonzero(self.alive & ~self.won)
+        if len(idx) == 0:
+            return self.alive
+
+        # Reverse moves and missing input keep the last direction
+        wanted = np.asarray(directions)[idx]
+        last = self.last_direction[idx]
+        accepted = (wanted >= 0) & (wanted < NO_DIRECTION) & (wanted != OPPOSITE[last])
+        current = np.where(accepted, wanted, last).astype(np.int8)
+        self.last_direction[idx] = current
+
+        # Drop the tail
+        length = self.length[idx]
+        tail_slot = (self.head_ptr[idx] - length + 1) % self.capacity
+        self.grid[idx, self.body[idx, tail_slot]] -= 1
+
+        # Grow on the tick after eating by duplicating the new tail, like Snake.update
+        grow = self.apple_triggered[idx]
+        if grow.any():
+            rows = idx[grow]
+            slots = tail_slot[grow]
+            new_tail = self.body[rows, (slots + 1) % self.capacity]
+            self.body[rows, slots] = new_tail
+            self.grid[rows, new_tail] += 1
+            self.length[rows] += 1
+
+        # Move the head
+        x = self.head_x[idx] + DX[current]
+        y = self.head_y[idx] + DY[current]
+        self.head_x[idx] = x
+        self.head_y[idx] = y
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        cell = np.where(inside, y * self.width + x, 0)
+
+        head_ptr = (self.head_ptr[idx] + 1) % self.capacity
+        self.head_ptr[idx] = head_ptr
+        self.body[idx, head_ptr] = np.where(inside, cell, -1)
+
+        suicide = inside & (self.grid[idx, cell] > 0)
+        on_board = idx[inside]
+        self.grid[on_board, cell[inside]] += 1
+
+        triggered = inside & (self.apple[idx] == cell)
+        self.apple_triggered[idx] = triggered
+        if triggered.any():
+            self.place_apples(idx[triggered])
+
+        self.alive[idx] = inside & ~suicide
+        return self.alive
+
+    def observe(self, out):
+        """Fill out, shaped (n, observe.CHANNELS, height, width), for every board at once."""
+        out.fill(0)
+        planes = out.reshape(self.n, out.shape[1], self.area)
+        np.greater(self.grid, 0, out=planes[:, OWN_BODY])
+        inside = (self.head_x >= 0) & (self.head_x < self.width) & (self.head_y >= 0) & (self.head_y < self.height)
+        heads = (self.head_y * self.width + self.head_x)[inside]
+        planes[self.rows[inside], OWN_HEAD, heads] = 1
+        planes[self.rows, APPLE, self.apple] = 1
+
+    def get_length(self):
+        return self.length.copy()
+
+    def get_apple(self, index):
+        apple = int(self.apple[index])
+        return apple % self.width, apple // self.width
+
+    def get_coords(self, index):
+        # Head first, matching [segment.get_position() for segment in snake.get_coords()]
+        coords = []
+        ptr = int(self.head_ptr[index])
+        for i in range(int(self.length[index])):
+            if i == 0:
+                coords.append((int(self.head_x[index]), int(self.head_y[index])))
+                continue
+            cell = int(self.body[index, (ptr - i) % self.capacity])
+            coords.append((cell % self.width, cell // self.width))
+        return coords
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+"""bench.py: Reproducible benchmarks for the game engine, apple placement, rendering and agents
+
+Usage: python bench.py --out results.json
+       python bench.py --compare results.json
+
+Every benchmark is timed several times and the median is kept. Results are written as JSON
+so runs from different commits can be compared; --compare reruns the suite and reports any
+metric that got worse by more than --threshold, exiting with status 1 if there was one.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from snake import *
+import agents
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+SEED = 1
+
+BOARD_SIZES = [(10, 10), (20, 20), (40, 40)]
+# Snake lengths as fractions of the board; 0 means the starting length of 3
+LENGTHS = [0, 0.25, 0.5]
+FILLS = [0.1, 0.25, 0.5, 0.75, 0.9, 0.95]
+# Boards need an even side for the Hamiltonian cycle the snakes follow
+RENDER_SIZES = [(16, 16), (30, 20), (60, 40)]
+# Big arenas, which use a SparseBoard, and how many snakes roam them
+ARENAS = [(1000, 1000, 100), (10000, 10000, 300)]
+# Side of the square every arena snake goes round
+ARENA_LOOP = 10
+
+# Whether a higher value of a metric is better, for --compare
+HIGHER_IS_BETTER = {
+    "ticks_per_second": True,
+    "ns_per_call": False,
+    "ms_per_frame": False,
+    "us_per_decision": False,
+}
+
+
+def cycle_directions(width, height):
+    """The Hamiltonian cycle of the board from agents.build_cycle, and the Direction that
+    leads from each cell to the next one along it. A snake laid on the cycle and steered
+    along it never dies, whatever its length, so it gives steady long-snake workloads."""
+    order = agents.build_cycle(width, height)
+    if order is None:
+        raise ValueError("No Hamiltonian cycle on a " + str(width) + "x" + str(height) + " board")
+    steps = {(dx, dy): direction for direction, (dx, dy) in MOVES.items()}
+    directions = [None] * (width * height)
+    for i, cell in enumerate(order):
+        following = order[(i + 1) % len(order)]
+        directions[cell] = steps[following % width - cell % width, following // width - cell // width]
+    return order, directions
+
+
+def snake_on_cycle(order, width, start, length):
+    # Head at order[start], the rest of the body trailing behind it along the cycle
+    positions = []
+    for i in range(length):
+        cell = order[(start - i) % len(order)]
+        positions.append((cell % width, cell // width))
+    return positions
+
+
+def game_state(width, height, snakes):
+    """GameState with the given (positions, direction) snakes and the apple on a free cell."""
+    board = Board(width, height)
+    for positions, _ in snakes:
+        for pos in positions:
+            board.occupy(pos)
+    apple = board.random_free(random.Random(SEED)) or (0, 0)
+    snake_states = []
+    for positions, direction in snakes:
+        body = tuple(y * width + x for x, y in positions[1:])
+        snake_states.append(SnakeState(positions[0], body, direction.value, False, True))
+    return GameState(width, height, tuple(snake_states), (apple,), False, None, board.free_order())
+
+
+def lay_snakes(game, order, directions, lengths):
+    # Spread the snakes evenly around the cycle and restore the game to that position
+    snakes = []
+    for i, length in enumerate(lengths):
+        start = (len(order) * i // len(lengths) + length - 1) % len(order)
+        positions = snake_on_cycle(order, game.width, start, length)
+        neck = order[(start - 1) % len(order)]
+        snakes.append((positions, directions[neck]))
+    state = game_state(game.width, game.height, snakes)
+    game.restore(state)
+    return state
+
+
+def snake_length(fraction, width, height):
+    return max(3, int(width * height * fraction))
+
+
+def median_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_single_update(width, height, length, ticks, repeat):
+    order, directions = cycle_directions(width, height)
+    game = SinglePlayerGame(width, height, SEED)
+    state = lay_snakes(game, order, directions, [length])
+    snake = game.get_snake()
+
+    def run():
+        game.restore(state)
+        for _ in range(ticks):
+            x, y = snake.get_head_position()
+            if not game.update(directions[y * width + x]):
+                game.restore(state)
+
+    return {"ticks_per_second": ticks / median_time(run, repeat)}
+
+
+def bench_two_player_update(width, height, length, ticks, repeat):
+    order, directions = cycle_directions(width, height)
+    game = TwoPlayerGame(width, height, SEED)
+    state = lay_snakes(game, order, directions, [length, length])
+    snake_1 = game.get_snake_1()
+    snake_2 = game.get_snake_2()
+
+    def run():
+        game.restore(state)
+        for _ in range(ticks):
+            x_1, y_1 = snake_1.get_head_position()
+            x_2, y_2 = snake_2.get_head_position()
+            if not game.update(directions[y_1 * width + x_1], directions[y_2 * width + x_2]):
+                game.restore(state)
+
+    return {"ticks_per_second": ticks / median_time(run, repeat)}
+
+
+def bench_arena_update(width, height, n_players, ticks, repeat):
+    # Every snake goes round its own small square, far from the others, so none of them die
+    loop = []
+    for direction in (Direction.UP, Direction.RIGHT, Direction.DOWN, Direction.LEFT):
+        loop.extend([[direction] * n_players] * ARENA_LOOP)
+    game = MultiPlayerGame(width, height, n_players, SEED)
+    state = game.snapshot()
+
+    def run():
+        game.restore(state)
+        for tick in range(ticks):
+            game.update(loop[tick % len(loop)])
+
+    return {"ticks_per_second": ticks / median_time(run, repeat)}
+
+
+def bench_apple(width, height, fill, calls, repeat):
+    order, directions = cycle_directions(width, height)
+    game = SinglePlayerGame(width, height, SEED)
+    lay_snakes(game, order, directions, [snake_length(fill, width, height)])
+
+    def run():
+        for _ in range(calls):
+            game.generate_apple_coords()
+
+    return {"ns_per_call": median_time(run, repeat) / calls * 1e9}
+
+
+def bench_render(width, height, incremental, frames, repeat):
+    # Imported here so the engine benchmarks run without pygame or a display
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import ui
+
+    grid = ui.GridUI(width, height, 10, 1, 5, 0, incremental=incremental)
+    order, directions = cycle_directions(width, height)
+    game = SinglePlayerGame(width, height, SEED)
+    state = lay_snakes(game, order, directions, [snake_length(0.25, width, height)])
+    snake = game.get_snake()
+    snakes = [(snake, ui.SNAKE_COLOR)]
+
+    def run():
+        game.restore(state)
+        grid.needs_redraw = True
+        for _ in range(frames):
+            rects = grid.draw_board(snakes, game.food)
+            grid.mark_dirty(snakes, game.food)
+            x, y = snake.get_head_position()
+            if not game.update(directions[y * width + x]):
+                game.restore(state)
+                grid.needs_redraw = True
+            grid.mark_dirty(snakes, game.food)
+            grid.show(rects)
+
+    return {"ms_per_frame": median_time(run, repeat) / frames * 1e3}
+
+
+def bench_agent(name, width, height, games, max_ticks):
+    agent = agents.BFSAgent() if name == "bfs" else agents.HamiltonianAgent()
+    for i in range(games):
+        game = SinglePlayerGame(width, height, SEED + i)
+        for _ in range(max_ticks):
+            if not game.update(agent(game, 1)):
+                break
+    return {"us_per_decision": agent.mean_latency() * 1e6, "decisions": agent.decisions}
+
+
+def run_suite(quick=False, render=True):
+    scale = 10 if quick else 1
+    repeat = 3 if quick else 5
+    results = {}
+
+    def record(name, result):
+        results[name] = result
+        print(name, " ".join("{}={:.4g}".format(key, value) for key, value in sorted(result.items())))
+        sys.stdout.flush()
+
+    for width, height in BOARD_SIZES:
+        for fraction in LENGTHS:
+            length = snake_length(fraction, width, height)
+            record("single_update/{}x{}/len{}".format(width, height, length),
+                   bench_single_update(width, height, length, 20000 // scale, repeat))
+            # Two snakes share the same fraction of the board
+            length = snake_length(fraction / 2, width, height)
+            record("two_player_update/{}x{}/len{}x2".format(width, height, length),
+                   bench_two_player_update(width, height, length, 20000 // scale, repeat))
+
+    for width, height, n_players in ARENAS:
+        record("arena_update/{}x{}/{}snakes".format(width, height, n_players),
+               bench_arena_update(width, height, n_players, 2000 // scale, repeat))
+
+    for fill in FILLS:
+        record("apple/40x40/fill{}".format(int(fill * 100)), bench_apple(40, 40, fill, 20000 // scale, repeat))
+
+    if render:
+        for width, height in RENDER_SIZES:
+            for incremental in (True, False):
+                mode = "incremental" if incremental else "full"
+                record("render/{}x{}/{}".format(width, height, mode),
+                       bench_render(width, height, incremental, 500 // scale, repeat))
+
+    for name in ("bfs", "hamiltonian"):
+        record("agent/" + name + "/16x16", bench_agent(name, 16, 16, 5 if quick else 20, 2000))
+
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(baseline, results, threshold):
+    """Print how every metric moved against the baseline; returns the regressed names."""
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric, value in sorted(results[name].items()):
+            if metric not in HIGHER_IS_BETTER or metric not in baseline[name]:
+                continue
+            old = baseline[name][metric]
+            if not old:
+                continue
+            change = (value - old) / old
+            worse = -change if HIGHER_IS_BETTER[metric] else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(name + " " + metric)
+            print("{:45} {:18} {:12.4g} -> {:12.4g} {:+7.1f}%{}".format(name, metric, old, value, change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the snake engine and UI")
+    parser.add_argument("--out", metavar="PATH", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare against results saved with --out")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown counted as a regression, default 0.1")
+    parser.add_argument("--quick", action="store_true", help="fewer ticks and repeats, for a smoke test")
+    parser.add_argument("--no-render", action="store_true", help="skip the pygame benchmarks")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.quick, not args.no_render)
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump({"meta": metadata(), "results": results}, file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print()
+        print("Compared with " + str(baseline["meta"].get("commit")) + ":")
+        regressions = compare(baseline["results"], results, args.threshold)
+        if regressions:
+            print(str(len(regressions)) + " regression(s)")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""delta.py: Compact binary encoding of the events games report every tick
+
+A game's subscribers are called after every update with a list of events, tuples of
+(kind, player, x, y) with players, and apples, counting from 0:
+
+    HEAD   the snake moved its head to (x, y)
+    TAIL   the segment at (x, y) dropped off the end of the snake
+    GROW   the snake grew by doubling up its last segment, at (x, y)
+    DEATH  the snake died with its head at (x, y), and left the board in multiplayer games
+    APPLE  apple number player, its index in Food.items, moved to (x, y)
+
+Events apply in the order given. A tick encodes as its number and event count followed by
+7 bytes per event, so it costs the same however long the snakes are. The player field is
+16 bits wide, so APPLE events can number as many apples as a state holds. Consumers start from
+a full state, sent once, and apply ticks to a Mirror of the game. All values are
+little-endian and positions are signed, since a dead snake's head can be off the board.
+"""
+
+from array import array
+from collections import deque
+from itertools import chain
+import struct
+import sys
+
+from snake import *
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+# encode_tick packs these in one call, one "BHhh" per event
+TICK = struct.Struct("<IH")
+EVENT = struct.Struct("<BHhh")
+# width, height, players and apples, then every apple's x and y, then per snake: alive and
+# length followed by its positions
+STATE = struct.Struct("<HHBH")
+SNAKE = struct.Struct("<BI")
+
+
+def encode_tick(tick, events):
+    return struct.pack("<IH" + "BHhh" * len(events), tick, len(events), *chain.from_iterable(events))
+
+
+def decode_tick(buffer, offset=0):
+    """Returns the tick number, its events and the offset just after it."""
+    tick, count = TICK.unpack_from(buffer, offset)
+    offset += TICK.size
+    events = list(EVENT.iter_unpack(buffer[offset:offset + EVENT.size * count]))
+    return tick, events, offset + EVENT.size * count
+
+
+def encode_state(game):
+    snakes = game.get_snakes()
+    alive = [game.is_alive()] if isinstance(game, SinglePlayerGame) else game.alive
+    apples = game.get_apples()
+    parts = [STATE.pack(game.width, game.height, len(snakes), len(apples)),
+             encode_positions(apple.get_position() for apple in apples)]
+    for snake, snake_alive in zip(snakes, alive):
+        parts.append(SNAKE.pack(snake_alive, snake.get_length()))
+        parts.append(encode_positions(snake.get_positions()))
+    return b"".join(parts)
+
+
+def encode_positions(positions):
+    coordinates = array("h")
+    for x, y in positions:
+        coordinates.append(x)
+        coordinates.append(y)
+    if sys.byteorder == "big":
+        coordinates.byteswap()
+    return coordinates.tobytes()
+
+
+def decode_positions(buffer, offset, count):
+    coordinates = array("h", bytes(buffer[offset:offset + 4 * count]))
+    if sys.byteorder == "big":
+        coordinates.byteswap()
+    return [(coordinates[i], coordinates[i + 1]) for i in range(0, len(coordinates), 2)]
+
+
+def decode_state(buffer, offset=0):
+    """Returns a Mirror of the encoded game and the offset just after it."""
+    width, height, players, count = STATE.unpack_from(buffer, offset)
+    offset += STATE.size
+    apples = decode_positions(buffer, offset, count)
+    offset += 4 * count
+    snakes = []
+    alive = []
+    for _ in range(players):
+        snake_alive, length = SNAKE.unpack_from(buffer, offset)
+        offset += SNAKE.size
+        snakes.append(decode_positions(buffer, offset, length))
+        offset += 4 * length
+        alive.append(bool(snake_alive))
+    return Mirror(width, height, snakes, alive, apples), offset
+
+
+class Mirror:
+    """A copy of a game's snakes and apples kept up to date from its events, with the same
+    head to tail order as Snake.get_positions() and apples in the order of Food.items."""
+
+    def __init__(self, width, height, snakes, alive, apples):
+        self.width = width
+        self.height = height
+        self.snakes = [deque(positions) for positions in snakes]
+        self.alive = list(alive)
+        self.apples = list(apples)
+        # Segments on each cell, counting only snakes still on the board
+        self.counts = {}
+        for snake, snake_alive in zip(self.snakes, self.alive):
+            if snake_alive:
+                for pos in snake:
+                    self.add(pos)
+
+    def add(self, pos):
+        self.counts[pos] = self.counts.get(pos, 0) + 1
+
+    def remove(self, pos):
+        count = self.counts[pos] - 1
+        if count:
+            self.counts[pos] = count
+        else:
+            del self.counts[pos]
+
+    def apply(self, events):
+        for kind, player, x, y in events:
+            if kind == HEAD:
+                self.snakes[player].appendleft((x, y))
+                self.add((x, y))
+            elif kind == TAIL:
+                self.remove(self.snakes[player].pop())
+            elif kind == GROW:
+                self.snakes[player].append((x, y))
+                self.add((x, y))
+            elif kind == DEATH:
+                self.alive[player] = False
+                for pos in self.snakes[player]:
+                    self.remove(pos)
+            elif kind == APPLE:
+                self.apples[player] = (x, y)
+
+    def is_free(self, pos):
+        x, y = pos
+        return 0 <= x < self.width and 0 <= y < self.height and pos not in self.counts
+
+
+class EventBuffer:
+    """Subscriber that keeps the events of every tick until they are drained.
+
+    game.subscribe(buffer), then iterate over buffer.drain() for (tick, events) pairs.
+    """
+
+    def __init__(self):
+        self.tick = 0
+        self.pending = []
+
+    def __call__(self, events):
+        self.tick += 1
+        self.pending.append((self.tick, events))
+
+    def drain(self):
+        pending = self.pending
+        self.pending = []
+        for tick, events in pending:
+            yield tick, events
+
+    def encoded(self):
+        # The drained ticks, encoded back to back
+        return b"".join(encode_tick(tick, events) for tick, events in self.drain())
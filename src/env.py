@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+
+"""env.py: Gym-style reset()/step() environments for training agents
+
+SnakeEnv wraps SinglePlayerGame, or a TwoPlayerGame against a sim.py policy, and follows the
+Gymnasium conventions: reset() returns (observation, info) and step(action) returns
+(observation, reward, terminated, truncated, info). Actions are Direction values, 0 to 3, or
+NO_DIRECTION to keep going straight. Observations are the observe.py board planes, paired with
+the ray features when rays=True, and are written in place, so the arrays a step returns are
+overwritten by the next one.
+
+VectorEnv steps many environments in this process and SubprocVectorEnv spreads them over
+worker processes. Both reset an environment as soon as its episode ends and hand back
+every array from one shared block of memory, so nothing is pickled or allocated per step.
+
+Usage: python env.py --envs 256 --workers 8 --steps 1000
+"""
+
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+import random
+import time
+
+import numpy as np
+
+from snake import *
+import observe
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+ACTIONS = 4
+
+# Commands sent to SubprocVectorEnv workers; everything else goes through shared memory
+STEP = b"s"
+RESET = b"r"
+RESEED = b"R"
+CLOSE = b"c"
+
+
+class Rewards:
+    """Reward shaping, the sum of every term that applies to a step:
+
+        apple     for eating the apple
+        death     for dying, including head-on collisions
+        win       for filling the board, or outliving the opponent
+        step      on every step, a small negative value discourages stalling
+        approach  per cell the head moved towards the apple, taken away when it moves away
+
+    The defaults match farm.reward_value.
+    """
+
+    def __init__(self, apple=1.0, death=-1.0, win=0.0, step=0.0, approach=0.0):
+        self.apple = apple
+        self.death = death
+        self.win = win
+        self.step = step
+        self.approach = approach
+
+    def __call__(self, ate, alive, won, closer):
+        reward = self.step
+        if ate:
+            reward += self.apple
+        if not alive:
+            reward += self.death
+        elif won:
+            reward += self.win
+        if self.approach and alive:
+            reward += self.approach * closer
+        return reward
+
+
+class SnakeEnv:
+    """One snake game behind reset() and step().
+
+    With opponent, the name of a sim.py policy, the agent plays player 1 of a TwoPlayerGame
+    against it. Episodes are truncated after max_steps steps, or after max_idle steps without
+    eating; either can be None. board and rays are the arrays observations are written to,
+    allocated here unless given.
+    """
+
+    def __init__(self, width=15, height=15, opponent=None, rewards=None, max_steps=None, max_idle=None,
+                 rays=False, seed=None, dtype=np.float32, board=None, ray_out=None):
+        self.width = width
+        self.height = height
+        self.opponent_name = opponent
+        self.rewards = rewards or Rewards()
+        self.max_steps = max_steps
+        self.max_idle = max_idle
+
+        self.observation_shape = (observe.CHANNELS, height, width)
+        self.board = np.zeros(self.observation_shape, dtype) if board is None else board
+        if rays:
+            self.rays = np.zeros(observe.RAYS, np.float32) if ray_out is None else ray_out
+            self.observation = (self.board, self.rays)
+        else:
+            self.rays = None
+            self.observation = self.board
+
+        self.rng = random.Random(seed)
+        self.opponent = None
+        self.game = None
+        # The game as first constructed; later episodes restore it instead of building a new one
+        self.start = None
+        self.steps = 0
+        self.idle = 0
+        self.episode_return = 0.0
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.rng.seed(seed)
+            self.opponent = None
+        if self.opponent_name and self.opponent is None:
+            self.opponent = sim.make_policy(self.opponent_name, random.Random(self.rng.randrange(1 << 63)))
+        self.new_game(seed is not None)
+        self.steps = 0
+        self.idle = 0
+        self.episode_return = 0.0
+        self.game.observe(self.board, 1, self.rays)
+        return self.observation, self.info()
+
+    def new_game(self, reseed):
+        # Seeding a generator costs more than the rest of a reset, so the game's RNG carries
+        # on from one episode to the next and is only seeded again when reset() is given a seed
+        game = self.game
+        if game is None or reseed:
+            if self.opponent_name:
+                self.game = TwoPlayerGame(self.width, self.height, self.rng.randrange(1 << 63))
+            else:
+                self.game = SinglePlayerGame(self.width, self.height, self.rng.randrange(1 << 63))
+            self.start = self.game.snapshot(rng=False)
+            return
+        game.restore(self.start)
+        apple_x, apple_y = game.generate_apple_coords()
+        game.apple.set_position(apple_x, apple_y)
+
+    def step(self, action):
+        reward, terminated, truncated = self.advance(action)
+        return self.observation, reward, terminated, truncated, self.info()
+
+    def advance(self, action):
+        """step() without building the info dict; returns reward, terminated and truncated."""
+        game = self.game
+        snake = self.snake()
+        head_x, head_y = snake.get_head_position()
+        apple_x, apple_y = game.apple.get_position()
+        direction = unpack_direction(action)
+
+        if self.opponent is None:
+            running = game.update(direction)
+            ate = game.apple_triggered
+            alive = game.alive
+            won = game.won
+        else:
+            running = game.update(direction, self.opponent(game, 2))
+            ate = game.apple_triggered[0]
+            alive = game.alive[0]
+            won = alive and not running
+
+        x, y = snake.get_head_position()
+        closer = abs(head_x - apple_x) + abs(head_y - apple_y) - abs(x - apple_x) - abs(y - apple_y)
+        reward = self.rewards(ate, alive, won, closer)
+        self.episode_return += reward
+        self.steps += 1
+        self.idle = 0 if ate else self.idle + 1
+
+        terminated = not running
+        truncated = not terminated and ((self.max_steps is not None and self.steps >= self.max_steps) or
+                                        (self.max_idle is not None and self.idle >= self.max_idle))
+        game.observe(self.board, 1, self.rays)
+        return reward, terminated, truncated
+
+    def snake(self):
+        return self.game.get_snake() if self.opponent is None else self.game.snakes[0]
+
+    def info(self):
+        return {"length": self.snake().get_length(), "steps": self.steps, "episode_return": self.episode_return}
+
+
+def layout(n, shape, rays, dtype):
+    """(name, shape, dtype, offset) of every array a vector env shares, and the total size.
+    Each array starts on an 8 byte boundary."""
+    fields = [
+        ("actions", (n,), np.int8),
+        ("board", (n,) + shape, dtype),
+        ("final_board", (n,) + shape, dtype),
+        ("rewards", (n,), np.float32),
+        ("terminated", (n,), np.bool_),
+        ("truncated", (n,), np.bool_),
+        ("episode_return", (n,), np.float32),
+        ("episode_length", (n,), np.int32),
+        ("seeds", (n,), np.uint64),
+    ]
+    if rays:
+        fields += [("rays", (n, observe.RAYS), np.float32), ("final_rays", (n, observe.RAYS), np.float32)]
+    placed = []
+    offset = 0
+    for name, field_shape, field_dtype in fields:
+        placed.append((name, field_shape, field_dtype, offset))
+        size = int(np.prod(field_shape)) * np.dtype(field_dtype).itemsize
+        offset += (size + 7) // 8 * 8
+    return placed, offset
+
+
+class Buffers:
+    """The arrays of a vector env, laid out by layout() over buffer, or over new memory.
+
+    Row i belongs to environment i. After a step that ended its episode, final_board (and
+    final_rays) hold the last observation of that episode, episode_return and
+    episode_length its totals, and board already shows the next episode.
+    """
+
+    def __init__(self, n, shape, rays=False, dtype=np.float32, buffer=None):
+        fields, size = layout(n, shape, rays, dtype)
+        if buffer is None:
+            buffer = bytearray(size)
+        self.rays = None
+        self.final_rays = None
+        for name, field_shape, field_dtype, offset in fields:
+            setattr(self, name, np.ndarray(field_shape, field_dtype, buffer, offset))
+
+        self.observation = self.board if self.rays is None else (self.board, self.rays)
+        self.info = {
+            "final_observation": self.final_board if self.rays is None else (self.final_board, self.final_rays),
+            "episode_return": self.episode_return,
+            "episode_length": self.episode_length,
+        }
+
+
+def make_envs(buffers, start, stop, seeds, kwargs):
+    # Environments start..stop, writing their observations straight into the buffers
+    rays = buffers.rays is not None
+    envs = []
+    for i in range(start, stop):
+        envs.append(SnakeEnv(seed=seeds[i], rays=rays, board=buffers.board[i],
+                             ray_out=buffers.rays[i] if rays else None, **kwargs))
+    return envs
+
+
+def reset_envs(envs, buffers, start, reseed=False):
+    for i, env in enumerate(envs, start):
+        env.reset(int(buffers.seeds[i]) if reseed else None)
+    buffers.rewards[start:start + len(envs)] = 0
+    buffers.terminated[start:start + len(envs)] = False
+    buffers.truncated[start:start + len(envs)] = False
+
+
+def step_envs(envs, buffers, start):
+    """Step envs, rows start onwards of buffers, resetting any whose episode ends."""
+    stop = start + len(envs)
+    rewards = buffers.rewards
+    terminated = buffers.terminated
+    truncated = buffers.truncated
+    for i, env, action in zip(range(start, stop), envs, buffers.actions[start:stop].tolist()):
+        reward, done, cut = env.advance(action)
+        rewards[i] = reward
+        terminated[i] = done
+        truncated[i] = cut
+        if done or cut:
+            buffers.final_board[i] = env.board
+            if env.rays is not None:
+                buffers.final_rays[i] = env.rays
+            buffers.episode_return[i] = env.episode_return
+            buffers.episode_length[i] = env.steps
+            env.reset()
+
+
+class VectorEnv:
+    """n SnakeEnvs stepped one after another in this process, taking and returning arrays
+    with one row per environment. Keyword arguments are passed on to every SnakeEnv."""
+
+    def __init__(self, n, seed=None, rays=False, dtype=np.float32, **kwargs):
+        self.n = n
+        self.observation_shape = (observe.CHANNELS, kwargs.get("height", 15), kwargs.get("width", 15))
+        self.buffers = Buffers(n, self.observation_shape, rays, dtype)
+        rng = random.Random(seed)
+        self.buffers.seeds[:] = [rng.randrange(1 << 63) for _ in range(n)]
+        self.envs = make_envs(self.buffers, 0, n, self.buffers.seeds.tolist(), kwargs)
+
+    def reset(self, seed=None):
+        reseed = seed is not None
+        if reseed:
+            rng = random.Random(seed)
+            self.buffers.seeds[:] = [rng.randrange(1 << 63) for _ in range(self.n)]
+        reset_envs(self.envs, self.buffers, 0, reseed)
+        return self.buffers.observation, self.buffers.info
+
+    def step(self, actions):
+        buffers = self.buffers
+        buffers.actions[:] = actions
+        step_envs(self.envs, buffers, 0)
+        return buffers.observation, buffers.rewards, buffers.terminated, buffers.truncated, buffers.info
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def worker_main(memory, n, start, stop, rays, dtype, kwargs, connection):
+    # The parent handles Ctrl-C and closes the workers itself
+    sim.ignore_interrupt()
+    shape = (observe.CHANNELS, kwargs.get("height", 15), kwargs.get("width", 15))
+    buffers = Buffers(n, shape, rays, dtype, memory.buf)
+    envs = make_envs(buffers, start, stop, buffers.seeds.tolist(), kwargs)
+    try:
+        while True:
+            command = connection.recv_bytes()
+            if command == STEP:
+                step_envs(envs, buffers, start)
+            elif command == RESET or command == RESEED:
+                reset_envs(envs, buffers, start, command == RESEED)
+            elif command == CLOSE:
+                break
+            connection.send_bytes(command)
+    finally:
+        # The arrays point into the shared memory, which can't be closed while they exist
+        del envs, buffers
+        memory.close()
+        connection.close()
+
+
+class SubprocVectorEnv(VectorEnv):
+    """VectorEnv with the environments split over worker processes.
+
+    Actions, observations, rewards and flags all live in one multiprocessing.shared_memory
+    block that every process maps; the pipes to the workers only carry one byte commands.
+    Call close(), or use the env as a context manager, to stop the workers and free the
+    memory.
+    """
+
+    def __init__(self, n, workers=None, seed=None, rays=False, dtype=np.float32, **kwargs):
+        self.n = n
+        self.workers = min(workers or multiprocessing.cpu_count(), n)
+        self.observation_shape = (observe.CHANNELS, kwargs.get("height", 15), kwargs.get("width", 15))
+        _, size = layout(n, self.observation_shape, rays, dtype)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.buffers = Buffers(n, self.observation_shape, rays, dtype, self.memory.buf)
+        rng = random.Random(seed)
+        self.buffers.seeds[:] = [rng.randrange(1 << 63) for _ in range(n)]
+
+        self.connections = []
+        self.processes = []
+        for i in range(self.workers):
+            start = n * i // self.workers
+            stop = n * (i + 1) // self.workers
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=worker_main, args=(self.memory, n, start, stop, rays, dtype, kwargs, child), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self.closed = False
+
+    def command(self, command):
+        for connection in self.connections:
+            connection.send_bytes(command)
+        for connection in self.connections:
+            connection.recv_bytes()
+
+    def reset(self, seed=None):
+        if seed is not None:
+            rng = random.Random(seed)
+            self.buffers.seeds[:] = [rng.randrange(1 << 63) for _ in range(self.n)]
+        self.command(RESET if seed is None else RESEED)
+        return self.buffers.observation, self.buffers.info
+
+    def step_async(self, actions):
+        self.buffers.actions[:] = actions
+        for connection in self.connections:
+            connection.send_bytes(STEP)
+
+    def step_wait(self):
+        for connection in self.connections:
+            connection.recv_bytes()
+        buffers = self.buffers
+        return buffers.observation, buffers.rewards, buffers.terminated, buffers.truncated, buffers.info
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for connection in self.connections:
+            try:
+                connection.send_bytes(CLOSE)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
+        self.buffers = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure vector environment throughput with random actions")
+    parser.add_argument("--envs", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, 0 to step in this process")
+    parser.add_argument("--steps", type=int, default=1000, help="vector steps to run")
+    parser.add_argument("--width", type=int, default=15)
+    parser.add_argument("--height", type=int, default=15)
+    parser.add_argument("--opponent", choices=sorted(sim.POLICIES))
+    parser.add_argument("--max-steps", type=int, default=1000)
+    parser.add_argument("--rays", action="store_true")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    kwargs = {"width": args.width, "height": args.height, "opponent": args.opponent, "max_steps": args.max_steps}
+    if args.workers:
+        env = SubprocVectorEnv(args.envs, args.workers, args.seed, args.rays, **kwargs)
+    else:
+        env = VectorEnv(args.envs, args.seed, args.rays, **kwargs)
+
+    rng = np.random.default_rng(args.seed)
+    actions = rng.integers(0, ACTIONS, size=(args.steps, args.envs), dtype=np.int8)
+    episodes = 0
+    with env:
+        env.reset(args.seed)
+        start = time.perf_counter()
+        for i in range(args.steps):
+            _, _, terminated, truncated, _ = env.step(actions[i])
+            episodes += int(np.count_nonzero(terminated | truncated))
+        elapsed = time.perf_counter() - start
+
+    steps = args.steps * args.envs
+    print("{} steps, {} episodes in {:.2f}s, {:.0f} steps/s".format(steps, episodes, elapsed, steps / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+"""export.py: Render replays and seeded games to video or image sequences, offscreen
+
+Usage: python export.py --replay games.snkr --out clips --workers 8
+       python export.py --games 20 --players 2 --policy bfs --opponent greedy --seed 1 --out clips
+       python export.py --replay games.snkr --episodes 0 3 --format png --out frames
+
+Frames are drawn by a headless GridUI, so they look the same as a live game, and repainted
+incrementally from tick to tick. A frame is a copy of the surface's pixels as they are in
+memory, 4 bytes each, and frames are handed to the writer batch_size at a time: either one
+ffmpeg process per clip, reading rawvideo in that pixel format on its stdin, or a directory
+of numbered ppm or png images. Every clip is rendered by its own worker process.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import pygame
+
+from snake import *
+import replay
+import sim
+import ui
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+# Snake colours by player, as in TwoPlayerUI, repeating for bigger games
+COLORS = (ui.SNAKE_COLOR, ui.SNAKE2_COLOR)
+IMAGE_FORMATS = ("ppm", "png")
+
+
+class Renderer(ui.GridUI):
+    """A headless GridUI that turns a sequence of game states into raw frames."""
+
+    def __init__(self, width, height, players, segment_size=20, segment_margin=1, outside_margin=5,
+                 view_width=None, view_height=None):
+        super().__init__(width, height, segment_size, segment_margin, outside_margin, 0,
+                         view_width=view_width, view_height=view_height, headless=True)
+        self.players = players
+        self.game = None
+
+    def snakes(self):
+        return [(snake, COLORS[i % len(COLORS)]) for i, snake in enumerate(self.game.get_snakes())]
+
+    def frame(self):
+        # A straight copy, many times faster than converting to RGB with pygame.image.tostring
+        return self.screen.get_buffer().raw
+
+    def frames(self, states):
+        """Yield a frame for every game in states, which may be the same game object updated
+        in place between them, as Episode.states() does."""
+        for game in states:
+            if game is not self.game:
+                self.game = game
+                self.start_loop()
+            snakes = self.snakes()
+            self.mark_dirty(snakes, game.food)
+            if self.following is not None:
+                self.center_on(snakes[self.following][0].get_head_position())
+            if is_over(game):
+                # Dead snakes come off the board all at once, so paint everything
+                self.needs_redraw = True
+            self.draw_board(snakes, game.food)
+            yield self.frame()
+            self.mark_dirty(snakes, game.food)
+
+    def end_card(self, text):
+        self.draw_text(text, 10)
+        # The text covers cells that were not marked dirty
+        self.needs_redraw = True
+        return self.frame()
+
+
+def pixel_format(surface):
+    """ffmpeg's name for how a 32 bit surface's pixels are laid out in memory, like "bgr0"."""
+    layout = ["0"] * 4
+    for name, mask, shift in zip("rgba", surface.get_masks(), surface.get_shifts()):
+        if mask:
+            byte = shift // 8
+            layout[byte if sys.byteorder == "little" else 3 - byte] = name
+    return "".join(layout)
+
+
+def is_over(game):
+    if isinstance(game, SinglePlayerGame):
+        return not game.is_alive() or game.has_won()
+    return not game.is_running()
+
+
+def result_text(game):
+    if isinstance(game, SinglePlayerGame):
+        return "Score: " + str(game.get_snake().get_length())
+    winner = game.winner()
+    if winner is None:
+        return "No winner"
+    if winner == 0:
+        return "Draw!"
+    return "Player " + str(winner) + " wins!"
+
+
+def seeded_states(players, policies, width, height, seed, max_ticks):
+    """Play a new game with the named sim policies, yielding it after creation and after
+    every tick."""
+    rng = random.Random(seed)
+    if players == 1:
+        game = SinglePlayerGame(width, height, rng.randrange(1 << 63))
+    else:
+        game = TwoPlayerGame(width, height, rng.randrange(1 << 63))
+    moves = [sim.make_policy(name, random.Random(rng.randrange(1 << 63))) for name in policies[:players]]
+    yield game
+    for _ in range(max_ticks):
+        running = game.update(*[policy(game, player + 1) for player, policy in enumerate(moves)])
+        yield game
+        if not running:
+            break
+
+
+class FFmpegWriter:
+    """Pipes raw frames into an ffmpeg process encoding path."""
+
+    def __init__(self, path, surface, fps, codec="libx264", ffmpeg="ffmpeg"):
+        # yuv420p, which players expect, needs even dimensions
+        command = [ffmpeg, "-loglevel", "error", "-y",
+                   "-f", "rawvideo", "-pix_fmt", pixel_format(surface),
+                   "-s", "{}x{}".format(surface.get_width(), surface.get_height()),
+                   "-r", str(fps), "-i", "-",
+                   "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", codec, "-pix_fmt", "yuv420p", path]
+        self.path = path
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frames):
+        self.process.stdin.write(b"".join(frames))
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait():
+            raise RuntimeError("ffmpeg failed to encode " + self.path)
+
+
+class ImageWriter:
+    """Writes frames of surface as numbered ppm or png images in a directory."""
+
+    def __init__(self, directory, surface, image_format="ppm"):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError("Unknown image format " + repr(image_format))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = image_format
+        # Frames are copied back into a surface like the one they came from to convert them
+        self.surface = surface.copy()
+        self.header = "P6\n{} {}\n255\n".format(surface.get_width(), surface.get_height()).encode("ascii")
+        self.count = 0
+
+    def write(self, frames):
+        for frame in frames:
+            path = os.path.join(self.directory, "{:06d}.{}".format(self.count, self.format))
+            self.surface.get_buffer().write(frame)
+            if self.format == "ppm":
+                with open(path, "wb") as file:
+                    file.write(self.header)
+                    file.write(pygame.image.tostring(self.surface, "RGB"))
+            else:
+                pygame.image.save(self.surface, path)
+            self.count += 1
+
+    def close(self):
+        pass
+
+
+def make_writer(path, surface, config):
+    if config["format"] in IMAGE_FORMATS:
+        return ImageWriter(path, surface, config["format"])
+    return FFmpegWriter(path, surface, config["fps"], config["codec"], config["ffmpeg"])
+
+
+def render(states, players, width, height, path, config):
+    """Render states to path and return the number of frames written."""
+    renderer = Renderer(width, height, players, config["segment_size"],
+                        view_width=config["view_width"], view_height=config["view_height"])
+    writer = make_writer(path, renderer.screen, config)
+    batch_size = config["batch_size"]
+    count = 0
+    try:
+        batch = []
+        for frame in renderer.frames(states):
+            batch.append(frame)
+            if len(batch) >= batch_size:
+                writer.write(batch)
+                count += len(batch)
+                batch = []
+        if renderer.game is not None and config["hold"]:
+            # Hold the last frame with the result over it
+            batch.extend([renderer.end_card(result_text(renderer.game))] * config["hold"])
+        writer.write(batch)
+        count += len(batch)
+    finally:
+        writer.close()
+    return count
+
+
+def export_job(job):
+    """Render one clip and return (path, frames, seconds).
+
+    A job is ("replay", replay path, episode index, output path, config) or
+    ("seeded", players, game seed, output path, config).
+    """
+    kind, source, index, path, config = job
+    start = time.perf_counter()
+    if kind == "replay":
+        with replay.ReplayReader(source) as reader:
+            episode = reader[index]
+            frames = render(episode.states(), episode.players, episode.width, episode.height, path, config)
+    else:
+        states = seeded_states(source, config["policies"], config["width"], config["height"], index,
+                               config["max_ticks"])
+        frames = render(states, source, config["width"], config["height"], path, config)
+    return path, frames, time.perf_counter() - start
+
+
+def export_all(jobs, workers=None):
+    """Render every job on a pool of processes, yielding export_job's results as they finish."""
+    workers = min(workers or multiprocessing.cpu_count(), len(jobs))
+    if workers <= 1:
+        for job in jobs:
+            yield export_job(job)
+        return
+    pool = multiprocessing.Pool(workers, initializer=sim.ignore_interrupt)
+    try:
+        for result in pool.imap_unordered(export_job, jobs):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render snake games to video or images, faster than real time")
+    parser.add_argument("--replay", metavar="PATH", help="render the episodes of this replay file")
+    parser.add_argument("--episodes", type=int, nargs="+", metavar="INDEX", help="only these episodes of --replay")
+    parser.add_argument("--games", type=int, default=1, help="without --replay, play and render this many games")
+    parser.add_argument("--players", type=int, default=1, choices=(1, 2))
+    parser.add_argument("--policy", default="greedy", choices=sorted(sim.POLICIES))
+    parser.add_argument("--opponent", choices=sorted(sim.POLICIES), help="policy for player 2, defaults to --policy")
+    parser.add_argument("--width", type=int, default=15)
+    parser.add_argument("--height", type=int, default=15)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-ticks", type=int, default=10000)
+    parser.add_argument("--out", default="clips", help="directory the clips are written to")
+    parser.add_argument("--format", default="mp4", help="ppm or png for image sequences, otherwise the video "
+                                                        "container ffmpeg encodes to")
+    parser.add_argument("--fps", type=float, default=10)
+    parser.add_argument("--codec", default="libx264")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="ffmpeg executable")
+    parser.add_argument("--segment-size", type=int, default=20, help="cell size in pixels")
+    parser.add_argument("--view", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="only draw this many cells around player 1 on bigger boards")
+    parser.add_argument("--hold", type=int, default=20, help="frames showing the result at the end")
+    parser.add_argument("--batch-size", type=int, default=256, help="frames handed to the writer at once")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args(argv)
+
+    if args.format not in IMAGE_FORMATS and shutil.which(args.ffmpeg) is None:
+        parser.error("{} not found, install it or use --format ppm or png".format(args.ffmpeg))
+
+    config = {
+        "format": args.format,
+        "fps": args.fps,
+        "codec": args.codec,
+        "ffmpeg": args.ffmpeg,
+        "segment_size": args.segment_size,
+        "view_width": args.view[0] if args.view else None,
+        "view_height": args.view[1] if args.view else None,
+        "hold": args.hold,
+        "batch_size": args.batch_size,
+        "policies": [args.policy, args.opponent or args.policy],
+        "width": args.width,
+        "height": args.height,
+        "max_ticks": args.max_ticks,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    extension = "" if args.format in IMAGE_FORMATS else "." + args.format
+
+    jobs = []
+    if args.replay:
+        with replay.ReplayReader(args.replay) as reader:
+            episodes = args.episodes if args.episodes is not None else range(len(reader))
+        for i in episodes:
+            path = os.path.join(args.out, "episode_{:05d}{}".format(i, extension))
+            jobs.append(("replay", args.replay, i, path, config))
+    else:
+        rng = random.Random(args.seed)
+        for i in range(args.games):
+            path = os.path.join(args.out, "game_{:05d}{}".format(i, extension))
+            jobs.append(("seeded", args.players, rng.randrange(1 << 63), path, config))
+    if not jobs:
+        print("Nothing to render")
+        return
+
+    start = time.perf_counter()
+    frames = 0
+    clips = 0
+    try:
+        for path, count, seconds in export_all(jobs, args.workers):
+            frames += count
+            clips += 1
+            print("{}: {} frames in {:.2f}s".format(path, count, seconds))
+    except KeyboardInterrupt:
+        print("Stopping...")
+    elapsed = time.perf_counter() - start
+    print("{} clips, {} frames in {:.2f}s, {:.0f} frames/s, {:.0f}x real time at {:g} fps".format(
+        clips, frames, elapsed, frames / elapsed if elapsed else 0.0,
+        frames / elapsed / args.fps if elapsed else 0.0, args.fps))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""farm.py: Self-play data generation spread over a pool of worker processes
+
+Usage: python farm.py --episodes 10000 --workers 8 --policy greedy --seed 1
+"""
+
+import argparse
+from array import array
+import multiprocessing
+import queue
+import random
+import time
+
+from snake import *
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+class TransitionBatch:
+    """A block of transitions from one worker, stored column-wise in typed arrays.
+
+    Row i is one player's move: the episode it belongs to (numbered per worker), the tick,
+    the player, the direction value or NO_DIRECTION, the reward and whether the player's
+    episode ended. Finished episodes are summarised in the episode_* columns.
+    """
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.episode = array("I")
+        self.tick = array("I")
+        self.player = array("B")
+        self.action = array("b")
+        self.reward = array("f")
+        self.done = array("B")
+
+        self.episode_id = array("I")
+        self.episode_length = array("I")
+        self.episode_score_1 = array("I")
+        self.episode_score_2 = array("I")
+
+        self.stats = None
+
+    def __len__(self):
+        return len(self.tick)
+
+    def add(self, episode, tick, player, action, reward, done):
+        self.episode.append(episode)
+        self.tick.append(tick)
+        self.player.append(player)
+        self.action.append(action)
+        self.reward.append(reward)
+        self.done.append(done)
+
+    def add_episode(self, episode, length, score_1, score_2):
+        self.episode_id.append(episode)
+        self.episode_length.append(length)
+        self.episode_score_1.append(score_1)
+        self.episode_score_2.append(score_2)
+
+
+class WorkerStats:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.episodes = 0
+        self.ticks = 0
+        self.transitions = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.finished = False
+
+    def ticks_per_second(self):
+        return self.ticks / self.seconds if self.seconds else 0.0
+
+    def episodes_per_second(self):
+        return self.episodes / self.seconds if self.seconds else 0.0
+
+
+def reward_value(ate, alive):
+    if not alive:
+        return -1.0
+    return 1.0 if ate else 0.0
+
+
+def play_episode(config, rng, policies, batch, episode):
+    width, height, players, max_ticks = config["width"], config["height"], config["players"], config["max_ticks"]
+    seed = rng.randrange(1 << 63)
+    tick = 0
+    if players == 1:
+        game = SinglePlayerGame(width, height, seed)
+        running = True
+        while running and tick < max_ticks:
+            tick += 1
+            direction = policies[0](game, 1)
+            running = game.update(direction)
+            done = not running or tick == max_ticks
+            batch.add(episode, tick, 1, pack_direction(direction),
+                      reward_value(game.apple_triggered, game.is_alive()), done)
+        batch.add_episode(episode, tick, game.get_snake().get_length(), 0)
+    else:
+        game = TwoPlayerGame(width, height, seed)
+        running = True
+        while running and tick < max_ticks:
+            tick += 1
+            direction_1 = policies[0](game, 1)
+            direction_2 = policies[1](game, 2)
+            running = game.update(direction_1, direction_2)
+            done = not running or tick == max_ticks
+            batch.add(episode, tick, 1, pack_direction(direction_1),
+                      reward_value(game.apple_triggered_s1, game.snake_1_alive()), done)
+            batch.add(episode, tick, 2, pack_direction(direction_2),
+                      reward_value(game.apple_triggered_s2, game.snake_2_alive()), done)
+        batch.add_episode(episode, tick, game.get_snake_1().get_length(), game.get_snake_2().get_length())
+    return tick
+
+
+def worker_main(worker_id, config, seed, episodes, results, stop):
+    # The parent tells the workers to stop through the event
+    sim.ignore_interrupt()
+
+    rng = random.Random(seed)
+    policies = [
+        sim.make_policy(config["policy"], random.Random(rng.randrange(1 << 63))),
+        sim.make_policy(config["opponent"] or config["policy"], random.Random(rng.randrange(1 << 63))),
+    ]
+    stats = WorkerStats(worker_id)
+    batch = TransitionBatch(worker_id)
+    start = time.perf_counter()
+
+    episode = 0
+    while not stop.is_set() and (episodes is None or episode < episodes):
+        stats.ticks += play_episode(config, rng, policies, batch, episode)
+        stats.episodes += 1
+        episode += 1
+        if len(batch) >= config["batch_size"]:
+            stats.transitions += len(batch)
+            stats.batches += 1
+            stats.seconds = time.perf_counter() - start
+            batch.stats = stats
+            results.put(batch)
+            batch = TransitionBatch(worker_id)
+
+    stats.transitions += len(batch)
+    stats.batches += 1
+    stats.seconds = time.perf_counter() - start
+    stats.finished = True
+    batch.stats = stats
+    results.put(batch)
+
+
+class SelfPlayFarm:
+    """Runs self-play episodes on a pool of processes and streams back TransitionBatches.
+
+    Every worker gets its own seed drawn from seed, so a farm with the same seed, worker
+    count and episode budget produces the same data. Leave episodes as None to run until
+    stop() is called.
+    """
+
+    def __init__(self, workers=None, players=1, policy="greedy", opponent=None, width=15, height=15,
+                 seed=None, episodes=None, batch_size=4096, max_ticks=10000):
+        sim.make_policy(policy, random.Random())
+        if opponent:
+            sim.make_policy(opponent, random.Random())
+
+        self.workers = workers or multiprocessing.cpu_count()
+        self.config = {
+            "players": players,
+            "policy": policy,
+            "opponent": opponent,
+            "width": width,
+            "height": height,
+            "batch_size": batch_size,
+            "max_ticks": max_ticks,
+        }
+        rng = random.Random(seed)
+        self.seeds = [rng.randrange(1 << 63) for _ in range(self.workers)]
+        if episodes is None:
+            self.episodes = [None] * self.workers
+        else:
+            self.episodes = [episodes // self.workers + (1 if i < episodes % self.workers else 0)
+                             for i in range(self.workers)]
+
+        self.results = multiprocessing.Queue(maxsize=self.workers * 4)
+        self.stop_event = multiprocessing.Event()
+        self.processes = []
+        self.stats = {i: WorkerStats(i) for i in range(self.workers)}
+
+    def start(self):
+        for i in range(self.workers):
+            process = multiprocessing.Process(
+                target=worker_main,
+                args=(i, self.config, self.seeds[i], self.episodes[i], self.results, self.stop_event),
+                daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def running(self):
+        return not all(s.finished for s in self.stats.values())
+
+    def batches(self, timeout=1.0):
+        """Yield batches as they arrive until every worker has finished."""
+        while self.running():
+            try:
+                batch = self.results.get(timeout=timeout)
+            except queue.Empty:
+                if not any(p.is_alive() for p in self.processes):
+                    raise RuntimeError("Self-play workers exited without finishing")
+                continue
+            self.stats[batch.worker_id] = batch.stats
+            yield batch
+
+    def stop(self):
+        # Let the workers finish their episodes and flush, draining the queue so none of
+        # them blocks on a full pipe
+        self.stop_event.set()
+        for _ in self.batches():
+            pass
+        for process in self.processes:
+            process.join()
+
+    def total(self, attribute):
+        return sum(getattr(s, attribute) for s in self.stats.values())
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate self-play transitions on every core")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--episodes", type=int, help="total episodes, runs until Ctrl-C if left out")
+    parser.add_argument("--players", type=int, default=1, choices=(1, 2))
+    parser.add_argument("--policy", default="greedy", choices=sorted(sim.POLICIES))
+    parser.add_argument("--opponent", choices=sorted(sim.POLICIES))
+    parser.add_argument("--width", type=int, default=15)
+    parser.add_argument("--height", type=int, default=15)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--max-ticks", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    farm = SelfPlayFarm(args.workers, args.players, args.policy, args.opponent, args.width, args.height,
+                        args.seed, args.episodes, args.batch_size, args.max_ticks)
+    start = time.perf_counter()
+    transitions = 0
+    with farm:
+        try:
+            for batch in farm.batches():
+                transitions += len(batch)
+        except KeyboardInterrupt:
+            print("Stopping workers...")
+    elapsed = time.perf_counter() - start
+
+    for stats in sorted(farm.stats.values(), key=lambda s: s.worker_id):
+        print("worker {}: {} episodes, {} ticks, {:.0f} ticks/s".format(
+            stats.worker_id, stats.episodes, stats.ticks, stats.ticks_per_second()))
+    print("total: {} episodes, {} transitions in {:.2f}s, {:.0f} transitions/s".format(
+        farm.total("episodes"), transitions, elapsed, transitions / elapsed if elapsed else 0.0))
+
+
+if __name__ == '__main__':
+    main()
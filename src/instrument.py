@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""instrument.py: Low overhead timing histograms and counters for the game loop
+
+An Instruments object is handed to a game or a GridUI with instruments=... and is left as
+None otherwise, which costs one attribute check per hook. Timings go into histograms with
+buckets allocated up front, so recording a tick never allocates or logs anything.
+"""
+
+from bisect import bisect_left
+import time
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+# Bucket upper bounds in seconds, doubling from 1us to about 1s
+BOUNDS = tuple(1e-6 * 2 ** i for i in range(21))
+
+
+class Histogram:
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        # One bucket per bound and a last one for anything above them all
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation, capped at the largest one
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def reset(self):
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Instruments:
+    """Per-phase timing histograms and event counters.
+
+    Time a phase with start = instruments.clock() and instruments.record(name, start), or
+    back to back phases with start = instruments.lap(name, start).
+    Frames longer than budget seconds, usually 1 / fps, are counted as overruns.
+    """
+
+    def __init__(self, budget=None):
+        self.clock = time.perf_counter
+        self.histograms = {}
+        self.counters = {}
+        self.budget = budget
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        return self.histograms[name]
+
+    def record(self, name, start):
+        elapsed = self.clock() - start
+        self.histogram(name).observe(elapsed)
+        return elapsed
+
+    def lap(self, name, start):
+        # Record the phase that began at start and return the start of the next one
+        now = self.clock()
+        self.histogram(name).observe(now - start)
+        return now
+
+    def record_frame(self, start):
+        if self.record("frame", start) > (self.budget or float("inf")):
+            self.count("frame_overruns")
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        for name in self.counters:
+            self.counters[name] = 0
+
+    def summary(self):
+        lines = ["{:10} {:>9} {:>10} {:>10} {:>10} {:>10}".format("phase", "count", "mean us", "p50 us",
+                                                                  "p99 us", "max us")]
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            lines.append("{:10} {:9d} {:10.1f} {:10.1f} {:10.1f} {:10.1f}".format(
+                name, histogram.count, histogram.mean() * 1e6, histogram.quantile(0.5) * 1e6,
+                histogram.quantile(0.99) * 1e6, histogram.max * 1e6))
+        if self.budget:
+            lines.append("frame budget {:.1f}ms".format(self.budget * 1e3))
+        for name in sorted(self.counters):
+            lines.append("{} {}".format(name, self.counters[name]))
+        return "\n".join(lines)
+
+    def prometheus(self, prefix="snake"):
+        """Everything recorded, in the Prometheus text exposition format."""
+        name = prefix + "_phase_seconds"
+        lines = ["# TYPE " + name + " histogram"]
+        for phase in sorted(self.histograms):
+            histogram = self.histograms[phase]
+            cumulative = 0
+            for bound, n in zip(histogram.bounds, histogram.buckets):
+                cumulative += n
+                lines.append('{}_bucket{{phase="{}",le="{:g}"}} {}'.format(name, phase, bound, cumulative))
+            lines.append('{}_bucket{{phase="{}",le="+Inf"}} {}'.format(name, phase, histogram.count))
+            lines.append('{}_sum{{phase="{}"}} {!r}'.format(name, phase, histogram.sum))
+            lines.append('{}_count{{phase="{}"}} {}'.format(name, phase, histogram.count))
+        for counter in sorted(self.counters):
+            lines.append("# TYPE {}_{}_total counter".format(prefix, counter))
+            lines.append("{}_{}_total {}".format(prefix, counter, self.counters[counter]))
+        return "\n".join(lines) + "\n"
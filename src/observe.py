@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""observe.py: Board observations for machine learning agents
+
+Observations are written into arrays the caller allocates once, shaped (CHANNELS, height,
+width) for one game or (N, CHANNELS, height, width) for many. Only array methods are used,
+so any NumPy-like array works and this module does not import NumPy itself.
+"""
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+OWN_BODY = 0
+OWN_HEAD = 1
+OPPONENT_BODY = 2
+APPLE = 3
+CHANNELS = 4
+
+# Ray features, one per Direction value: the distance to the wall, then the distance to the
+# first occupied cell or the wall, both divided by the longer side of the board
+RAYS = 8
+
+RAY_STEPS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+
+def observe(game, out, player=1, rays=None):
+    """Write the board as seen by player (counting from 1) into out, and optionally the ray
+    features into rays."""
+    width = game.width
+    snakes = game.get_snakes()
+    own = snakes[player - 1]
+
+    out.fill(0)
+    own_body = out[OWN_BODY]
+    if len(snakes) == 1:
+        # The board only holds this snake, so its occupied cells are the body
+        mark_occupied(game.board, own_body.reshape(-1))
+    else:
+        # Every snake's segments, straight from the board
+        mark_occupied(game.board, out[OPPONENT_BODY].reshape(-1))
+        positions = own.get_positions()
+        if own.board is not None:
+            for x, y in positions:
+                own_body[y, x] = 1
+        # Opponents are everything on the board that isn't this snake
+        out[OPPONENT_BODY] -= own_body
+
+    x, y = own.get_head_position()
+    on_board = 0 <= x < width and 0 <= y < game.height
+    if on_board and own.board is not None:
+        out[OWN_HEAD, y, x] = 1
+
+    for apple in game.get_apples():
+        out[APPLE, apple.y, apple.x] = 1
+
+    if rays is not None:
+        rays.fill(0)
+        if on_board and own.board is not None:
+            cast_rays(game, x, y, rays)
+
+
+def mark_occupied(board, flat):
+    """Set the cells of flat, one per board cell, to 1 where the board is occupied."""
+    counts = board.counts
+    if isinstance(counts, dict):
+        # A SparseBoard only keeps the occupied cells
+        for cell in counts:
+            flat[cell] = 1
+    else:
+        flat[:] = counts
+        flat.clip(0, 1, out=flat)
+
+
+def cast_rays(game, x, y, rays):
+    width = game.width
+    height = game.height
+    counts = game.board.counts
+    scale = float(max(width, height))
+    for i, (dx, dy) in enumerate(RAY_STEPS):
+        if dx < 0:
+            wall = x
+        elif dx > 0:
+            wall = width - 1 - x
+        elif dy < 0:
+            wall = y
+        else:
+            wall = height - 1 - y
+        free = 0
+        cell_x = x + dx
+        cell_y = y + dy
+        while free < wall and counts[cell_y * width + cell_x] == 0:
+            free += 1
+            cell_x += dx
+            cell_y += dy
+        rays[i] = wall / scale
+        rays[4 + i] = free / scale
+
+
+def observe_batch(games, out, players=None, rays=None):
+    """Fill out[i] (and rays[i]) for games[i], as seen by players[i] or player 1."""
+    for i, game in enumerate(games):
+        observe(game, out[i], players[i] if players is not None else 1, rays[i] if rays is not None else None)
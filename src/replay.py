@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+"""replay.py: Compact binary game recordings and a memory-mapped reader
+
+A replay file is a sequence of episodes appended one after another. Each episode is a
+fixed header followed by its payload, all little-endian:
+
+    header   magic "SNKR", version (B), players (B), width (H), height (H), seed (Q),
+             ticks (I), apples (I)
+    payload  ticks direction bytes, then the apple spawns as three columns:
+             apples tick numbers (I), apples x (H), apples y (H)
+
+A direction byte holds player 1 in the low nibble and player 2 in the high nibble, using
+Direction.value or NO_DIRECTION when the player gave no input. The apple placed when the
+game is created is recorded at tick 0.
+"""
+
+from array import array
+import mmap
+import struct
+import sys
+import weakref
+
+from snake import *
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+MAGIC = b"SNKR"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHHQII")
+
+
+def little_endian(column):
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+class ReplayRecorder:
+    """Appends games to a replay file.
+
+    Call begin(game) after creating a game, record(game, *directions) after every
+    game.update with the directions that were passed to it, and end() when it is over.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "ab")
+        self.game = None
+
+    def begin(self, game):
+        if len(game.get_apples()) != 1:
+            raise ValueError("Replays record games with a single apple")
+        if len(game.get_snakes()) > 2:
+            raise ValueError("Replays record games with one or two players")
+        self.game = game
+        self.players = 1 if isinstance(game, SinglePlayerGame) else 2
+        self.directions = bytearray()
+        self.apple_ticks = array("I")
+        self.apple_x = array("H")
+        self.apple_y = array("H")
+        self.add_apple(0)
+
+    def add_apple(self, tick):
+        self.apple = self.game.get_apple().get_position()
+        self.apple_ticks.append(tick)
+        self.apple_x.append(self.apple[0])
+        self.apple_y.append(self.apple[1])
+
+    def record(self, game, *directions):
+        code = pack_direction(directions[0])
+        if len(directions) > 1:
+            code |= pack_direction(directions[1]) << 4
+        self.directions.append(code)
+        if game.get_apple().get_position() != self.apple:
+            self.add_apple(len(self.directions))
+
+    def end(self):
+        if self.game is None:
+            return
+        game = self.game
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.players, game.width, game.height, game.seed,
+                                    len(self.directions), len(self.apple_ticks)))
+        self.file.write(self.directions)
+        self.file.write(little_endian(self.apple_ticks).tobytes())
+        self.file.write(little_endian(self.apple_x).tobytes())
+        self.file.write(little_endian(self.apple_y).tobytes())
+        self.file.flush()
+        self.game = None
+
+    def close(self):
+        self.end()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class Episode:
+    def __init__(self, buffer, offset):
+        magic, version, self.players, self.width, self.height, self.seed, self.ticks, self.apples = \
+            HEADER.unpack_from(buffer, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a replay episode at offset " + str(offset))
+
+        start = offset + HEADER.size
+        self.directions = buffer[start:start + self.ticks]
+        start += self.ticks
+        self.apple_ticks = self.column(buffer, start, "I")
+        start += 4 * self.apples
+        self.apple_x = self.column(buffer, start, "H")
+        start += 2 * self.apples
+        self.apple_y = self.column(buffer, start, "H")
+        self.end = start + 2 * self.apples
+
+    def release(self):
+        # Let go of the views into the reader's mapping, after which the episode is unusable
+        for column in (self.directions, self.apple_ticks, self.apple_x, self.apple_y):
+            if isinstance(column, memoryview):
+                column.release()
+
+    def column(self, buffer, start, typecode):
+        view = buffer[start:start + array(typecode).itemsize * self.apples]
+        if sys.byteorder == "big":
+            column = array(typecode, view)
+            column.byteswap()
+            return column
+        return view.cast(typecode)
+
+    def get_directions(self, tick):
+        code = self.directions[tick]
+        if self.players == 1:
+            return unpack_direction(code),
+        return unpack_direction(code & 0x0F), unpack_direction(code >> 4)
+
+    def new_game(self):
+        if self.players == 1:
+            return SinglePlayerGame(self.width, self.height, self.seed)
+        return TwoPlayerGame(self.width, self.height, self.seed)
+
+    def states(self):
+        """Replay the episode, yielding the game after creation and after every tick.
+
+        The same game object is yielded each time. Apples are put where they were recorded,
+        so the replay does not depend on the game's random number generator.
+        """
+        game = self.new_game()
+        apple = 0
+        game.get_apple().set_position(self.apple_x[0], self.apple_y[0])
+        apple += 1
+        yield game
+        for tick in range(self.ticks):
+            game.update(*self.get_directions(tick))
+            if apple < self.apples and self.apple_ticks[apple] == tick + 1:
+                game.get_apple().set_position(self.apple_x[apple], self.apple_y[apple])
+                apple += 1
+            yield game
+
+    def game_at(self, tick):
+        for i, game in enumerate(self.states()):
+            if i == tick:
+                return game
+        raise IndexError("Episode only has " + str(self.ticks) + " ticks")
+
+
+class ReplayReader:
+    """Memory-maps a replay file and indexes its episodes by reading only the headers.
+
+    Episodes read straight from the mapping. Closing the reader releases every episode it
+    handed out that is still around, so they can't be used after that.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.offsets = []
+        self.episodes = weakref.WeakSet()
+        self.buffer = memoryview(b"")
+        self.map = None
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return
+        self.buffer = memoryview(self.map)
+
+        offset = 0
+        while offset < len(self.buffer):
+            self.offsets.append(offset)
+            _, _, _, _, _, _, ticks, apples = HEADER.unpack_from(self.buffer, offset)
+            offset += HEADER.size + ticks + 8 * apples
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        return self.episode(self.offsets[index])
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield self.episode(offset)
+
+    def episode(self, offset):
+        episode = Episode(self.buffer, offset)
+        self.episodes.add(episode)
+        return episode
+
+    def close(self):
+        for episode in list(self.episodes):
+            episode.release()
+        self.episodes.clear()
+        self.buffer.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+"""server.py: Asyncio server that hosts many two player matches over TCP
+
+Usage: python server.py --port 8765 --tick-rate 10
+       python server.py --loopback 1000 --max-ticks 300
+
+Clients send one line per turn, "U", "D", "L" or "R". Connections are paired up into
+matches as they arrive and every match is stepped on one shared tick. The server sends
+binary messages, each a header of type (B) and payload length (I), little-endian:
+
+    START  match id (I), player (B, 1 or 2), tick rate (f), then the game state as
+           encoded by delta.encode_state
+    TICK   that tick's events, as encoded by delta.encode_tick
+    END    winner (B, 0 for a draw), ticks played (I)
+
+Only the changes are sent each tick, so a frame's size does not grow with the snakes.
+"""
+
+import argparse
+import asyncio
+from collections import deque
+import random
+import struct
+import time
+
+from snake import *
+import delta
+import instrument
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+CODES = {
+    b"U": Direction.UP,
+    b"D": Direction.DOWN,
+    b"L": Direction.LEFT,
+    b"R": Direction.RIGHT,
+}
+LETTERS = {direction: code for code, direction in CODES.items()}
+
+# Turns a player can send ahead of the ticks that use them
+INPUT_QUEUE = 3
+# A client this many bytes behind is dropped; the tick loop never waits for anyone
+WRITE_LIMIT = 1 << 16
+# Pending connections the listening socket queues, enough for thousands joining at once
+BACKLOG = 4096
+
+
+HEADER = struct.Struct("<BI")
+START = 1
+TICK = 2
+END = 3
+START_INFO = struct.Struct("<IBf")
+END_INFO = struct.Struct("<BI")
+
+
+def message(kind, payload):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+class Player:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.match = None
+        self.index = 0
+        self.inputs = deque()
+        self.connected = True
+
+    def queue_direction(self, direction):
+        # Turns sent while the queue is full are dropped, so the ones kept stay in order
+        if len(self.inputs) < INPUT_QUEUE:
+            self.inputs.append(direction)
+
+    def next_direction(self):
+        return self.inputs.popleft() if self.inputs else False
+
+    def send(self, data):
+        if not self.connected:
+            return
+        transport = self.writer.transport
+        if transport.is_closing() or transport.get_write_buffer_size() > WRITE_LIMIT:
+            self.disconnect()
+            return
+        self.writer.write(data)
+
+    def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self.writer.close()
+
+
+class Match:
+    def __init__(self, match_id, players, width, height, seed):
+        self.id = match_id
+        self.players = players
+        self.game = TwoPlayerGame(width, height, seed)
+        self.ticks = 0
+        self.winner = None
+        self.events = []
+        self.game.subscribe(self.record)
+        for i, player in enumerate(players):
+            player.match = self
+            player.index = i
+
+    def start_message(self, player, tick_rate):
+        return message(START, START_INFO.pack(self.id, player.index + 1, tick_rate) + delta.encode_state(self.game))
+
+    def step(self):
+        """Run one tick and return its encoded events."""
+        game = self.game
+        running = game.update(*[player.next_direction() for player in self.players])
+        self.ticks += 1
+
+        if not running:
+            self.winner = game.winner()
+        return delta.encode_tick(self.ticks, self.events)
+
+    def record(self, events):
+        # Subscribed to the game
+        self.events = events
+
+    def broadcast(self, data):
+        for player in self.players:
+            player.send(data)
+
+
+class Server:
+    """Pairs up connections into TwoPlayerGame matches and ticks them all together.
+
+    on_finish, if set, is called with every match when it ends.
+    """
+
+    def __init__(self, width=30, height=20, tick_rate=10, max_ticks=10000, seed=None, instruments=None):
+        self.width = width
+        self.height = height
+        self.tick_rate = tick_rate
+        self.max_ticks = max_ticks
+        self.rng = random.Random(seed)
+        self.instruments = instruments
+        self.on_finish = None
+
+        self.matches = {}
+        self.waiting = None
+        self.next_id = 0
+        self.server = None
+        self.ticker = None
+
+        self.ticks = 0
+        self.overruns = 0
+        self.matches_played = 0
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=BACKLOG)
+        self.ticker = asyncio.ensure_future(self.run())
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.ticker:
+            self.ticker.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        for match in list(self.matches.values()):
+            for player in match.players:
+                player.disconnect()
+
+    async def handle(self, reader, writer):
+        player = Player(reader, writer)
+        self.join(player)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                direction = CODES.get(line.strip())
+                if direction is not None and player.match is not None:
+                    player.queue_direction(direction)
+        except ConnectionError:
+            pass
+        finally:
+            self.leave(player)
+
+    def join(self, player):
+        if self.waiting is None or not self.waiting.connected:
+            self.waiting = player
+            return
+        players = [self.waiting, player]
+        self.waiting = None
+        match = Match(self.next_id, players, self.width, self.height, self.rng.randrange(1 << 63))
+        self.next_id += 1
+        self.matches[match.id] = match
+        for each in players:
+            each.send(match.start_message(each, self.tick_rate))
+
+    def leave(self, player):
+        player.disconnect()
+        if self.waiting is player:
+            self.waiting = None
+        match = player.match
+        if match is not None and match.winner is None:
+            # Forfeit: the other player wins
+            match.winner = 2 - player.index
+            self.finish(match)
+
+    def finish(self, match):
+        self.matches.pop(match.id, None)
+        self.matches_played += 1
+        match.broadcast(message(END, END_INFO.pack(match.winner, match.ticks)))
+        if self.on_finish:
+            self.on_finish(match)
+
+    async def run(self):
+        # Ticks are scheduled on a fixed grid; a late tick is counted and the grid moves on
+        # rather than running extra ticks to catch up
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.tick_rate
+        next_time = loop.time()
+        while True:
+            next_time += interval
+            delay = next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.overruns += 1
+                next_time = loop.time()
+                await asyncio.sleep(0)
+            self.tick()
+
+    def tick(self):
+        instruments = self.instruments
+        if instruments:
+            start = instruments.clock()
+        for match in list(self.matches.values()):
+            if match.winner is not None:
+                continue
+            match.broadcast(message(TICK, match.step()))
+            if match.winner is None and match.ticks >= self.max_ticks:
+                match.winner = 0
+            if match.winner is not None:
+                self.finish(match)
+        self.ticks += 1
+        if instruments:
+            instruments.record("tick", start)
+
+
+class LoopbackClient:
+    """Plays one match against the server, turning at random but never into an obstacle
+    it can see."""
+
+    def __init__(self, seed=None, turn_chance=0.2):
+        self.rng = random.Random(seed)
+        self.turn_chance = turn_chance
+        self.match = None
+        self.player = None
+        self.mirror = None
+        self.direction = Direction.LEFT
+        self.winner = None
+
+    def choose(self):
+        mirror = self.mirror
+        x, y = mirror.snakes[self.player - 1][0]
+        options = []
+        for direction in DIRECTIONS:
+            dx, dy = MOVES[direction]
+            if direction != OPPOSITE[self.direction] and mirror.is_free((x + dx, y + dy)):
+                options.append(direction)
+        if not options:
+            return self.direction
+        if self.direction in options and self.rng.random() >= self.turn_chance:
+            return self.direction
+        return self.rng.choice(options)
+
+    async def run(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while True:
+                try:
+                    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    payload = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    break
+                if kind == TICK:
+                    _, events, _ = delta.decode_tick(payload)
+                    self.mirror.apply(events)
+                elif kind == START:
+                    self.match, self.player, _ = START_INFO.unpack_from(payload)
+                    self.mirror, _ = delta.decode_state(payload, START_INFO.size)
+                elif kind == END:
+                    self.winner, _ = END_INFO.unpack(payload)
+                    break
+                if self.mirror is not None and self.mirror.alive[self.player - 1]:
+                    direction = self.choose()
+                    if direction != self.direction:
+                        self.direction = direction
+                        writer.write(LETTERS[direction] + b"\n")
+        finally:
+            writer.close()
+
+
+async def loopback(games, width=30, height=20, tick_rate=10, max_ticks=300, seed=None):
+    """Run games matches between in-process clients over localhost and check that every
+    client's mirror ends up identical to the server's game."""
+    instruments = instrument.Instruments(1.0 / tick_rate)
+    server = Server(width, height, tick_rate, max_ticks, seed, instruments)
+    final = {}
+    server.on_finish = lambda match: final.__setitem__(
+        match.id, [list(snake.get_positions()) for snake in match.game.get_snakes()])
+    port = await server.start("127.0.0.1", 0)
+
+    rng = random.Random(seed)
+    clients = [LoopbackClient(rng.randrange(1 << 63)) for _ in range(games * 2)]
+    start = time.perf_counter()
+    await asyncio.gather(*[client.run("127.0.0.1", port) for client in clients])
+    elapsed = time.perf_counter() - start
+    await server.stop()
+
+    mismatches = 0
+    for client in clients:
+        mirror = client.mirror
+        if mirror is None or [list(snake) for snake in mirror.snakes] != final.get(client.match):
+            mismatches += 1
+    histogram = instruments.histogram("tick")
+    return {
+        "matches": server.matches_played,
+        "server_ticks": server.ticks,
+        "seconds": elapsed,
+        "overruns": server.overruns,
+        "mean_tick_ms": histogram.mean() * 1e3,
+        "max_tick_ms": histogram.max * 1e3,
+        "mismatches": mismatches,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host two player snake matches over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--width", type=int, default=30)
+    parser.add_argument("--height", type=int, default=20)
+    parser.add_argument("--tick-rate", type=float, default=10)
+    parser.add_argument("--max-ticks", type=int, default=10000, help="call a match a draw after this many ticks")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--loopback", type=int, metavar="GAMES",
+                        help="instead of serving, play this many matches between in-process clients")
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    if args.loopback:
+        stats = loop.run_until_complete(loopback(args.loopback, args.width, args.height, args.tick_rate,
+                                                 args.max_ticks, args.seed))
+        print("{matches} matches, {server_ticks} server ticks in {seconds:.1f}s".format(**stats))
+        print("tick mean {mean_tick_ms:.2f}ms, max {max_tick_ms:.2f}ms, {overruns} overruns".format(**stats))
+        print("{mismatches} client mirrors out of sync".format(**stats))
+        return
+
+    server = Server(args.width, args.height, args.tick_rate, args.max_ticks, args.seed)
+    loop.run_until_complete(server.start(args.host, args.port))
+    print("Serving on {}:{}".format(args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.stop())
+
+
+if __name__ == '__main__':
+    main()
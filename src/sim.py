@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""sim.py: Headless simulation of snake games, no pygame and no frame limit
+
+Usage: python sim.py --games 1000 --policy greedy --seed 1
+"""
+
+import argparse
+import random
+import signal
+import time
+
+from snake import *
+import agents
+import instrument
+import replay
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+DIRECTIONS = list(Direction)
+OFFSETS = [MOVES[d] for d in DIRECTIONS]
+
+
+# A policy is a callable policy(game, player) that returns a Direction, or False to keep
+# going straight. player is 1 for SinglePlayerGame and counts from 1 for TwoPlayerGame and
+# MultiPlayerGame.
+
+def get_player_snake(game, player):
+    if isinstance(game, SinglePlayerGame):
+        return game.get_snake()
+    return game.get_snake(player - 1)
+
+
+def get_player_direction(game, player):
+    if isinstance(game, SinglePlayerGame):
+        return game.last_direction
+    return game.last_directions[player - 1]
+
+
+def is_safe(game, pos):
+    x, y = pos
+    return 0 <= x < game.width and 0 <= y < game.height and game.board.is_free(pos)
+
+
+def straight_policy(rng):
+    def policy(game, player):
+        return False
+    return policy
+
+
+def random_policy(rng):
+    def policy(game, player):
+        return rng.choice(DIRECTIONS)
+    return policy
+
+
+def greedy_policy(rng):
+    # Step towards the nearest apple, never into a wall or an occupied cell if there is a choice
+    def policy(game, player):
+        x, y = get_player_snake(game, player).get_head_position()
+        apple_x, apple_y = game.nearest_apple((x, y)).get_position()
+        best = None
+        best_distance = None
+        for direction, (dx, dy) in zip(DIRECTIONS, OFFSETS):
+            pos = (x + dx, y + dy)
+            if not is_safe(game, pos):
+                continue
+            distance = abs(pos[0] - apple_x) + abs(pos[1] - apple_y)
+            if best is None or distance < best_distance or (distance == best_distance and rng.random() < 0.5):
+                best = direction
+                best_distance = distance
+        return best or False
+    return policy
+
+
+POLICIES = {
+    "straight": straight_policy,
+    "random": random_policy,
+    "greedy": greedy_policy,
+    "bfs": agents.bfs_policy,
+    "hamiltonian": agents.hamiltonian_policy,
+}
+
+
+def ignore_interrupt():
+    # For worker processes; the parent handles Ctrl-C and stops them itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def make_policy(name, rng):
+    if name not in POLICIES:
+        raise ValueError("Unknown policy " + repr(name) + ", choose from " + ", ".join(sorted(POLICIES)))
+    return POLICIES[name](rng)
+
+
+def play_single(game, policy, max_ticks, recorder=None):
+    if recorder:
+        recorder.begin(game)
+    ticks = 0
+    while ticks < max_ticks:
+        ticks += 1
+        direction = policy(game, 1)
+        running = game.update(direction)
+        if recorder:
+            recorder.record(game, direction)
+        if not running:
+            break
+    if recorder:
+        recorder.end()
+    return ticks
+
+
+def play_double(game, policy_1, policy_2, max_ticks, recorder=None):
+    if recorder:
+        recorder.begin(game)
+    ticks = 0
+    while ticks < max_ticks:
+        ticks += 1
+        direction_1 = policy_1(game, 1)
+        direction_2 = policy_2(game, 2)
+        running = game.update(direction_1, direction_2)
+        if recorder:
+            recorder.record(game, direction_1, direction_2)
+        if not running:
+            break
+    if recorder:
+        recorder.end()
+    return ticks
+
+
+def run(games, policy, opponent=None, players=1, width=15, height=15, seed=None, max_ticks=10000,
+        recorder=None, instruments=None):
+    rng = random.Random(seed)
+    policy_1 = make_policy(policy, random.Random(rng.randrange(1 << 63)))
+    policy_2 = make_policy(opponent or policy, random.Random(rng.randrange(1 << 63)))
+
+    total_ticks = 0
+    total_score = 0
+    start = time.perf_counter()
+    for i in range(games):
+        game_seed = rng.randrange(1 << 63)
+        if players == 1:
+            game = SinglePlayerGame(width, height, game_seed, instruments=instruments)
+            total_ticks += play_single(game, policy_1, max_ticks, recorder)
+            total_score += game.get_snake().get_length()
+        else:
+            game = TwoPlayerGame(width, height, game_seed, instruments=instruments)
+            total_ticks += play_double(game, policy_1, policy_2, max_ticks, recorder)
+            total_score += game.get_snake_1().get_length() + game.get_snake_2().get_length()
+    elapsed = time.perf_counter() - start
+
+    stats = {
+        "games": games,
+        "ticks": total_ticks,
+        "seconds": elapsed,
+        "games_per_second": games / elapsed if elapsed else 0.0,
+        "ticks_per_second": total_ticks / elapsed if elapsed else 0.0,
+        "mean_score": total_score / (games * players) if games else 0.0,
+    }
+    # Agents from agents.py time their own decisions
+    for name, player_policy in (("policy", policy_1), ("opponent", policy_2)):
+        if hasattr(player_policy, "mean_latency"):
+            stats[name + "_latency_us"] = player_policy.mean_latency() * 1e6
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run snake games headless as fast as possible")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--policy", default="greedy", choices=sorted(POLICIES))
+    parser.add_argument("--opponent", choices=sorted(POLICIES), help="policy for player 2, defaults to --policy")
+    parser.add_argument("--players", type=int, default=1, choices=(1, 2))
+    parser.add_argument("--width", type=int, default=15)
+    parser.add_argument("--height", type=int, default=15)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-ticks", type=int, default=10000, help="stop a game after this many ticks")
+    parser.add_argument("--record", metavar="PATH", help="append every game to this replay file")
+    parser.add_argument("--profile", action="store_true", help="print apple placement timings and event counts")
+    parser.add_argument("--prometheus", metavar="PATH", help="write the profile in Prometheus text format")
+    args = parser.parse_args(argv)
+
+    instruments = None
+    if args.profile or args.prometheus:
+        instruments = instrument.Instruments()
+
+    recorder = None
+    if args.record:
+        recorder = replay.ReplayRecorder(args.record)
+    try:
+        stats = run(args.games, args.policy, args.opponent, args.players, args.width, args.height,
+                    args.seed, args.max_ticks, recorder, instruments)
+    finally:
+        if recorder:
+            recorder.close()
+    print("{games} games, {ticks} ticks in {seconds:.3f}s".format(**stats))
+    print("{games_per_second:.1f} games/s, {ticks_per_second:.0f} ticks/s".format(**stats))
+    print("mean score {mean_score:.2f}".format(**stats))
+    for name in ("policy", "opponent"):
+        if name + "_latency_us" in stats and (name == "policy" or args.players == 2):
+            print("{} decision latency {:.1f}us".format(name, stats[name + "_latency_us"]))
+    if args.profile:
+        print(instruments.summary())
+    if args.prometheus:
+        with open(args.prometheus, "w") as file:
+            file.write(instruments.prometheus())
+
+
+if __name__ == '__main__':
+    main()
@@ -2,178 +2,771 @@
 
 """snake.py: Non GUI game logic"""
 
+from array import array
+from collections import deque, namedtuple
 from enum import Enum
+from itertools import islice
 import random
 
+import observe
+from zobrist import get_table
+
 __author__ = "Wesley Soo-Hoo"
 __license__ = "MIT"
 
 
+def new_seed():
+    return random.randrange(1 << 63)
+
+
+class GameRandom:
+    """A game's random.Random, with a state that snapshots and clones can share.
+
+    Reading the Mersenne Twister state costs more than the rest of a clone, so the state is
+    kept once read until the next draw, and a generator built from a shared state is only
+    created when it is first drawn from.
+    """
+
+    __slots__ = ("rng", "state")
+
+    def __init__(self, seed=None, state=None):
+        self.rng = None if state is not None else random.Random(seed)
+        self.state = state
+
+    def get(self):
+        if self.rng is None:
+            # Skips the seeding that random.Random() does before the state is overwritten
+            self.rng = random.Random.__new__(random.Random)
+            self.rng.setstate(self.state)
+        self.state = None
+        return self.rng
+
+    def getstate(self):
+        if self.state is None:
+            self.state = self.rng.getstate()
+        return self.state
+
+    def setstate(self, state):
+        self.rng = None
+        self.state = state
+
+    def copy(self):
+        return GameRandom(state=self.getstate())
+
+
 class SinglePlayerGame:
-    def __init__(self, width, height):
+    def __init__(self, width, height, seed=None, check_occupancy=False, hashing=False, instruments=None,
+                 sparse=None, apples=1):
         self.width = width
         self.height = height
-        self.last_direction = Direction.LEFT
-
-        self.snake = Snake(int(width/2), int(height/2))
-        apple_coords = self.generate_apple_coords()
-        self.apple = Segment(apple_coords[0], apple_coords[1])
+        # The direction the snake last moved in, as a Direction.value
+        self.heading = Direction.LEFT.value
+        # Optional instrument.Instruments for apple placement timings and collision counts
+        self.instruments = instruments
+        # With check_occupancy on, the board is checked against the snake after every update
+        self.check_occupancy = check_occupancy
+
+        # Each game owns its RNG so seeded runs are reproducible
+        self.seed = new_seed() if seed is None else seed
+        self.random = GameRandom(self.seed)
+        self.board = make_board(width, height, sparse)
+
+        # With hashing on, the snakes keep their Zobrist keys up to date as they move
+        self.zobrist = get_table(width, height, 1) if hashing else None
+
+        self.snake = Snake(int(width/2), int(height/2), self.board, self.zobrist)
+        self.food = Food(width, height, apples)
+        self.spawn_apples(apples)
         self.apple_triggered = False
         self.alive = True
+        self.won = False
+
+        # Called with the list of events after every update, see subscribe()
+        self.listeners = []
+
+    @property
+    def rng(self):
+        return self.random.get()
+
+    @property
+    def last_direction(self):
+        return DIRECTIONS[self.heading]
+
+    @property
+    def apple(self):
+        return self.food.items[0]
 
     def generate_apple_coords(self):
-        while True:
-            x = random.randint(0, self.width - 1)
-            y = random.randint(0, self.height - 1)
-            if not self.snake.collided((x, y)):
-                print("Generating new apple", x, y)
-                return x, y
-        return False
+        return self.food.random_free(self.board, self.random.get(), self.instruments)
+
+    def spawn_apples(self, apples):
+        for _ in range(apples):
+            apple_coords = self.generate_apple_coords()
+            if apple_coords:
+                self.food.spawn(apple_coords[0], apple_coords[1])
 
     def get_apple(self):
-        return self.apple
+        return self.food.items[0]
+
+    def get_apples(self):
+        return self.food.items
+
+    def nearest_apple(self, pos):
+        return self.food.nearest(pos)
 
     def get_snake(self):
         return self.snake
 
+    def get_snakes(self):
+        return [self.snake]
+
+    def observe(self, out, player=1, rays=None):
+        # See observe.py for the channel layout
+        observe.observe(self, out, player, rays)
+
+    def zobrist_hash(self):
+        zobrist = self.zobrist or get_table(self.width, self.height, 1)
+        key = self.snake.zobrist_key(zobrist) ^ self.food.zobrist_key(zobrist)
+        return key ^ zobrist.state_key(0, self.heading, self.apple_triggered, self.alive)
+
+    def subscribe(self, listener):
+        """Call listener(events) after every update with what changed in that tick.
+
+        Events are (kind, player, x, y) tuples, described in delta.py. restore() is not
+        reported, so a listener following the game needs the full state again after it.
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
     def is_alive(self):
         return self.alive
 
-    def update(self, direction):
-        if not direction:
-            current_direction = self.last_direction
-        elif (self.last_direction == Direction.UP and direction == Direction.DOWN) or \
-            (self.last_direction == Direction.DOWN and direction == Direction.UP) or \
-            (self.last_direction == Direction.LEFT and direction == Direction.RIGHT) or \
-            (self.last_direction == Direction.RIGHT and direction == Direction.LEFT):
-            current_direction = self.last_direction
-        else:
-            self.last_direction = current_direction = direction
-
-        self.snake.update(current_direction, self.apple_triggered)
+    def has_won(self):
+        return self.won
+
+    def snapshot(self, rng=True):
+        # Copying the RNG state is the most expensive part, leave it out for lookup keys
+        snake_state = pack_snake(self.snake, self.width, self.heading, self.apple_triggered, self.alive)
+        return GameState(self.width, self.height, (snake_state,), self.food.positions(), self.won,
+                         self.random.getstate() if rng else None, self.board.free_order())
+
+    def restore(self, state):
+        state.check_size(self.width, self.height)
+        self.board.clear()
+        snake_state = state.snakes[0]
+        self.snake.board = self.board
+        self.snake.set_positions(unpack_positions(snake_state, self.width))
+        self.heading = self.snake.heading = snake_state.direction
+        self.apple_triggered = snake_state.apple_triggered
+        self.alive = snake_state.alive
+        self.food.set_positions(state.apples)
+        self.won = state.finished
+        self.board.set_free_order(state.free_order)
+        if state.rng_state is not None:
+            self.random.setstate(state.rng_state)
+
+    def clone(self):
+        game = self.__class__.__new__(self.__class__)
+        game.__dict__.update(self.__dict__)
+        game.board = self.board.copy()
+        game.snake = self.snake.copy(game.board)
+        game.food = self.food.copy()
+        game.random = self.random.copy()
+        game.listeners = []
+        return game
 
-        self.apple_triggered = self.apple.collided(self.snake.get_head().get_position())
-        if self.apple_triggered:
+    def update(self, direction):
+        # Directions are turned into table indices once; reversing into the neck is ignored
+        if direction:
+            heading = direction.value
+            if heading != REVERSE[self.heading]:
+                self.heading = heading
+
+        if self.listeners:
+            tail = self.snake.get_tail_position()
+            grew = self.apple_triggered
+            moved = None
+
+        snake = self.snake
+        snake.step(self.heading, self.apple_triggered)
+
+        apple = self.food.cells.get(snake.get_head_position())
+        self.apple_triggered = apple is not None
+        if apple is not None:
+            if self.instruments:
+                start = self.instruments.clock()
             apple_coords = self.generate_apple_coords()
-            self.apple.set_position(apple_coords[0], apple_coords[1])
-
-        if self.snake.suicide():
-            self.alive = False
-        elif self.snake.get_head().get_x() < 0:
-            self.alive = False
-        elif self.snake.get_head().get_x() >= self.width:
-            self.alive = False
-        elif self.snake.get_head().get_y() < 0:
-            self.alive = False
-        elif self.snake.get_head().get_y() >= self.height:
+            if apple_coords:
+                apple.set_position(apple_coords[0], apple_coords[1])
+                moved = apple
+            else:
+                # The snake fills the whole board, apart from any other apples
+                self.won = True
+            if self.instruments:
+                self.instruments.record("apple", start)
+                self.instruments.count("apple_placements")
+
+        if self.instruments:
+            self.instruments.count("collision_checks")
+
+        # The board only holds this snake, so a count above one is the head inside the body
+        cell = snake.head_cell
+        if cell == WALL or self.board.counts[cell] > 1:
             self.alive = False
+        if self.check_occupancy:
+            self.board.verify((snake,))
 
-        return self.alive
+        if self.listeners:
+            events = snake_events(0, self.snake, tail, grew, not self.alive)
+            if moved is not None:
+                events.append((APPLE, moved.index) + moved.get_position())
+            for listener in self.listeners:
+                listener(events)
 
+        return self.alive and not self.won
 
-class TwoPlayerGame:
-    def __init__(self, width, height):
+
+class MultiPlayerGame:
+    def __init__(self, width, height, n_players, seed=None, starts=None, check_occupancy=False, hashing=False,
+                 instruments=None, sparse=None, apples=1):
         self.width = width
         self.height = height
-
-        self.last_direction_1 = Direction.LEFT
-        self.last_direction_2 = Direction.LEFT
-
-        self.snake_1 = Snake(int(width/2), int(height/3))
-        self.snake_2 = Snake(int(width/2), int(height/3 * 2))
-        apple_coords = self.generate_apple_coords()
-        self.apple = Segment(apple_coords[0], apple_coords[1])
-        self.apple_triggered_s1 = False
-        self.apple_triggered_s2 = False
-        self.alive_s1 = True
-        self.alive_s2 = True
+        self.n_players = n_players
+        self.instruments = instruments
+        self.check_occupancy = check_occupancy
+
+        self.seed = new_seed() if seed is None else seed
+        self.random = GameRandom(self.seed)
+        self.board = make_board(width, height, sparse)
+
+        self.zobrist = get_table(width, height, n_players) if hashing else None
+
+        if starts is None:
+            starts = self.default_starts()
+        self.snakes = [Snake(x, y, self.board, self.zobrist, i)
+                       for i, (x, y) in enumerate(starts)]
+        for snake in self.snakes:
+            for pos in snake.get_positions():
+                if not self.board.contains(pos) or self.board.count(pos) > 1:
+                    raise ValueError("No room for " + str(n_players) + " snakes on a " +
+                                     str(width) + "x" + str(height) + " board")
+
+        self.headings = [Direction.LEFT.value] * n_players
+        self.apple_triggered = [False] * n_players
+        self.alive = [True] * n_players
+        self.food = Food(width, height, apples)
+        self.spawn_apples(apples)
+        self.board_full = False
+        self.listeners = []
+
+    def default_starts(self):
+        # Spread the snakes over a grid of columns and rows
+        columns = 1
+        while columns * columns < self.n_players:
+            columns += 1
+        rows = (self.n_players + columns - 1) // columns
+        return [(int(self.width / (columns + 1) * (i % columns + 1)),
+                 int(self.height / (rows + 1) * (i // columns + 1))) for i in range(self.n_players)]
+
+    @property
+    def rng(self):
+        return self.random.get()
+
+    @property
+    def last_directions(self):
+        return [DIRECTIONS[heading] for heading in self.headings]
+
+    @property
+    def apple(self):
+        return self.food.items[0]
 
     def generate_apple_coords(self):
-        while True:
-            x = random.randint(0, self.width - 1)
-            y = random.randint(0, self.height - 1)
-            if not (self.snake_1.collided((x, y)) or self.snake_2.collided((x, y))):
-                print("Generating new apple", x, y)
-                return x, y
-        return False
+        return self.food.random_free(self.board, self.random.get(), self.instruments)
+
+    def spawn_apples(self, apples):
+        for _ in range(apples):
+            apple_coords = self.generate_apple_coords()
+            if apple_coords:
+                self.food.spawn(apple_coords[0], apple_coords[1])
 
     def get_apple(self):
-        return self.apple
+        return self.food.items[0]
+
+    def get_apples(self):
+        return self.food.items
+
+    def nearest_apple(self, pos):
+        return self.food.nearest(pos)
+
+    def get_snake(self, player):
+        return self.snakes[player]
+
+    def get_snakes(self):
+        return self.snakes
+
+    def observe(self, out, player=1, rays=None):
+        # See observe.py for the channel layout
+        observe.observe(self, out, player, rays)
+
+    def zobrist_hash(self):
+        zobrist = self.zobrist or get_table(self.width, self.height, self.n_players)
+        key = self.food.zobrist_key(zobrist)
+        for i, snake in enumerate(self.snakes):
+            key ^= snake.zobrist_key(zobrist)
+            key ^= zobrist.state_key(i, self.headings[i], self.apple_triggered[i], self.alive[i])
+        return key
+
+    def subscribe(self, listener):
+        # See SinglePlayerGame.subscribe
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def is_alive(self, player):
+        return self.alive[player]
+
+    def alive_count(self):
+        return sum(self.alive)
+
+    def is_board_full(self):
+        return self.board_full
+
+    def snapshot(self, rng=True):
+        snake_states = tuple(pack_snake(snake, self.width, self.headings[i], self.apple_triggered[i],
+                                        self.alive[i]) for i, snake in enumerate(self.snakes))
+        return GameState(self.width, self.height, snake_states, self.food.positions(), self.board_full,
+                         self.random.getstate() if rng else None, self.board.free_order())
+
+    def restore(self, state):
+        state.check_size(self.width, self.height)
+        if len(state.snakes) != self.n_players:
+            raise ValueError("Snapshot has " + str(len(state.snakes)) + " players, not " + str(self.n_players))
+        self.board.clear()
+        for i, snake_state in enumerate(state.snakes):
+            snake = self.snakes[i]
+            # Dead snakes are off the board
+            snake.board = self.board if snake_state.alive else None
+            snake.set_positions(unpack_positions(snake_state, self.width))
+            self.headings[i] = snake.heading = snake_state.direction
+            self.apple_triggered[i] = snake_state.apple_triggered
+            self.alive[i] = snake_state.alive
+        self.food.set_positions(state.apples)
+        self.board_full = state.finished
+        self.board.set_free_order(state.free_order)
+        if state.rng_state is not None:
+            self.random.setstate(state.rng_state)
+
+    def clone(self):
+        game = self.__class__.__new__(self.__class__)
+        game.__dict__.update(self.__dict__)
+        game.board = self.board.copy()
+        game.snakes = [snake.copy(game.board if snake.board is not None else None) for snake in self.snakes]
+        game.headings = list(self.headings)
+        game.apple_triggered = list(self.apple_triggered)
+        game.alive = list(self.alive)
+        game.food = self.food.copy()
+        game.random = self.random.copy()
+        game.listeners = []
+        return game
+
+    def is_running(self):
+        if self.board_full:
+            return False
+        return self.alive_count() > (1 if self.n_players > 1 else 0)
+
+    def winner(self):
+        """The player (counting from 1) left alive once the game is over, 0 for a draw when
+        no one or more than one is, or None while the game is still running."""
+        if self.is_running():
+            return None
+        alive = [i for i in range(self.n_players) if self.alive[i]]
+        return alive[0] + 1 if len(alive) == 1 else 0
+
+    def update(self, directions):
+        """Move every living snake at once, directions holding one Direction or False per player.
+
+        All snakes move before anything is checked, so a head moving into the cell another
+        tail just left is safe, and two heads meeting in the same cell both die. Every head
+        that lands on an apple grows, and each apple eaten is placed again once. Dead snakes
+        are taken off the board. Returns whether the game is still running.
+        """
+        if self.listeners:
+            tails = [snake.get_tail_position() for snake in self.snakes]
+            grew = list(self.apple_triggered)
+
+        headings = self.headings
+        moved = []
+        for i, snake in enumerate(self.snakes):
+            if not self.alive[i]:
+                continue
+            direction = directions[i]
+            if direction:
+                heading = direction.value
+                if heading != REVERSE[headings[i]]:
+                    headings[i] = heading
+            snake.step(headings[i], self.apple_triggered[i])
+            moved.append(i)
+
+        cells = self.food.cells
+        eaten = []
+        for i in moved:
+            apple = cells.get(self.snakes[i].get_head_position())
+            self.apple_triggered[i] = apple is not None
+            if apple is not None and apple not in eaten:
+                eaten.append(apple)
+        placed = []
+        if eaten:
+            if self.instruments:
+                start = self.instruments.clock()
+            for apple in eaten:
+                apple_coords = self.generate_apple_coords()
+                if apple_coords:
+                    apple.set_position(apple_coords[0], apple_coords[1])
+                    placed.append(apple)
+                else:
+                    self.board_full = True
+            if self.instruments:
+                self.instruments.record("apple", start)
+                self.instruments.count("apple_placements", len(eaten))
+
+        # The board counts every segment of every snake, so a head shares its cell with
+        # anything else exactly when the count is above one
+        counts = self.board.counts
+        died = []
+        for i in moved:
+            cell = self.snakes[i].head_cell
+            if cell == WALL or counts[cell] > 1:
+                died.append(i)
+        for i in died:
+            self.alive[i] = False
+            self.snakes[i].leave_board()
+        if self.check_occupancy:
+            self.board.verify([snake for snake in self.snakes if snake.board is not None])
+        if self.instruments:
+            self.instruments.count("collision_checks", len(moved))
+
+        if self.listeners:
+            events = []
+            for i in moved:
+                events.extend(snake_events(i, self.snakes[i], tails[i], grew[i], not self.alive[i]))
+            for apple in placed:
+                events.append((APPLE, apple.index) + apple.get_position())
+            for listener in self.listeners:
+                listener(events)
+
+        return self.is_running()
+
+
+class TwoPlayerGame(MultiPlayerGame):
+    def __init__(self, width, height, seed=None, check_occupancy=False, hashing=False, instruments=None,
+                 sparse=None):
+        starts = [(int(width/2), int(height/3)), (int(width/2), int(height/3 * 2))]
+        super().__init__(width, height, 2, seed, starts, check_occupancy, hashing, instruments, sparse)
+
+    @property
+    def snake_1(self):
+        return self.snakes[0]
+
+    @property
+    def snake_2(self):
+        return self.snakes[1]
+
+    @property
+    def last_direction_1(self):
+        return DIRECTIONS[self.headings[0]]
+
+    @property
+    def last_direction_2(self):
+        return DIRECTIONS[self.headings[1]]
+
+    @property
+    def apple_triggered_s1(self):
+        return self.apple_triggered[0]
+
+    @property
+    def apple_triggered_s2(self):
+        return self.apple_triggered[1]
+
+    @property
+    def alive_s1(self):
+        return self.alive[0]
+
+    @property
+    def alive_s2(self):
+        return self.alive[1]
 
     def get_snake_1(self):
-        return self.snake_1
+        return self.snakes[0]
 
     def get_snake_2(self):
-        return self.snake_2
+        return self.snakes[1]
 
     def snake_1_alive(self):
-        return self.alive_s1
+        return self.alive[0]
 
     def snake_2_alive(self):
-        return self.alive_s2
+        return self.alive[1]
 
     def update(self, direction1, direction2):
+        return super().update((direction1, direction2))
 
-        if not direction1:
-            current_direction_1 = self.last_direction_1
-        elif (self.last_direction_1 == Direction.UP and direction1 == Direction.DOWN) or \
-            (self.last_direction_1 == Direction.DOWN and direction1 == Direction.UP) or \
-            (self.last_direction_1 == Direction.LEFT and direction1 == Direction.RIGHT) or \
-            (self.last_direction_1 == Direction.RIGHT and direction1 == Direction.LEFT):
-            current_direction_1 = self.last_direction_1
-        else:
-            current_direction_1 = direction1
-
-        if not direction2:
-            current_direction_2 = self.last_direction_2
-        elif (self.last_direction_2 == Direction.UP and direction2 == Direction.DOWN) or \
-            (self.last_direction_2 == Direction.DOWN and direction2 == Direction.UP) or \
-            (self.last_direction_2 == Direction.LEFT and direction2 == Direction.RIGHT) or \
-            (self.last_direction_2 == Direction.RIGHT and direction2 == Direction.LEFT):
-            current_direction_2 = self.last_direction_2
-        else:
-            current_direction_2 = direction2
 
-        self.last_direction_1 = current_direction_1
-        self.last_direction_2 = current_direction_2
+class Board:
+    """Segment counts for every cell of the board, shared by all the snakes in a game.
 
-        self.snake_1.update(current_direction_1, self.apple_triggered_s1)
-        self.snake_2.update(current_direction_2, self.apple_triggered_s2)
+    Everything is kept in arrays rather than lists of ints, which is most of what a game
+    costs in memory.
+    """
 
-        self.apple_triggered_s1 = self.apple.collided(self.snake_1.get_head().get_position())
-        self.apple_triggered_s2 = self.apple.collided(self.snake_2.get_head().get_position())
+    __slots__ = ("width", "height", "moves", "counts", "free", "slots")
 
-        if self.apple_triggered_s1 or self.apple_triggered_s2:
-            apple_coords = self.generate_apple_coords()
-            self.apple.set_position(apple_coords[0], apple_coords[1])
-
-        if self.snake_1.suicide():
-            self.alive_s1 = False
-        elif self.snake_1.get_head().get_x() < 0:
-            self.alive_s1 = False
-        elif self.snake_1.get_head().get_x() >= self.width:
-            self.alive_s1 = False
-        elif self.snake_1.get_head().get_y() < 0:
-            self.alive_s1 = False
-        elif self.snake_1.get_head().get_y() >= self.height:
-            self.alive_s1 = False
-        elif self.snake_2.collided(self.snake_1.get_head().get_position()):
-            self.alive_s1 = False
-
-        if self.snake_2.suicide():
-            self.alive_s2 = False
-        elif self.snake_2.get_head().get_x() < 0:
-            self.alive_s2 = False
-        elif self.snake_2.get_head().get_x() >= self.width:
-            self.alive_s2 = False
-        elif self.snake_2.get_head().get_y() < 0:
-            self.alive_s2 = False
-        elif self.snake_2.get_head().get_y() >= self.height:
-            self.alive_s2 = False
-        elif self.snake_1.collided(self.snake_2.get_head().get_position()):
-            self.alive_s2 = False
-
-        return self.alive_s1 and self.alive_s2
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.moves = get_moves(width, height)
+        self.clear()
+
+    def clear(self):
+        # Free cells (y * width + x) live in an array that is kept dense by swapping the last
+        # cell into any hole, with slots[cell] giving each cell's index in that array. Both
+        # taking and freeing a cell, and picking a random free one, are O(1).
+        self.counts = array("B", bytes(self.width * self.height))
+        self.free = self.moves.cells[:]
+        self.slots = self.moves.cells[:]
+
+    def free_order(self):
+        # Apples are picked by index into the free array, so its order is part of what makes
+        # a restored game play out the same
+        return self.free.tobytes(), self.slots.tobytes()
+
+    def set_free_order(self, free_order):
+        self.free = array(self.moves.typecode)
+        self.free.frombytes(free_order[0])
+        self.slots = array(self.moves.typecode)
+        self.slots.frombytes(free_order[1])
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.width = self.width
+        board.height = self.height
+        board.moves = self.moves
+        board.counts = self.counts[:]
+        board.free = self.free[:]
+        board.slots = self.slots[:]
+        return board
+
+    def occupy(self, pos):
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.occupy_cell(y * self.width + x)
+
+    def vacate(self, pos):
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.vacate_cell(y * self.width + x)
+
+    def occupy_cell(self, cell):
+        self.counts[cell] += 1
+        if self.counts[cell] == 1:
+            slot = self.slots[cell]
+            last = self.free.pop()
+            if last != cell:
+                self.free[slot] = last
+                self.slots[last] = slot
+
+    def vacate_cell(self, cell):
+        self.counts[cell] -= 1
+        if self.counts[cell] == 0:
+            self.slots[cell] = len(self.free)
+            self.free.append(cell)
+
+    def contains(self, pos):
+        x, y = pos
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def count(self, pos):
+        x, y = pos
+        return self.counts[y * self.width + x]
+
+    def is_free(self, pos):
+        x, y = pos
+        return self.counts[y * self.width + x] == 0
+
+    def free_count(self):
+        return len(self.free)
+
+    def verify(self, snakes):
+        """Raise RuntimeError unless the counts hold exactly the on-board segments of snakes and
+        the free list exactly the empty cells, each at its slot."""
+        expected = array("B", bytes(len(self.counts)))
+        for snake in snakes:
+            for x, y in snake.get_positions():
+                if 0 <= x < self.width and 0 <= y < self.height:
+                    expected[y * self.width + x] += 1
+        if expected != self.counts:
+            raise RuntimeError("Board counts out of sync with the snakes")
+        if len(self.free) != self.counts.count(0):
+            raise RuntimeError("Free list out of sync with the board counts")
+        for slot, cell in enumerate(self.free):
+            if self.counts[cell] or self.slots[cell] != slot:
+                raise RuntimeError("Free list out of sync with the board counts")
+
+    def random_free(self, rng, exclude=None, instruments=None):
+        """A random free cell as (x, y), or None if there is none.
+
+        Cells whose position is in exclude are skipped, by drawing again; after RANDOM_TRIES
+        draws the choice is made among the free cells not excluded. Draws beyond the first
+        are counted as apple_retries in instruments.
+        """
+        free = self.free
+        if not free:
+            return None
+        positions = self.moves.positions
+        pos = positions[free[rng.randrange(len(free))]]
+        if not exclude or pos not in exclude:
+            return pos
+        for tries in range(1, RANDOM_TRIES):
+            pos = positions[free[rng.randrange(len(free))]]
+            if pos not in exclude:
+                if instruments:
+                    instruments.count("apple_retries", tries)
+                return pos
+        if instruments:
+            instruments.count("apple_retries", RANDOM_TRIES)
+        # Nearly every free cell is excluded: choose among the rest of the free list
+        rest = [positions[cell] for cell in free if positions[cell] not in exclude]
+        return rng.choice(rest) if rest else None
+
+
+class Counts(dict):
+    """Segment counts of the occupied cells, reading 0 for every other cell."""
+
+    __slots__ = ()
+
+    def __missing__(self, cell):
+        return 0
+
+
+class SparseBoard:
+    """Board for arenas too big to hold anything per cell, like 10000x10000.
+
+    Only occupied cells are stored, in counts, so memory and the cost of a tick depend on
+    how many segments there are rather than on the area. Apples are placed by picking cells
+    at random until a free one comes up, which takes one or two tries on a mostly empty
+    board. There is no free list to snapshot, so free_order() is None.
+    """
+
+    __slots__ = ("width", "height", "moves", "counts")
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.moves = SparseMoves(width, height)
+        self.clear()
+
+    def clear(self):
+        self.counts = Counts()
+
+    def free_order(self):
+        return None
+
+    def set_free_order(self, free_order):
+        pass
+
+    def copy(self):
+        board = SparseBoard.__new__(SparseBoard)
+        board.width = self.width
+        board.height = self.height
+        board.moves = self.moves
+        board.counts = Counts(self.counts)
+        return board
+
+    def occupy(self, pos):
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.counts[y * self.width + x] += 1
+
+    def vacate(self, pos):
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.vacate_cell(y * self.width + x)
+
+    def occupy_cell(self, cell):
+        self.counts[cell] += 1
+
+    def vacate_cell(self, cell):
+        count = self.counts[cell] - 1
+        if count:
+            self.counts[cell] = count
+        else:
+            del self.counts[cell]
+
+    def contains(self, pos):
+        x, y = pos
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def count(self, pos):
+        x, y = pos
+        return self.counts[y * self.width + x]
+
+    def is_free(self, pos):
+        x, y = pos
+        return y * self.width + x not in self.counts
+
+    def free_count(self):
+        return self.width * self.height - len(self.counts)
+
+    def verify(self, snakes):
+        # As Board.verify; only occupied cells are stored, so there is no free list to check
+        expected = {}
+        for snake in snakes:
+            for x, y in snake.get_positions():
+                if 0 <= x < self.width and 0 <= y < self.height:
+                    cell = y * self.width + x
+                    expected[cell] = expected.get(cell, 0) + 1
+        if expected != dict(self.counts):
+            raise RuntimeError("Board counts out of sync with the snakes")
+
+    def random_free(self, rng, exclude=None, instruments=None):
+        # Draws from the whole area, skipping occupied cells and positions in exclude, and
+        # counts every draw after the first as apple_retries in instruments
+        area = self.width * self.height
+        counts = self.counts
+        width = self.width
+        if len(counts) >= area:
+            return None
+        for tries in range(RANDOM_TRIES):
+            cell = rng.randrange(area)
+            if cell not in counts:
+                pos = (cell % width, cell // width)
+                if not exclude or pos not in exclude:
+                    if tries and instruments:
+                        instruments.count("apple_retries", tries)
+                    return pos
+        if instruments:
+            instruments.count("apple_retries", RANDOM_TRIES)
+        # Hardly any room left: the snakes and apples cover nearly the whole area, so going
+        # through it costs about as much as they do
+        rest = [(cell % width, cell // width) for cell in range(area) if cell not in counts]
+        if exclude:
+            rest = [pos for pos in rest if pos not in exclude]
+        return rng.choice(rest) if rest else None
+
+
+# Boards with more cells than this are a SparseBoard unless asked otherwise; a Board and its
+# MoveTable cost tens of bytes per cell
+SPARSE_AREA = 1 << 18
+# Random cells random_free tries for an apple before choosing among all the free ones
+RANDOM_TRIES = 32
+
+
+def make_board(width, height, sparse=None):
+    if sparse is None:
+        sparse = width * height > SPARSE_AREA
+    return SparseBoard(width, height) if sparse else Board(width, height)
 
 
 class Direction(Enum):
@@ -183,59 +776,348 @@ class Direction(Enum):
     RIGHT = 3
 
 
+OPPOSITE = {
+    Direction.UP: Direction.DOWN,
+    Direction.DOWN: Direction.UP,
+    Direction.LEFT: Direction.RIGHT,
+    Direction.RIGHT: Direction.LEFT,
+}
+
+MOVES = {
+    Direction.UP: (0, -1),
+    Direction.DOWN: (0, 1),
+    Direction.LEFT: (-1, 0),
+    Direction.RIGHT: (1, 0),
+}
+
+DIRECTIONS = list(Direction)
+
+# The same moves as plain tuples indexed by Direction.value, which the game loop uses
+# instead of hashing and comparing Enum members
+DX = (0, 0, -1, 1)
+DY = (-1, 1, 0, 0)
+REVERSE = (1, 0, 3, 2)
+
+# Stands for no input wherever directions are stored as numbers, in replays, training data
+# and actions; the value after the last direction, so it fits the same unsigned fields
+NO_DIRECTION = 4
+
+
+def pack_direction(direction):
+    return direction.value if direction else NO_DIRECTION
+
+
+def unpack_direction(code):
+    return DIRECTIONS[code] if code != NO_DIRECTION else False
+
+
+# Cell number for anything off the board
+WALL = -1
+
+
+class MoveTable:
+    """Moves between cells (y * width + x) of one board size.
+
+    neighbours[cell * 4 + heading] is the cell one step away in that direction, or WALL,
+    and positions[cell] is the cell's (x, y) tuple, shared so moving never builds one.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # Smallest array type that holds every cell number
+        self.typecode = "H" if width * height <= 1 << 16 else "I"
+        # Every cell in order, copied to start a board's free list
+        self.cells = array(self.typecode, range(width * height))
+        self.positions = [(cell % width, cell // width) for cell in range(width * height)]
+        self.neighbours = []
+        for x, y in self.positions:
+            for heading in range(4):
+                nx = x + DX[heading]
+                ny = y + DY[heading]
+                self.neighbours.append(ny * width + nx if 0 <= nx < width and 0 <= ny < height else WALL)
+
+    def cell(self, pos):
+        x, y = pos
+        return y * self.width + x if 0 <= x < self.width and 0 <= y < self.height else WALL
+
+    def intern(self, pos):
+        # The shared tuple for an on-board position
+        cell = self.cell(pos)
+        return self.positions[cell] if cell != WALL else pos
+
+
+class CellPositions:
+    # positions[cell] without the table
+    __slots__ = ("width",)
+
+    def __init__(self, width):
+        self.width = width
+
+    def __getitem__(self, cell):
+        return cell % self.width, cell // self.width
+
+
+class CellNeighbours:
+    # neighbours[cell * 4 + heading] without the table
+    __slots__ = ("width", "height")
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def __getitem__(self, index):
+        cell, heading = divmod(index, 4)
+        y, x = divmod(cell, self.width)
+        x += DX[heading]
+        y += DY[heading]
+        return y * self.width + x if 0 <= x < self.width and 0 <= y < self.height else WALL
+
+
+class SparseMoves(MoveTable):
+    """MoveTable for a SparseBoard, working every lookup out when it is made instead of
+    holding a table as big as the board. Positions are not interned."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.positions = CellPositions(width)
+        self.neighbours = CellNeighbours(width, height)
+
+    def intern(self, pos):
+        return pos
+
+
+move_tables = {}
+
+
+def get_moves(width, height):
+    # Shared by every board of the same size
+    key = (width, height)
+    if key not in move_tables:
+        move_tables[key] = MoveTable(width, height)
+    return move_tables[key]
+
+# One snake inside a GameState. The head is kept as (x, y) because a dead snake's head can
+# be off the board; the rest of the body is packed as y * width + x, head end first.
+SnakeState = namedtuple("SnakeState", "head body direction apple_triggered alive")
+
+
+def pack_snake(snake, width, heading, apple_triggered, alive):
+    body = tuple(y * width + x for x, y in islice(snake.get_positions(), 1, None))
+    return SnakeState(snake.get_head_position(), body, heading, apple_triggered, alive)
+
+
+def unpack_positions(snake_state, width):
+    positions = [snake_state.head]
+    for cell in snake_state.body:
+        positions.append((cell % width, cell // width))
+    return positions
+
+
+class GameState:
+    """Immutable snapshot of a game made by snapshot() and applied with restore().
+
+    Equality and hashing cover the position (snakes, apples, whether the game is finished)
+    but not the RNG state or the order of the free cells, so snapshots can be used
+    directly as transposition-table keys.
+    """
+
+    __slots__ = ("width", "height", "snakes", "apples", "finished", "rng_state", "free_order", "hash")
+
+    def __init__(self, width, height, snakes, apples, finished, rng_state, free_order):
+        self.width = width
+        self.height = height
+        self.snakes = snakes
+        # (x, y) of every apple, in the order of Food.items
+        self.apples = apples
+        self.finished = finished
+        self.rng_state = rng_state
+        self.free_order = free_order
+        self.hash = hash((width, height, snakes, apples, finished))
+
+    def key(self):
+        return self.width, self.height, self.snakes, self.apples, self.finished
+
+    def check_size(self, width, height):
+        if (width, height) != (self.width, self.height):
+            raise ValueError("Snapshot is for a " + str(self.width) + "x" + str(self.height) + " board")
+
+    def __eq__(self, other):
+        return isinstance(other, GameState) and self.hash == other.hash and self.key() == other.key()
+
+    def __hash__(self):
+        return self.hash
+
+
+# Kinds of event passed to game listeners, see delta.py
+HEAD = 0
+TAIL = 1
+GROW = 2
+DEATH = 3
+APPLE = 4
+
+
+def snake_events(player, snake, tail, grew, died):
+    # Events for a snake that just moved, given where its tail was before the move
+    x, y = snake.get_head_position()
+    events = [(HEAD, player, x, y), (TAIL, player) + tail]
+    if grew:
+        events.append((GROW, player) + snake.get_tail_position())
+    if died:
+        events.append((DEATH, player, x, y))
+    return events
+
+
 class Snake:
-    def __init__(self, startx, starty):
-        self.direction = Direction.LEFT
-        self.coords = [
-            Segment(startx, starty),
-            Segment(startx + 1, starty),
-            Segment(startx + 2, starty),
-        ]
+    __slots__ = ("heading", "board", "zobrist", "player", "body", "moves", "head_cell", "hash")
+
+    def __init__(self, startx, starty, board=None, zobrist=None, player=0):
+        self.heading = Direction.LEFT.value
+        self.board = board
+        self.zobrist = zobrist
+        self.player = player
+        # With a board, moves are looked up in its MoveTable and head_cell tracks the head's
+        # cell, WALL once it is off the board. Without one they are worked out from (x, y).
+        self.moves = board.moves if board is not None else None
+        # Positions from head to tail. Moving pushes a new head and pops the tail, so a tick
+        # costs the same no matter how long the snake is. On-board positions are the shared
+        # tuples from the MoveTable, so segments cost no memory of their own.
+        self.body = deque()
+        self.set_body([(startx, starty), (startx + 1, starty), (startx + 2, starty)])
+        for pos in self.body:
+            self.occupy(pos)
+
+        self.hash = zobrist.snake_key(player, self.body) if zobrist else 0
+
+    def set_body(self, positions):
+        if self.moves:
+            self.body = deque(self.moves.intern(pos) for pos in positions)
+            self.head_cell = self.moves.cell(self.body[0])
+        else:
+            self.body = deque(positions)
+            self.head_cell = WALL
+
+    def occupy(self, pos):
+        if self.board is not None:
+            self.board.occupy(pos)
+
+    def vacate(self, pos):
+        if self.board is not None:
+            self.board.vacate(pos)
+
+    @property
+    def direction(self):
+        return DIRECTIONS[self.heading]
+
+    @direction.setter
+    def direction(self, direction):
+        self.heading = direction.value
 
     def get_coords(self):
-        return self.coords
+        # Segments are built on demand from the body and are copies, not live views
+        return [Segment(x, y) for x, y in self.body]
+
+    def get_positions(self):
+        return self.body
+
+    def set_positions(self, positions):
+        # Used by restore(), which clears the board before placing the snakes again
+        self.set_body(positions)
+        for pos in self.body:
+            self.occupy(pos)
+        if self.zobrist:
+            self.hash = self.zobrist.snake_key(self.player, self.body)
+
+    def copy(self, board):
+        snake = Snake.__new__(Snake)
+        snake.heading = self.heading
+        snake.moves = self.moves
+        snake.head_cell = self.head_cell
+        snake.zobrist = self.zobrist
+        snake.player = self.player
+        snake.hash = self.hash
+        snake.board = board
+        snake.body = deque(self.body)
+        return snake
+
+    def leave_board(self):
+        if self.board is not None:
+            for pos in self.body:
+                self.board.vacate(pos)
+            self.board = None
+
+    def zobrist_key(self, zobrist):
+        if zobrist is self.zobrist:
+            return self.hash
+        return zobrist.snake_key(self.player, self.body)
 
     def get_head(self):
-        return self.coords[0]
+        x, y = self.body[0]
+        return Segment(x, y)
+
+    def get_head_position(self):
+        return self.body[0]
+
+    def get_tail_position(self):
+        return self.body[-1]
 
     def suicide(self):
-        head = self.get_head().get_position()
-        for i in range(1, len(self.coords)):
-            if self.coords[i].collided(head):
-                return True
-        return False
+        # Games check collisions on the board; these scan the body without allocating
+        return self.body.count(self.body[0]) > 1
 
     def collided(self, pos):
-        for i in self.coords:
-            if i.collided(pos):
-                return True
-        return False
+        return pos in self.body
 
     def get_length(self):
-        return len(self.coords)
+        return len(self.body)
 
     def update(self, direction, apple):
         if direction:
-            self.direction = direction
-
-        last_coords_a = self.coords[0].get_position()
-        last_coords_b = self.coords[0].get_position()
-        self.coords[0].update(direction)
-
-        for i in range(1, len(self.coords)):
-            if i % 2 == 0:
-                last_coords_b = self.coords[i].get_position()
-                self.coords[i].set_position(last_coords_a[0], last_coords_a[1])
-            else:
-                last_coords_a = self.coords[i].get_position()
-                self.coords[i].set_position(last_coords_b[0], last_coords_b[1])
-            last_coords = self.coords[i].get_position()
-
+            self.heading = direction.value
+        self.step(self.heading, apple)
+
+    def step(self, heading, apple):
+        """Move one cell towards heading, a Direction.value, growing if apple is set."""
+        self.heading = heading
+        body = self.body
+        neck = body[0]
+        cell = self.head_cell
+        if cell != WALL:
+            cell = self.moves.neighbours[cell * 4 + heading]
+        if cell != WALL:
+            head = self.moves.positions[cell]
+        else:
+            head = (neck[0] + DX[heading], neck[1] + DY[heading])
+        self.head_cell = cell
+        zobrist = self.zobrist
+
+        if zobrist:
+            # Only the ends of the body change
+            self.hash ^= zobrist.link_key(self.player, body[-1], body[-2]) ^ \
+                zobrist.head_key(self.player, neck) ^ zobrist.head_key(self.player, head) ^ \
+                zobrist.link_key(self.player, neck, head)
+
+        board = self.board
+        tail = body.pop()
+        body.appendleft(head)
+        if board is not None:
+            board.vacate(tail)
+            if cell != WALL:
+                board.occupy_cell(cell)
+
+        # Grow the tick after eating by doubling up the tail; it separates on the next move
         if apple:
-            self.coords.append(Segment(last_coords[0], last_coords[1]))
+            tail = body[-1]
+            body.append(tail)
+            self.occupy(tail)
+            if zobrist:
+                self.hash ^= zobrist.link_key(self.player, tail, tail)
 
 
 class Segment:
+    __slots__ = ("x", "y", "active")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -261,14 +1143,9 @@ class Segment:
         self.y = y
 
     def update(self, direction):
-        if direction == Direction.UP:
-            self.up()
-        elif direction == Direction.DOWN:
-            self.down()
-        elif direction == Direction.LEFT:
-            self.left()
-        elif direction == Direction.RIGHT:
-            self.right()
+        if direction:
+            self.x += DX[direction.value]
+            self.y += DY[direction.value]
 
     def left(self):
         self.x -= 1
@@ -293,3 +1170,175 @@ class Segment:
 
     def collided(self, position):
         return self.x == position[0] and self.y == position[1]
+
+
+class Apple(Segment):
+    """An apple in a Food. Moving it with the setters keeps the Food's index up to date."""
+
+    __slots__ = ("food", "index")
+
+    def __init__(self, x, y, food, index):
+        super().__init__(x, y)
+        self.food = food
+        # Position in food.items, which only changes if another apple is removed
+        self.index = index
+
+    def set_x(self, x):
+        self.food.move(self, x, self.y)
+
+    def set_y(self, y):
+        self.food.move(self, self.x, y)
+
+    def set_position(self, x, y):
+        self.food.move(self, x, y)
+
+
+class Food:
+    """Every apple on the board, one per cell.
+
+    cells maps the position of each apple to it, so spawning, moving, removing and checking
+    a cell for food are all O(1). Apples are also filed in square buckets sized to hold about
+    one apple each, which nearest() searches ring by ring outwards from a position and
+    within() scans for a region, so neither looks at every apple.
+    """
+
+    def __init__(self, width, height, expected=1):
+        self.width = width
+        self.height = height
+        self.expected = expected
+        self.size = max(4, int((width * height / max(1, expected)) ** 0.5))
+        self.columns = (width + self.size - 1) // self.size
+        self.rows = (height + self.size - 1) // self.size
+        self.items = []
+        self.cells = {}
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def bucket(self, x, y):
+        key = y // self.size * self.columns + x // self.size
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = {}
+        return bucket
+
+    def add(self, apple):
+        pos = apple.get_position()
+        self.cells[pos] = apple
+        self.bucket(pos[0], pos[1])[pos] = apple
+
+    def discard(self, apple):
+        pos = apple.get_position()
+        if self.cells.get(pos) is apple:
+            del self.cells[pos]
+            del self.bucket(pos[0], pos[1])[pos]
+
+    def spawn(self, x, y):
+        apple = Apple(x, y, self, len(self.items))
+        self.items.append(apple)
+        self.add(apple)
+        return apple
+
+    def move(self, apple, x, y):
+        self.discard(apple)
+        apple.x = x
+        apple.y = y
+        self.add(apple)
+
+    def remove(self, apple):
+        # Swap the last apple into the hole so items stays dense
+        self.discard(apple)
+        last = self.items.pop()
+        if last is not apple:
+            last.index = apple.index
+            self.items[apple.index] = last
+
+    def at(self, pos):
+        return self.cells.get(pos)
+
+    def positions(self):
+        return tuple(apple.get_position() for apple in self.items)
+
+    def set_positions(self, positions):
+        if len(positions) == len(self.items):
+            for apple, (x, y) in zip(self.items, positions):
+                self.discard(apple)
+                apple.x = x
+                apple.y = y
+            for apple in self.items:
+                self.add(apple)
+            return
+        self.items = []
+        self.cells = {}
+        self.buckets = {}
+        for x, y in positions:
+            self.spawn(x, y)
+
+    def copy(self):
+        food = Food(self.width, self.height, self.expected)
+        for apple in self.items:
+            food.spawn(apple.x, apple.y)
+        return food
+
+    def zobrist_key(self, zobrist):
+        key = 0
+        for apple in self.items:
+            key ^= zobrist.apple_key(apple.get_position())
+        return key
+
+    def random_free(self, board, rng, instruments=None):
+        """A random free cell of board without an apple on it, or None if there is none."""
+        return board.random_free(rng, self.cells, instruments)
+
+    def nearest(self, pos):
+        """The apple closest to pos by Manhattan distance, ties going to the smallest (x, y),
+        or None if there are no apples."""
+        if len(self.items) < 2:
+            return self.items[0] if self.items else None
+        x, y = pos
+        size = self.size
+        column = min(max(x // size, 0), self.columns - 1)
+        row = min(max(y // size, 0), self.rows - 1)
+        best = None
+        best_distance = None
+        for ring in range(max(self.columns, self.rows)):
+            # Every cell in this ring of buckets is more than (ring - 1) * size cells away
+            if best is not None and best_distance <= (ring - 1) * size:
+                break
+            for bucket_row in range(row - ring, row + ring + 1):
+                if not 0 <= bucket_row < self.rows:
+                    continue
+                if bucket_row in (row - ring, row + ring):
+                    bucket_columns = range(max(column - ring, 0), min(column + ring, self.columns - 1) + 1)
+                else:
+                    bucket_columns = [c for c in (column - ring, column + ring) if 0 <= c < self.columns]
+                for bucket_column in bucket_columns:
+                    bucket = self.buckets.get(bucket_row * self.columns + bucket_column)
+                    if not bucket:
+                        continue
+                    for apple_pos, apple in bucket.items():
+                        distance = abs(apple_pos[0] - x) + abs(apple_pos[1] - y)
+                        if best is None or distance < best_distance or \
+                                (distance == best_distance and apple_pos < best.get_position()):
+                            best = apple
+                            best_distance = distance
+        return best
+
+    def within(self, x, y, width, height):
+        """The apples in the width x height region with its top left corner at (x, y)."""
+        if x <= 0 and y <= 0 and x + width >= self.width and y + height >= self.height:
+            return self.items
+        size = self.size
+        found = []
+        for bucket_row in range(max(y // size, 0), min((y + height - 1) // size, self.rows - 1) + 1):
+            for bucket_column in range(max(x // size, 0), min((x + width - 1) // size, self.columns - 1) + 1):
+                bucket = self.buckets.get(bucket_row * self.columns + bucket_column)
+                if bucket:
+                    for (apple_x, apple_y), apple in bucket.items():
+                        if x <= apple_x < x + width and y <= apple_y < y + height:
+                            found.append(apple)
+        return found
@@ -0,0 +1,11 @@
+"""conftest.py: Lets the tests import the modules in src the way the scripts there do"""
+
+import os
+import sys
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# No window is ever opened by the tests
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
@@ -0,0 +1,39 @@
+"""test_agents.py: The baseline agents keep eating instead of circling for ever"""
+
+from snake import *
+import agents
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def longest_hungry_stretch(agent, size, seed, max_ticks):
+    # Most ticks the snake went without eating, and its length at the end
+    game = SinglePlayerGame(size, size, seed)
+    length = game.get_snake().get_length()
+    hungry = 0
+    longest = 0
+    for _ in range(max_ticks):
+        if not game.update(agent(game, 1)):
+            break
+        if game.get_snake().get_length() != length:
+            length = game.get_snake().get_length()
+            hungry = 0
+        else:
+            hungry += 1
+            longest = max(longest, hungry)
+    return longest, length
+
+
+def test_bfs_does_not_livelock():
+    for size in (10, 15):
+        for seed in range(4):
+            longest, length = longest_hungry_stretch(agents.BFSAgent(), size, seed, 3000)
+            assert longest < 2 * size * size, (size, seed, longest)
+            assert length > size * size // 3, (size, seed, length)
+
+
+def test_hamiltonian_falls_back_on_odd_boards():
+    longest, length = longest_hungry_stretch(agents.HamiltonianAgent(), 11, 1, 3000)
+    assert longest < 2 * 11 * 11
+    assert length > 11 * 11 // 3
@@ -0,0 +1,32 @@
+"""test_apples.py: Apples land on free cells, one per cell, and retried draws are counted"""
+
+import pytest
+
+from snake import *
+import instrument
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+@pytest.mark.parametrize("sparse", (False, True))
+def test_crowded_board_fills_every_free_cell(sparse):
+    # 3 snake cells on a 6x6 board leave 33 cells, all of which get an apple
+    instruments = instrument.Instruments()
+    game = SinglePlayerGame(6, 6, 1, sparse=sparse, apples=40, instruments=instruments)
+    positions = game.food.positions()
+    assert len(positions) == 33 == len(set(positions))
+    assert all(game.board.is_free(pos) for pos in positions)
+    assert game.food.random_free(game.board, game.random.get()) is None
+
+
+@pytest.mark.parametrize("sparse", (False, True))
+def test_retries_are_counted(sparse):
+    instruments = instrument.Instruments()
+    game = SinglePlayerGame(8, 8, 2, sparse=sparse, apples=50, instruments=instruments)
+    apples = len(game.food.positions())
+    for _ in range(200):
+        if not game.update(False):
+            break
+    assert instruments.counters["apple_retries"] > 0
+    assert len(set(game.food.positions())) == apples
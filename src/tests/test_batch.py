@@ -0,0 +1,54 @@
+"""test_batch.py: Every board of a BatchSinglePlayerGame plays like its own SinglePlayerGame"""
+
+import random
+
+import numpy as np
+import pytest
+
+from snake import *
+from batch import BatchSinglePlayerGame
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+@pytest.mark.parametrize("width, height", ((8, 8), (12, 9)))
+def test_batch_matches_single_player_games(width, height):
+    n = 16
+    batch = BatchSinglePlayerGame(n, width, height, seed=1)
+    games = [SinglePlayerGame(width, height, seed) for seed in range(n)]
+    # The batch draws its own apples, so every board is given its game's apple instead
+    for i, game in enumerate(games):
+        batch.set_apple(i, *game.get_apple().get_position())
+
+    rng = random.Random(1)
+    greedy = sim.make_policy("greedy", rng)
+    eaten = 0
+    for _ in range(1000):
+        directions = []
+        for game in games:
+            roll = rng.random()
+            if not game.is_alive() or roll < 0.05:
+                direction = None
+            elif roll < 0.1:
+                direction = rng.choice(DIRECTIONS)
+            else:
+                direction = greedy(game, 1)
+            directions.append(direction)
+            if game.is_alive():
+                game.update(direction)
+        batch.step(np.array([pack_direction(direction) for direction in directions], dtype=np.int8))
+
+        for i, game in enumerate(games):
+            assert bool(batch.alive[i]) == game.is_alive()
+            assert batch.get_coords(i) == list(game.get_snake().get_positions())
+            assert batch.length[i] == game.get_snake().get_length()
+            assert batch.last_direction[i] == game.heading
+            if game.is_alive() and game.apple_triggered:
+                eaten += 1
+                batch.set_apple(i, *game.get_apple().get_position())
+            assert batch.get_apple(i) == game.get_apple().get_position()
+        if not batch.alive.any():
+            break
+    assert eaten > n
@@ -0,0 +1,77 @@
+"""test_delta.py: A Mirror fed the encoded events of every tick stays the same as the game"""
+
+import random
+
+import pytest
+
+from snake import *
+import delta
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def assert_mirrors(mirror, game):
+    alive = [game.is_alive()] if isinstance(game, SinglePlayerGame) else game.alive
+    assert mirror.alive == list(alive)
+    assert [list(snake) for snake in mirror.snakes] == [list(snake.get_positions()) for snake in game.get_snakes()]
+    assert mirror.apples == [apple.get_position() for apple in game.get_apples()]
+    if isinstance(game, SinglePlayerGame) and not game.is_alive():
+        # A dead single player snake stays on the board, but the Mirror takes it off
+        return
+    for y in range(game.height):
+        for x in range(game.width):
+            assert mirror.is_free((x, y)) == game.board.is_free((x, y))
+
+
+def play_mirrored(game, players, seed):
+    # Play the game, checking a Mirror fed only the encoded ticks against it after every
+    # tick, and return how many ticks were played
+    events = delta.EventBuffer()
+    game.subscribe(events)
+    mirror = delta.decode_state(delta.encode_state(game))[0]
+
+    rng = random.Random(seed)
+    greedy = sim.make_policy("greedy", rng)
+    ticks = 0
+    for _ in range(1500):
+        directions = [rng.choice(DIRECTIONS) if rng.random() < 0.05 else greedy(game, player + 1)
+                      for player in range(players)]
+        running = game.update(directions[0]) if players == 1 else game.update(directions)
+
+        buffer = events.encoded()
+        offset = 0
+        while offset < len(buffer):
+            tick, tick_events, offset = delta.decode_tick(buffer, offset)
+            ticks += 1
+            assert tick == ticks
+            mirror.apply(tick_events)
+        assert_mirrors(mirror, game)
+        if not running:
+            break
+
+    # The state encoded at the end decodes to the same Mirror as well
+    assert_mirrors(delta.decode_state(delta.encode_state(game))[0], game)
+    return ticks
+
+
+@pytest.mark.parametrize("players, apples", ((1, 1), (1, 3), (2, 4), (4, 6)))
+def test_mirror_follows_the_game(players, apples):
+    ticks = 0
+    for seed in range(5):
+        if players == 1:
+            game = SinglePlayerGame(10, 10, seed, apples=apples)
+        else:
+            game = MultiPlayerGame(12, 12, players, seed, apples=apples)
+        ticks += play_mirrored(game, players, seed)
+    assert ticks > 50
+
+
+def test_apple_events_past_256_apples():
+    # The apple index goes in the event's player field, which has to hold more than a byte
+    game = MultiPlayerGame(30, 30, 2, 1, apples=400)
+    indices = []
+    game.subscribe(lambda events: indices.extend(player for kind, player, x, y in events if kind == APPLE))
+    assert play_mirrored(game, 2, 1) > 0
+    assert max(indices) > 255
@@ -0,0 +1,55 @@
+"""test_env.py: A SubprocVectorEnv steps, resets and shuts down like the scalar envs it holds"""
+
+import random
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from snake import *
+import env
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def test_subproc_vector_env_matches_scalar_envs():
+    n = 4
+    vector = env.SubprocVectorEnv(n, workers=2, seed=1, width=8, height=8)
+    name = vector.memory.name
+    try:
+        # The workers build their envs from these seeds, so the scalar envs play the same games
+        scalars = [env.SnakeEnv(8, 8, seed=int(seed)) for seed in vector.buffers.seeds]
+        observations, info = vector.reset()
+        for i, scalar in enumerate(scalars):
+            scalar.reset()
+            assert np.array_equal(observations[i], scalar.board)
+
+        rng = random.Random(1)
+        episodes = [0] * n
+        for _ in range(200):
+            # Mostly straight on, so episodes end against a wall
+            actions = [rng.randrange(env.ACTIONS) if rng.random() < 0.3 else NO_DIRECTION for _ in range(n)]
+            observations, rewards, terminated, truncated, info = vector.step(np.array(actions, dtype=np.int8))
+            for i, scalar in enumerate(scalars):
+                _, reward, done, cut, _ = scalar.step(actions[i])
+                assert rewards[i] == np.float32(reward)
+                assert terminated[i] == done
+                assert truncated[i] == cut
+                if done or cut:
+                    episodes[i] += 1
+                    assert np.array_equal(info["final_observation"][i], scalar.board)
+                    assert info["episode_return"][i] == np.float32(scalar.episode_return)
+                    assert info["episode_length"][i] == scalar.steps
+                    scalar.reset()
+                # After a game over, the board already shows the next episode
+                assert np.array_equal(observations[i], scalar.board)
+        assert min(episodes) >= 3
+    finally:
+        vector.close()
+
+    for process in vector.processes:
+        assert not process.is_alive()
+        assert process.exitcode == 0
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name)
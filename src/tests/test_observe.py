@@ -0,0 +1,41 @@
+"""test_observe.py: Observations of a game on a SparseBoard match the dense Board's"""
+
+import random
+
+import numpy as np
+import pytest
+
+from snake import *
+import observe
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+@pytest.mark.parametrize("players", (1, 2, 4))
+def test_sparse_board_observations_match_dense(players):
+    if players == 1:
+        dense = SinglePlayerGame(12, 12, 4)
+        sparse = SinglePlayerGame(12, 12, 4, sparse=True)
+    else:
+        dense = MultiPlayerGame(12, 12, players, 4, apples=3)
+        sparse = MultiPlayerGame(12, 12, players, 4, sparse=True, apples=3)
+    shape = (observe.CHANNELS, 12, 12)
+    expected = np.zeros(shape, np.float32)
+    actual = np.zeros(shape, np.float32)
+    expected_rays = np.zeros(observe.RAYS, np.float32)
+    actual_rays = np.zeros(observe.RAYS, np.float32)
+
+    greedy = sim.make_policy("greedy", random.Random(4))
+    for _ in range(300):
+        # The sparse game draws its apples differently, so it is put in the dense game's place
+        sparse.restore(dense.snapshot())
+        for player in range(1, players + 1):
+            dense.observe(expected, player, expected_rays)
+            sparse.observe(actual, player, actual_rays)
+            assert np.array_equal(actual, expected)
+            assert np.array_equal(actual_rays, expected_rays)
+        directions = [greedy(dense, player + 1) for player in range(players)]
+        if not (dense.update(directions[0]) if players == 1 else dense.update(directions)):
+            break
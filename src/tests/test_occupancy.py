@@ -0,0 +1,57 @@
+"""test_occupancy.py: The board counts and free list stay exactly in sync with the snakes"""
+
+import random
+
+import pytest
+
+from snake import *
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def play(game, players, ticks, seed=0):
+    # Random turns, so the snakes hit walls, themselves and each other
+    policy = sim.make_policy("random", random.Random(seed))
+    for _ in range(ticks):
+        directions = [policy(game, player + 1) for player in range(players)]
+        if isinstance(game, SinglePlayerGame):
+            running = game.update(directions[0])
+        elif isinstance(game, TwoPlayerGame):
+            running = game.update(*directions)
+        else:
+            running = game.update(directions)
+        if not running:
+            return
+
+
+@pytest.mark.parametrize("sparse", (False, True))
+def test_soak(sparse):
+    for seed in range(20):
+        play(SinglePlayerGame(8, 8, seed, check_occupancy=True, sparse=sparse), 1, 500, seed)
+        play(TwoPlayerGame(8, 8, seed, check_occupancy=True, sparse=sparse), 2, 500, seed)
+        play(MultiPlayerGame(12, 12, 4, seed, check_occupancy=True, sparse=sparse), 4, 500, seed)
+
+
+@pytest.mark.parametrize("sparse", (False, True))
+def test_stale_count_is_caught(sparse):
+    game = SinglePlayerGame(10, 10, 1, check_occupancy=True, sparse=sparse)
+    game.board.occupy((0, 0))
+    with pytest.raises(RuntimeError):
+        game.update(False)
+
+
+def test_missing_count_is_caught():
+    game = TwoPlayerGame(10, 10, 1, check_occupancy=True)
+    game.board.vacate(game.get_snake_2().get_positions()[1])
+    with pytest.raises(RuntimeError):
+        game.update(False, False)
+
+
+def test_broken_free_list_is_caught():
+    game = SinglePlayerGame(10, 10, 1, check_occupancy=True)
+    board = game.board
+    board.free[0], board.free[1] = board.free[1], board.free[0]
+    with pytest.raises(RuntimeError):
+        game.update(False)
@@ -0,0 +1,39 @@
+"""test_render.py: Incremental repaints give the same frames as drawing everything"""
+
+import random
+
+import pytest
+
+from snake import *
+import export
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def multi_states(players, seed, ticks):
+    # A crowded MultiPlayerGame, so snakes die and the others run over where they were
+    game = MultiPlayerGame(12, 12, players, seed)
+    policy = sim.make_policy("greedy", random.Random(seed))
+    yield game
+    for _ in range(ticks):
+        running = game.update([policy(game, player + 1) if game.is_alive(player) else False
+                               for player in range(players)])
+        yield game
+        if not running:
+            break
+
+
+def frames(states, players, width, incremental):
+    renderer = export.Renderer(width, width, players, 6)
+    renderer.incremental = incremental
+    return list(renderer.frames(states))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_incremental_matches_full_redraw(seed):
+    for players, policies in ((1, ["bfs"]), (2, ["greedy", "random"])):
+        assert frames(export.seeded_states(players, policies, 10, 10, seed, 400), players, 10, True) == \
+            frames(export.seeded_states(players, policies, 10, 10, seed, 400), players, 10, False)
+    assert frames(multi_states(4, seed, 300), 4, 12, True) == frames(multi_states(4, seed, 300), 4, 12, False)
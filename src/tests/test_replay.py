@@ -0,0 +1,65 @@
+"""test_replay.py: Replays play back the recorded games, and the reader closes cleanly"""
+
+import random
+
+import pytest
+
+from snake import *
+import replay
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def record_games(path, players, games=3):
+    # Plays games and returns every game's snakes after each tick
+    recorded = []
+    policies = [sim.make_policy("greedy", random.Random(i)) for i in range(2)]
+    with replay.ReplayRecorder(path) as recorder:
+        for seed in range(games):
+            game = SinglePlayerGame(10, 10, seed) if players == 1 else TwoPlayerGame(10, 10, seed)
+            recorder.begin(game)
+            states = [snake_positions(game)]
+            for _ in range(300):
+                directions = [policy(game, player + 1) for player, policy in enumerate(policies[:players])]
+                running = game.update(*directions)
+                recorder.record(game, *directions)
+                states.append(snake_positions(game))
+                if not running:
+                    break
+            recorder.end()
+            recorded.append(states)
+    return recorded
+
+
+def snake_positions(game):
+    return [list(snake.get_positions()) for snake in game.get_snakes()]
+
+
+@pytest.mark.parametrize("players", (1, 2))
+def test_replay_matches_game(tmp_path, players):
+    path = str(tmp_path / "games.snkr")
+    recorded = record_games(path, players)
+    with replay.ReplayReader(path) as reader:
+        assert len(reader) == len(recorded)
+        for episode, states in zip(reader, recorded):
+            assert [snake_positions(game) for game in episode.states()] == states
+
+
+def test_close_with_episodes_held(tmp_path):
+    path = str(tmp_path / "games.snkr")
+    record_games(path, 1)
+    with replay.ReplayReader(path) as reader:
+        episodes = list(reader)
+        first = reader[0]
+    with pytest.raises(ValueError):
+        first.get_directions(0)
+    assert len(episodes) == 3
+
+
+def test_more_than_two_players_is_refused(tmp_path):
+    with replay.ReplayRecorder(str(tmp_path / "games.snkr")) as recorder:
+        with pytest.raises(ValueError):
+            recorder.begin(MultiPlayerGame(12, 12, 3, 1))
+    assert (tmp_path / "games.snkr").read_bytes() == b""
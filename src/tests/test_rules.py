@@ -0,0 +1,114 @@
+"""test_rules.py: Games play move for move like a plain copy of the original rules"""
+
+import random
+
+import pytest
+
+from snake import *
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def noisy_policy(seed):
+    # Mostly greedy so snakes grow long, with random turns and missing input mixed in
+    rng = random.Random(seed)
+    greedy = sim.make_policy("greedy", rng)
+
+    def policy(game, player):
+        roll = rng.random()
+        if roll < 0.04:
+            return rng.choice(DIRECTIONS)
+        if roll < 0.06:
+            return None
+        return greedy(game, player)
+    return policy
+
+
+# Kept separate from snake.OPPOSITE so the baseline does not share tables with the engine
+REVERSE = {
+    Direction.UP: Direction.DOWN,
+    Direction.DOWN: Direction.UP,
+    Direction.LEFT: Direction.RIGHT,
+    Direction.RIGHT: Direction.LEFT,
+}
+
+
+class BaselineSnake:
+    """The rules of the first version of the game, with the body as a plain list."""
+
+    def __init__(self, startx, starty):
+        self.body = [(startx, starty), (startx + 1, starty), (startx + 2, starty)]
+        self.last_direction = Direction.LEFT
+        self.apple_triggered = False
+        self.alive = True
+
+    def turn(self, direction):
+        if direction and direction != REVERSE[self.last_direction]:
+            self.last_direction = direction
+        return self.last_direction
+
+    def update(self, direction):
+        dx, dy = MOVES[self.turn(direction)]
+        x, y = self.body[0]
+        self.body = [(x + dx, y + dy)] + self.body[:-1]
+        # Growing doubles up the tail on the tick after the apple was eaten
+        if self.apple_triggered:
+            self.body.append(self.body[-1])
+
+    def inside(self, width, height):
+        x, y = self.body[0]
+        return 0 <= x < width and 0 <= y < height
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_single_player_follows_baseline_rules(seed):
+    game = SinglePlayerGame(10, 10, seed)
+    baseline = BaselineSnake(5, 5)
+    apple = game.get_apple().get_position()
+    policy = noisy_policy(seed)
+    eaten = 0
+    for _ in range(2000):
+        direction = policy(game, 1)
+        game.update(direction)
+        baseline.update(direction)
+
+        head = baseline.body[0]
+        baseline.apple_triggered = head == apple
+        baseline.alive = baseline.inside(10, 10) and head not in baseline.body[1:]
+        assert list(game.get_snake().get_positions()) == baseline.body
+        assert game.is_alive() == baseline.alive
+        if not baseline.alive:
+            break
+        if baseline.apple_triggered:
+            eaten += 1
+            apple = game.get_apple().get_position()
+        assert game.get_apple().get_position() == apple
+    assert eaten
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_two_player_follows_baseline_rules(seed):
+    game = TwoPlayerGame(12, 12, seed)
+    baselines = [BaselineSnake(6, 4), BaselineSnake(6, 8)]
+    apple = game.get_apple().get_position()
+    policy = noisy_policy(seed)
+    for _ in range(2000):
+        directions = [policy(game, 1), policy(game, 2)]
+        game.update(*directions)
+        for baseline, direction in zip(baselines, directions):
+            baseline.update(direction)
+
+        for baseline, other in (baselines, baselines[::-1]):
+            head = baseline.body[0]
+            baseline.apple_triggered = head == apple
+            baseline.alive = baseline.inside(12, 12) and head not in baseline.body[1:] and head not in other.body
+        for player, baseline in enumerate(baselines):
+            assert list(game.get_snake(player).get_positions()) == baseline.body
+            assert game.is_alive(player) == baseline.alive
+        if not all(baseline.alive for baseline in baselines):
+            break
+        if any(baseline.apple_triggered for baseline in baselines):
+            apple = game.get_apple().get_position()
+        assert game.get_apple().get_position() == apple
@@ -0,0 +1,28 @@
+"""test_server.py: Server input queues and loopback matches"""
+
+import asyncio
+
+from snake import *
+import server
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def test_full_input_queue_drops_new_turns():
+    player = server.Player(None, None)
+    turns = [Direction.UP, Direction.LEFT, Direction.DOWN, Direction.RIGHT, Direction.UP]
+    for direction in turns:
+        player.queue_direction(direction)
+    assert [player.next_direction() for _ in range(server.INPUT_QUEUE)] == turns[:server.INPUT_QUEUE]
+    assert player.next_direction() is False
+
+
+def test_loopback_mirrors_stay_in_sync():
+    loop = asyncio.new_event_loop()
+    try:
+        stats = loop.run_until_complete(server.loopback(6, 20, 15, tick_rate=200, max_ticks=60, seed=1))
+    finally:
+        loop.close()
+    assert stats["matches"] == 6
+    assert stats["mismatches"] == 0
@@ -0,0 +1,59 @@
+"""test_snapshot.py: Restored and cloned games play on exactly like the original"""
+
+import random
+
+import pytest
+
+from snake import *
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def new_game(players, seed):
+    if players == 1:
+        return SinglePlayerGame(10, 10, seed, apples=2)
+    return MultiPlayerGame(12, 12, players, seed)
+
+
+def play(game, players, directions):
+    # The position and bodies after each tick, played until the game ends
+    trace = []
+    for tick_directions in directions:
+        if players == 1:
+            running = game.update(tick_directions[0])
+        else:
+            running = game.update(tick_directions)
+        trace.append((game.snapshot(rng=False), [list(snake.get_positions()) for snake in game.get_snakes()]))
+        if not running:
+            break
+    return trace
+
+
+@pytest.mark.parametrize("players", (1, 2, 3))
+def test_snapshot_restore_and_clone_replay_the_same_game(players):
+    game = new_game(players, 7)
+    rng = random.Random(7)
+    greedy = sim.make_policy("greedy", rng)
+    for _ in range(30):
+        directions = [greedy(game, player + 1) for player in range(players)]
+        game.update(directions[0] if players == 1 else directions)
+    directions = [[rng.choice(DIRECTIONS + [None]) for _ in range(players)] for _ in range(400)]
+
+    state = game.snapshot()
+    clone = game.clone()
+    expected = play(game, players, directions)
+    assert expected
+
+    # The clone was not affected by the original playing on, and apples come from the same RNG
+    assert play(clone, players, directions) == expected
+    game.restore(state)
+    assert game.snapshot() == state
+    assert game.snapshot().free_order == state.free_order
+    assert play(game, players, directions) == expected
+
+    # Restoring into a fresh game of the same size gives the same game too
+    fresh = new_game(players, 99)
+    fresh.restore(state)
+    assert play(fresh, players, directions) == expected
@@ -0,0 +1,58 @@
+"""test_tournament.py: A tournament resumed from a checkpoint ends where an uninterrupted one does"""
+
+import pytest
+
+import tournament
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+BOTS = ["greedy", "random", "straight"]
+
+
+def new_tournament():
+    return tournament.Tournament(BOTS, rounds=2, width=8, height=8, seed=5, max_ticks=300)
+
+
+def summary(cup):
+    return ({name: cup.elo.rating(name) for name in BOTS},
+            {name: (standing.wins, standing.draws, standing.losses) for name, standing in cup.standings.items()},
+            cup.results)
+
+
+def test_resumed_tournament_reaches_the_same_ratings(tmp_path):
+    path = str(tmp_path / "cup.json")
+    uninterrupted = new_tournament()
+    for _ in uninterrupted.run(workers=1):
+        pass
+    assert uninterrupted.finished()
+
+    # Stop partway, as Ctrl-C does, then pick up from the checkpoint
+    interrupted = new_tournament()
+    games = interrupted.run(workers=1)
+    for _ in range(5):
+        next(games)
+    games.close()
+    interrupted.save(path)
+
+    resumed = tournament.Tournament.load(path)
+    assert summary(resumed) == summary(interrupted)
+    assert len(resumed.pending()) == len(resumed.matches) - 5
+    for _ in resumed.run(workers=1):
+        pass
+    assert resumed.finished()
+    assert summary(resumed) == summary(uninterrupted)
+
+
+def test_resuming_with_different_options_is_an_error(tmp_path, capsys):
+    path = str(tmp_path / "cup.json")
+    options = ["--bots"] + BOTS + ["--rounds", "1", "--width", "8", "--height", "8", "--seed", "5",
+                                   "--max-ticks", "300", "--workers", "1", "--checkpoint", path]
+    tournament.main(options)
+    with pytest.raises(SystemExit):
+        tournament.main(options[:-2] + ["--rounds", "2", "--checkpoint", path])
+    assert "--rounds" in capsys.readouterr().err
+
+    # The same options, or none of them, resume it
+    tournament.main(options)
+    tournament.main(["--workers", "1", "--checkpoint", path])
@@ -0,0 +1,36 @@
+"""test_ui.py: The UI game loop keeps its tick rate whatever the frame rate"""
+
+import ui
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def run_frames(grid, frames, seconds):
+    # Pretend each frame took seconds, without sleeping through it
+    ticks = 0
+    for _ in range(frames):
+        grid.last_time -= seconds
+        ticks += grid.ticks_due()
+    return ticks
+
+
+def make_ui(fps, tick_rate=None):
+    return ui.SinglePlayerUI(15, 15, 10, 1, 5, fps, tick_rate=tick_rate)
+
+
+def test_low_fps_ticks_once_a_frame():
+    assert run_frames(make_ui(2), 10, 0.5) == 10
+
+
+def test_low_tick_rate():
+    assert run_frames(make_ui(60, tick_rate=1), 180, 1 / 60) in (2, 3)
+
+
+def test_high_tick_rate_at_low_fps():
+    assert run_frames(make_ui(2, tick_rate=1000), 10, 0.5) >= 4990
+
+
+def test_stall_is_not_caught_up():
+    grid = make_ui(60)
+    assert run_frames(grid, 1, 10.0) == int(ui.MAX_LAG * 60)
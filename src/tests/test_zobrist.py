@@ -0,0 +1,53 @@
+"""test_zobrist.py: The key a game keeps up to date equals one worked out from scratch"""
+
+import random
+
+import pytest
+
+from snake import *
+from zobrist import get_table
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+
+def rebuilt_key(game):
+    # The game's Zobrist key worked out from scratch from its snakes, apples and flags
+    snakes = game.get_snakes()
+    zobrist = get_table(game.width, game.height, len(snakes))
+    if isinstance(game, SinglePlayerGame):
+        flags = [(game.heading, game.apple_triggered, game.alive)]
+    else:
+        flags = list(zip(game.headings, game.apple_triggered, game.alive))
+    key = 0
+    for apple in game.get_apples():
+        key ^= zobrist.apple_key(apple.get_position())
+    for player, snake in enumerate(snakes):
+        key ^= zobrist.snake_key(player, list(snake.get_positions()))
+        key ^= zobrist.state_key(player, *flags[player])
+    return key
+
+
+@pytest.mark.parametrize("players", (1, 2, 4))
+def test_incremental_key_matches_rebuilt_key(players):
+    if players == 1:
+        game = SinglePlayerGame(10, 10, 3, hashing=True, apples=3)
+    else:
+        game = MultiPlayerGame(14, 14, players, 3, hashing=True)
+    rng = random.Random(3)
+    greedy = sim.make_policy("greedy", rng)
+    keys = set()
+    for _ in range(1500):
+        assert game.zobrist_hash() == rebuilt_key(game)
+        keys.add(game.zobrist_hash())
+        directions = [rng.choice(DIRECTIONS) if rng.random() < 0.05 else greedy(game, player + 1)
+                      for player in range(players)]
+        if players == 1:
+            running = game.update(directions[0]) and not game.has_won()
+        else:
+            running = game.update(directions)
+        if not running:
+            assert game.zobrist_hash() == rebuilt_key(game)
+            break
+    assert len(keys) > 20
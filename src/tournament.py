@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""tournament.py: Round-robin tournaments between policies on a pool of worker processes
+
+Usage: python tournament.py --bots greedy bfs hamiltonian --rounds 100 --workers 32 --seed 1
+       python tournament.py --checkpoint cup.json ...    (run it again to resume)
+
+Every ordered pair of bots meets rounds times, so each pairing is played from both
+starting positions. A match's game and policies are seeded from the tournament seed and
+the match's number, so it plays out the same whichever worker runs it. A match is a draw
+when both snakes die on the same tick or neither has died after max_ticks. Elo ratings are
+updated as results come back, and the checkpoint keeps every result in the order it
+arrived so a resumed tournament ends up with the same ratings.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+
+from snake import *
+import sim
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+# Matches handed to a worker at once, at most; small enough that results stream back
+MAX_CHUNK = 64
+# What main() plays when neither the command line nor a checkpoint says otherwise; bots
+# defaults to every policy and seed to a random one
+DEFAULTS = {"rounds": 10, "width": 15, "height": 15, "max_ticks": 10000, "k": 16}
+
+
+class Elo:
+    def __init__(self, k=16, initial=1500):
+        self.k = k
+        self.initial = initial
+        self.ratings = {}
+
+    def rating(self, name):
+        return self.ratings.get(name, self.initial)
+
+    def expected(self, a, b):
+        """Expected score of a against b, 1 for a sure win."""
+        return 1 / (1 + 10 ** ((self.rating(b) - self.rating(a)) / 400))
+
+    def update(self, a, b, score):
+        # score is a's: 1 for a win, 0.5 for a draw and 0 for a loss
+        change = self.k * (score - self.expected(a, b))
+        self.ratings[a] = self.rating(a) + change
+        self.ratings[b] = self.rating(b) - change
+
+
+class Standing:
+    def __init__(self, name):
+        self.name = name
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        games = self.games()
+        return (self.wins + 0.5 * self.draws) / games if games else 0.0
+
+
+def schedule(bots, rounds):
+    """The tournament's matches in order, as (policy_1, policy_2) pairs."""
+    pairs = [(a, b) for a in bots for b in bots if a != b]
+    return pairs * rounds
+
+
+def play_match(spec):
+    """Plays one match and returns (index, winner, ticks, length_1, length_2), with winner
+    0 for a draw."""
+    index, policy_1, policy_2, seed, width, height, max_ticks = spec
+    rng = random.Random(seed)
+    game = TwoPlayerGame(width, height, rng.randrange(1 << 63))
+    players = [sim.make_policy(policy_1, random.Random(rng.randrange(1 << 63))),
+               sim.make_policy(policy_2, random.Random(rng.randrange(1 << 63)))]
+    ticks = sim.play_double(game, players[0], players[1], max_ticks)
+    return index, game.winner() or 0, ticks, game.get_snake_1().get_length(), game.get_snake_2().get_length()
+
+
+class Tournament:
+    """A round-robin between sim.POLICIES, played with run() and resumable from save().
+
+    results holds (index, winner, ticks, length_1, length_2) tuples in the order they
+    were recorded.
+    """
+
+    def __init__(self, bots, rounds=1, width=15, height=15, seed=None, max_ticks=10000, k=16):
+        if len(bots) < 2 or len(set(bots)) != len(bots):
+            raise ValueError("A tournament needs at least two different bots")
+        for name in bots:
+            sim.make_policy(name, random.Random())
+        if seed is None:
+            seed = random.randrange(1 << 63)
+
+        self.config = {
+            "bots": list(bots),
+            "rounds": rounds,
+            "width": width,
+            "height": height,
+            "seed": seed,
+            "max_ticks": max_ticks,
+            "k": k,
+        }
+        self.matches = schedule(bots, rounds)
+        self.elo = Elo(k)
+        self.standings = {name: Standing(name) for name in bots}
+        self.results = []
+        self.done = set()
+
+    def match_seed(self, index):
+        return random.Random(self.config["seed"] * len(self.matches) + index).randrange(1 << 63)
+
+    def pending(self):
+        """Specs for play_match of every match without a result."""
+        config = self.config
+        return [(i, policy_1, policy_2, self.match_seed(i), config["width"], config["height"], config["max_ticks"])
+                for i, (policy_1, policy_2) in enumerate(self.matches) if i not in self.done]
+
+    def record(self, result):
+        index, winner = result[0], result[1]
+        if index in self.done:
+            return
+        self.done.add(index)
+        self.results.append(tuple(result))
+        policy_1, policy_2 = self.matches[index]
+        first = self.standings[policy_1]
+        second = self.standings[policy_2]
+        if winner == 1:
+            first.wins += 1
+            second.losses += 1
+            self.elo.update(policy_1, policy_2, 1)
+        elif winner == 2:
+            first.losses += 1
+            second.wins += 1
+            self.elo.update(policy_1, policy_2, 0)
+        else:
+            first.draws += 1
+            second.draws += 1
+            self.elo.update(policy_1, policy_2, 0.5)
+
+    def finished(self):
+        return len(self.done) == len(self.matches)
+
+    def run(self, workers=None):
+        """Play every pending match and yield each result once it has been recorded.
+
+        Stopping early, with Ctrl-C or by closing the generator, keeps the results so far.
+        """
+        specs = self.pending()
+        workers = workers or multiprocessing.cpu_count()
+        if workers == 1:
+            for spec in specs:
+                result = play_match(spec)
+                self.record(result)
+                yield result
+            return
+
+        chunk = max(1, min(MAX_CHUNK, len(specs) // (workers * 8)))
+        pool = multiprocessing.Pool(workers, initializer=sim.ignore_interrupt)
+        try:
+            for result in pool.imap_unordered(play_match, specs, chunk):
+                self.record(result)
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def standings_table(self):
+        lines = ["{:12} {:>8} {:>7} {:>7} {:>7} {:>7} {:>7}".format(
+            "bot", "rating", "games", "wins", "draws", "losses", "score")]
+        for name in sorted(self.standings, key=self.elo.rating, reverse=True):
+            standing = self.standings[name]
+            lines.append("{:12} {:8.1f} {:7d} {:7d} {:7d} {:7d} {:7.3f}".format(
+                name, self.elo.rating(name), standing.games(), standing.wins, standing.draws,
+                standing.losses, standing.score()))
+        return "\n".join(lines)
+
+    def save(self, path):
+        # Written next to path and renamed over it, so a crash never leaves half a file
+        data = {
+            "config": self.config,
+            "results": self.results,
+            "ratings": {name: self.elo.rating(name) for name in self.config["bots"]},
+        }
+        temporary = path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(data, file, separators=(",", ":"))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            data = json.load(file)
+        config = data["config"]
+        tournament = cls(config["bots"], config["rounds"], config["width"], config["height"], config["seed"],
+                         config["max_ticks"], config["k"])
+        # Replaying the results in their original order gives back the same ratings
+        for result in data["results"]:
+            tournament.record(result)
+        return tournament
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play a round-robin tournament between policies on every core")
+    # The options a tournament is made of have no argparse defaults, so resuming can tell
+    # which of them were given
+    parser.add_argument("--bots", nargs="+", choices=sorted(sim.POLICIES), help="default: every policy")
+    parser.add_argument("--rounds", type=int, help="matches per ordered pair of bots, default 10")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--width", type=int, help="default 15")
+    parser.add_argument("--height", type=int, help="default 15")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-ticks", type=int, help="call a match a draw after this many ticks, default 10000")
+    parser.add_argument("--k", type=float, help="Elo K factor, default 16")
+    parser.add_argument("--checkpoint", metavar="PATH", help="save progress here, and resume from it if it exists")
+    parser.add_argument("--checkpoint-every", type=float, default=30, metavar="SECONDS")
+    args = parser.parse_args(argv)
+    given = {key: getattr(args, key) for key in ("bots", "rounds", "width", "height", "seed", "max_ticks", "k")
+             if getattr(args, key) is not None}
+
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        tournament = Tournament.load(args.checkpoint)
+        changed = sorted(key for key, value in given.items() if value != tournament.config[key])
+        if changed:
+            parser.error("{} holds a tournament with different {}; leave them out to resume it".format(
+                args.checkpoint, ", ".join("--" + key.replace("_", "-") for key in changed)))
+        print("Resuming {}: {} of {} matches played".format(
+            args.checkpoint, len(tournament.done), len(tournament.matches)))
+    else:
+        config = dict(DEFAULTS, bots=sorted(sim.POLICIES), seed=None)
+        config.update(given)
+        tournament = Tournament(config["bots"], config["rounds"], config["width"], config["height"],
+                                config["seed"], config["max_ticks"], config["k"])
+
+    start = time.perf_counter()
+    last_save = start
+    played = 0
+    ticks = 0
+    try:
+        for result in tournament.run(args.workers):
+            played += 1
+            ticks += result[2]
+            if args.checkpoint and time.perf_counter() - last_save >= args.checkpoint_every:
+                tournament.save(args.checkpoint)
+                last_save = time.perf_counter()
+    except KeyboardInterrupt:
+        print("Stopping...")
+    elapsed = time.perf_counter() - start
+    if args.checkpoint:
+        tournament.save(args.checkpoint)
+
+    print("{} matches, {} ticks in {:.2f}s, {:.0f} matches/hour".format(
+        played, ticks, elapsed, played / elapsed * 3600 if elapsed else 0.0))
+    if not tournament.finished():
+        print("{} of {} matches still to play".format(len(tournament.matches) - len(tournament.done),
+                                                      len(tournament.matches)))
+    print(tournament.standings_table())
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,9 @@
 
 """ui.py: User Interface for the snake"""
 
+from collections import deque
 import sys
+import time
 
 import pygame
 
@@ -48,9 +50,34 @@ RIGHT2 = pygame.K_d
 
 RESET = pygame.K_r
 
+# TwoPlayerUI.winner when both snakes die on the same tick
+DRAW = -1
+
+# Moving the view around boards bigger than the window; FOLLOW cycles through the players
+# the view keeps centred, and scrolling stops following
+SCROLL_KEYS = {
+    pygame.K_i: (0, -1),
+    pygame.K_k: (0, 1),
+    pygame.K_j: (-1, 0),
+    pygame.K_l: (1, 0),
+}
+FOLLOW = pygame.K_f
+
+# Key presses buffered per player, at most this many ticks ahead
+INPUT_QUEUE = 3
+# Longest stretch of time the loop catches up on in one frame, in seconds, unless a tick or
+# a frame takes longer than that, in which case it is two of those
+MAX_LAG = 0.25
+
 
 class GridUI:
-    def __init__(self, cells_width, cells_height, segment_size, segment_margin, outside_margin, fps):
+    # Subclasses set how many players there are and map keys to (player, Direction)
+    players = 1
+    keys = {}
+
+    def __init__(self, cells_width, cells_height, segment_size, segment_margin, outside_margin, fps,
+                 recorder=None, incremental=True, instruments=None, tick_rate=None, interpolate=False,
+                 view_width=None, view_height=None, headless=False):
         self.segment_size = segment_size
         self.segment_margin = segment_margin
         self.total_segment = segment_margin + segment_size
@@ -59,40 +86,328 @@ class GridUI:
         self.cells_width = cells_width
         self.cells_height = cells_height
 
-        self.window_height = self.cells_height * (self.segment_size + self.segment_margin) \
+        # Only a view_width x view_height window of cells is drawn, with its top left corner
+        # at (view_x, view_y). It shows the whole board unless the board is bigger, in which
+        # case it follows player 1 to begin with.
+        self.view_width = min(view_width or cells_width, cells_width)
+        self.view_height = min(view_height or cells_height, cells_height)
+        self.view_x = 0
+        self.view_y = 0
+        fits = self.view_width == cells_width and self.view_height == cells_height
+        self.following = None if fits else 0
+
+        self.window_height = self.view_height * (self.segment_size + self.segment_margin) \
                              + self.segment_margin + self.outside_margin * 2
-        self.window_width = self.cells_width * (self.segment_size + self.segment_margin) \
+        self.window_width = self.view_width * (self.segment_size + self.segment_margin) \
                             + self.segment_margin + self.outside_margin * 2
 
-        pygame.init()
+        # A headless GridUI draws onto an offscreen surface and never opens a window or
+        # touches the display, for rendering frames to files
+        self.headless = headless
+        if headless:
+            pygame.font.init()
+        else:
+            pygame.init()
 
         self.font = pygame.font.SysFont("roboto", 30)
         self.fps = fps
         self.fps_clock = pygame.time.Clock()
 
-        self.screen = pygame.display.set_mode((self.window_width, self.window_height))
-
-    def draw_grid(self):
+        if headless:
+            self.screen = pygame.Surface((self.window_width, self.window_height))
+        else:
+            self.screen = pygame.display.set_mode((self.window_width, self.window_height))
+
+        # The empty grid is drawn once. With incremental rendering only the cells marked dirty
+        # since the last frame are repainted and pushed to the display.
+        self.background = pygame.Surface((self.window_width, self.window_height))
+        if not headless:
+            self.background = self.background.convert()
+        self.background.fill(BGCOLOR)
+        self.draw_grid(self.background)
+        self.incremental = incremental
+        self.needs_redraw = True
+        self.dirty = set()
+
+        # Optional replay.ReplayRecorder that every game played is appended to
+        self.recorder = recorder
+
+        # Optional instrument.Instruments timing every phase of a frame, also handed to the
+        # games. Frames that take longer than a tick at the target fps count as overruns.
+        self.instruments = instruments
+        if instruments and instruments.budget is None and fps:
+            instruments.budget = 1.0 / fps
+
+        # The game advances at tick_rate ticks a second, fps is only how often it is drawn.
+        # Without a tick_rate the game ticks once per frame. With interpolate, heads are
+        # drawn partway into their next cell between ticks.
+        self.tick_rate = tick_rate or fps
+        self.tick_interval = 1.0 / self.tick_rate if self.tick_rate else 0.0
+        self.max_lag = max(MAX_LAG, 2 * self.tick_interval, 2.0 / fps if fps else 0.0)
+        self.interpolate = interpolate
+        self.start_loop()
+
+    def draw_grid(self, surface=None):
+        surface = surface or self.screen
         for x in range(self.outside_margin, self.window_width, self.segment_size+self.segment_margin):
-            pygame.draw.line(self.screen, GRID_COLOR, (x, self.outside_margin),
+            pygame.draw.line(surface, GRID_COLOR, (x, self.outside_margin),
                              (x, self.window_height - self.outside_margin), self.segment_margin)
         for y in range(self.outside_margin, self.window_height+self.outside_margin, self.segment_size+self.segment_margin):
-            pygame.draw.line(self.screen, GRID_COLOR, (self.outside_margin, y),
+            pygame.draw.line(surface, GRID_COLOR, (self.outside_margin, y),
                              (self.window_width - self.outside_margin, y), self.segment_margin)
 
+    def cell_rect(self, x, y):
+        rect_x = (x - self.view_x) * self.total_segment + self.outside_margin + self.segment_margin
+        rect_y = (y - self.view_y) * self.total_segment + self.outside_margin + self.segment_margin
+        return pygame.Rect(rect_x, rect_y, self.segment_size, self.segment_size)
+
+    def in_view(self, x, y):
+        return self.view_x <= x < self.view_x + self.view_width and self.view_y <= y < self.view_y + self.view_height
+
     def fill_cell(self, x, y, color):
-        if 0 <= x < self.cells_width and 0 <= y < self.cells_height:
-            rect_x = x * self.total_segment + self.outside_margin + self.segment_margin
-            rect_y = y * self.total_segment + self.outside_margin + self.segment_margin
-            rectangle = pygame.Rect(rect_x, rect_y, self.segment_size, self.segment_size)
-            pygame.draw.rect(self.screen, color, rectangle)
+        if self.in_view(x, y):
+            pygame.draw.rect(self.screen, color, self.cell_rect(x, y))
+
+    def scroll_to(self, x, y):
+        # Move the view's top left corner, keeping the view on the board
+        x = max(0, min(x, self.cells_width - self.view_width))
+        y = max(0, min(y, self.cells_height - self.view_height))
+        if (x, y) != (self.view_x, self.view_y):
+            self.view_x = x
+            self.view_y = y
+            self.needs_redraw = True
+
+    def scroll(self, dx, dy):
+        self.scroll_to(self.view_x + dx, self.view_y + dy)
+
+    def center_on(self, pos):
+        self.scroll_to(pos[0] - self.view_width // 2, pos[1] - self.view_height // 2)
+
+    def follow(self, player):
+        """Keep the view centred on player's head (counting from 0), or stop with None."""
+        self.following = player
+        if player is not None:
+            self.center_on(self.snakes()[player][0].get_head_position())
+
+    def visible_snakes(self, snakes):
+        # A snake lies within its length of its head, so any snake whose head is further
+        # than that from the view can be skipped without looking at its body
+        visible = []
+        for snake, color in snakes:
+            x, y = snake.get_head_position()
+            reach = snake.get_length()
+            if self.view_x - reach < x < self.view_x + self.view_width + reach and \
+                    self.view_y - reach < y < self.view_y + self.view_height + reach:
+                visible.append((snake, color))
+        return visible
 
     def draw_apple(self, apple, color):
         self.fill_cell(apple.get_x(), apple.get_y(), color)
 
+    def visible_apples(self, food):
+        # Looked up in the food's buckets, so apples far from the view are never touched
+        return food.within(self.view_x, self.view_y, self.view_width, self.view_height)
+
+    def draw_apples(self, food, color):
+        for apple in self.visible_apples(food):
+            self.draw_apple(apple, color)
+
     def draw_snake(self, snake, color):
-        for i in snake.get_coords():
-            self.fill_cell(i.get_x(), i.get_y(), color)
+        for x, y in snake.get_positions():
+            self.fill_cell(x, y, color)
+
+    def mark_dirty(self, snakes, food):
+        # Call before and after every game update: the cells that can change in a tick are
+        # the heads, the tails and the apples
+        for snake, color in snakes:
+            self.dirty.add(snake.get_head_position())
+            self.dirty.add(snake.get_tail_position())
+        for apple in self.visible_apples(food):
+            self.dirty.add(apple.get_position())
+
+    def draw_board(self, snakes, food):
+        """Draw the apples of food and the (snake, color) pairs, later snakes on top.
+
+        Returns the rects to push with show(), or None if the whole screen was redrawn.
+        """
+        snakes = self.visible_snakes(snakes)
+        if self.needs_redraw or not self.incremental:
+            self.screen.blit(self.background, (0, 0))
+            self.draw_apples(food, APPLE_COLOR)
+            for snake, color in snakes:
+                self.draw_snake(snake, color)
+            self.needs_redraw = False
+            self.dirty.clear()
+            return None
+
+        counts = None
+        for snake, _ in snakes:
+            if snake.board is not None:
+                counts = snake.board.counts
+                break
+        rects = []
+        for pos in self.dirty:
+            x, y = pos
+            if not self.in_view(x, y):
+                continue
+            rectangle = self.cell_rect(x, y)
+            color = self.snake_color(pos, snakes, counts)
+            if color is None and pos in food.cells:
+                color = APPLE_COLOR
+            if color is None:
+                self.screen.blit(self.background, rectangle, rectangle)
+            else:
+                pygame.draw.rect(self.screen, color, rectangle)
+            rects.append(rectangle)
+        self.dirty.clear()
+        return rects
+
+    def snake_color(self, pos, snakes, counts):
+        """Colour of the last of the (snake, color) pairs with a segment on pos, or None.
+
+        The board's count settles most cells without looking through the bodies on it:
+        nothing on the board covers an empty cell, and a cell counted once that is some
+        snake's head or tail belongs to that snake alone. Snakes that have left the board are
+        still drawn where they died, so those later than the owner are checked too.
+        """
+        count = -1 if counts is None else counts[pos[1] * self.cells_width + pos[0]]
+        owner = -1
+        if count == 1:
+            for i, (snake, _) in enumerate(snakes):
+                if snake.board is not None and (snake.get_head_position() == pos or snake.get_tail_position() == pos):
+                    owner = i
+                    break
+        if owner == -1 and count:
+            for i in range(len(snakes) - 1, -1, -1):
+                snake = snakes[i][0]
+                if (snake.board is not None or counts is None) and snake.collided(pos):
+                    owner = i
+                    break
+        for i in range(len(snakes) - 1, owner, -1):
+            snake = snakes[i][0]
+            if snake.board is None and snake.collided(pos):
+                return snakes[i][1]
+        return snakes[owner][1] if owner != -1 else None
+
+    def show(self, rects):
+        if self.headless:
+            return
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
+    def start_loop(self):
+        # Forget buffered input and time from before the game started
+        self.inputs = [deque() for _ in range(self.players)]
+        self.lag = 0.0
+        self.last_time = time.perf_counter()
+        self.needs_redraw = True
+
+    def poll_input(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT: sys.exit(0)
+            if event.type == pygame.KEYDOWN:
+                if event.key == QUIT:
+                    sys.exit(0)
+                elif event.key in self.keys:
+                    player, direction = self.keys[event.key]
+                    self.queue_direction(player, direction)
+                elif event.key in SCROLL_KEYS:
+                    dx, dy = SCROLL_KEYS[event.key]
+                    self.following = None
+                    self.scroll(dx * max(1, self.view_width // 4), dy * max(1, self.view_height // 4))
+                elif event.key == FOLLOW:
+                    following = 0 if self.following is None else self.following + 1
+                    self.follow(following if following < self.players else None)
+
+    def queue_direction(self, player, direction):
+        # Presses that repeat or reverse the direction the snake will be going by then would
+        # be ignored by the game anyway, so they don't take up a tick
+        queue = self.inputs[player]
+        last = queue[-1] if queue else self.last_direction(player)
+        if direction != last and direction != OPPOSITE[last] and len(queue) < INPUT_QUEUE:
+            queue.append(direction)
+
+    def next_direction(self, player):
+        queue = self.inputs[player]
+        return queue.popleft() if queue else False
+
+    def ticks_due(self):
+        if not self.tick_interval:
+            return 1
+        now = time.perf_counter()
+        self.lag = min(self.lag + now - self.last_time, self.max_lag)
+        self.last_time = now
+        due = int(self.lag / self.tick_interval)
+        self.lag -= due * self.tick_interval
+        return due
+
+    def update(self):
+        # One frame: read the input, run every tick that is due, then draw
+        instruments = self.instruments
+        if instruments:
+            frame_start = start = instruments.clock()
+        self.poll_input()
+        if instruments:
+            start = instruments.lap("input", start)
+
+        for _ in range(self.ticks_due()):
+            if self.winner != 0:
+                break
+            snakes = self.snakes()
+            self.mark_dirty(snakes, self.game.food)
+            self.tick()
+            self.mark_dirty(snakes, self.game.food)
+        if self.following is not None:
+            self.center_on(self.snakes()[self.following][0].get_head_position())
+        if instruments:
+            start = instruments.lap("update", start)
+
+        if self.winner == 0:
+            snakes = self.snakes()
+            rects = self.draw_board(snakes, self.game.food)
+            if self.interpolate and self.tick_interval:
+                rects = self.draw_motion(snakes, self.lag / self.tick_interval, rects)
+            if instruments:
+                start = instruments.lap("draw", start)
+            self.show(rects)
+        if instruments:
+            instruments.record("show", start)
+            instruments.record_frame(frame_start)
+
+        self.fps_clock.tick(self.fps)
+
+    def draw_motion(self, snakes, progress, rects):
+        """Draw each living head progress (0 to 1) of the way into the cell it moves to next.
+
+        The covered cells are marked dirty so the next frame paints over them.
+        """
+        for snake, color in snakes:
+            if snake.board is None:
+                continue
+            x, y = snake.get_head_position()
+            dx = DX[snake.heading]
+            dy = DY[snake.heading]
+            size = int(self.segment_size * progress)
+            if not size or not self.in_view(x + dx, y + dy):
+                continue
+            rectangle = self.cell_rect(x + dx, y + dy)
+            if dx > 0:
+                rectangle.width = size
+            elif dx < 0:
+                rectangle.left = rectangle.right - size
+                rectangle.width = size
+            elif dy > 0:
+                rectangle.height = size
+            else:
+                rectangle.top = rectangle.bottom - size
+                rectangle.height = size
+            pygame.draw.rect(self.screen, color, rectangle)
+            self.dirty.add((x + dx, y + dy))
+            if rects is not None:
+                rects.append(rectangle)
+        return rects
 
     def draw_text(self, text, border):
         text = self.font.render(text, True, TEXT_COLOR)
@@ -107,7 +422,7 @@ class GridUI:
         pygame.draw.rect(self.screen, BG_TEXT_COLOR, rectangle)
 
         self.screen.blit(text, text_rect)
-        pygame.display.flip()
+        self.show(None)
 
     def title(self, title):
         self.screen.fill(BGCOLOR)
@@ -116,10 +431,21 @@ class GridUI:
 
 
 class SinglePlayerUI(GridUI):
-    def __init__(self, cells_width, cells_height, segment_size, segment_margin, outside_margin, fps):
-        super().__init__(cells_width, cells_height, segment_size, segment_margin, outside_margin, fps)
-
-        self.game = SinglePlayerGame(cells_width, cells_height)
+    players = 1
+    keys = {
+        UP: (0, Direction.UP),
+        DOWN: (0, Direction.DOWN),
+        LEFT: (0, Direction.LEFT),
+        RIGHT: (0, Direction.RIGHT),
+    }
+
+    def __init__(self, cells_width, cells_height, segment_size, segment_margin, outside_margin, fps,
+                 recorder=None, incremental=True, instruments=None, tick_rate=None, interpolate=False,
+                 view_width=None, view_height=None):
+        super().__init__(cells_width, cells_height, segment_size, segment_margin, outside_margin, fps,
+                         recorder, incremental, instruments, tick_rate, interpolate, view_width, view_height)
+
+        self.game = SinglePlayerGame(cells_width, cells_height, instruments=instruments)
         self.winner = 2
 
     def go(self):
@@ -133,11 +459,19 @@ class SinglePlayerUI(GridUI):
         self.play()
 
     def play(self):
-        self.game = SinglePlayerGame(self.cells_width, self.cells_height)
+        self.game = SinglePlayerGame(self.cells_width, self.cells_height, instruments=self.instruments)
+        self.start_loop()
+        if self.recorder:
+            self.recorder.begin(self.game)
         while self.winner == 0:
             self.update()
+        if self.recorder:
+            self.recorder.end()
         while self.winner == 1:
-            self.draw_text("You lose! Score: " + str(self.game.get_snake().get_length()), 10)
+            if self.game.has_won():
+                self.draw_text("You win! Score: " + str(self.game.get_snake().get_length()), 10)
+            else:
+                self.draw_text("You lose! Score: " + str(self.game.get_snake().get_length()), 10)
             for event in pygame.event.get():
                 if event.type == pygame.QUIT: sys.exit(0)
                 elif event.type == pygame.KEYDOWN:
@@ -148,45 +482,41 @@ class SinglePlayerUI(GridUI):
                         sys.exit(0)
         self.play()
 
-    def update(self):
-        # This function should be run every repetition
-        # Reset screen
-        self.screen.fill(BGCOLOR)
-        self.draw_grid()
+    def snakes(self):
+        return [(self.game.get_snake(), SNAKE_COLOR)]
 
-        direction = False
+    def last_direction(self, player):
+        return self.game.last_direction
 
-        # Check for events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: sys.exit(0)
-            if event.type == pygame.KEYDOWN:
-                if event.key == QUIT:
-                    sys.exit(0)
-                elif event.key == UP:
-                    direction = Direction.UP
-                elif event.key == DOWN:
-                    direction = Direction.DOWN
-                elif event.key == LEFT:
-                    direction = Direction.LEFT
-                elif event.key == RIGHT:
-                    direction = Direction.RIGHT
-
-        self.draw_apple(self.game.get_apple(), APPLE_COLOR)
-        self.draw_snake(self.game.get_snake(), SNAKE_COLOR)
-
-        if not self.game.update(direction):
+    def tick(self):
+        direction = self.next_direction(0)
+        running = self.game.update(direction)
+        if self.recorder:
+            self.recorder.record(self.game, direction)
+        if not running:
             self.winner = 1
-        else:
-            pygame.display.flip()
-
-        self.fps_clock.tick(self.fps)
 
 
 class TwoPlayerUI(GridUI):
-    def __init__(self, cells_width, cells_height, segment_size, segment_margin, outside_margin, fps):
-        super().__init__(cells_width, cells_height, segment_size, segment_margin, outside_margin, fps)
-
-        self.game = TwoPlayerGame(cells_width, cells_height)
+    players = 2
+    keys = {
+        UP: (0, Direction.UP),
+        DOWN: (0, Direction.DOWN),
+        LEFT: (0, Direction.LEFT),
+        RIGHT: (0, Direction.RIGHT),
+        UP2: (1, Direction.UP),
+        DOWN2: (1, Direction.DOWN),
+        LEFT2: (1, Direction.LEFT),
+        RIGHT2: (1, Direction.RIGHT),
+    }
+
+    def __init__(self, cells_width, cells_height, segment_size, segment_margin, outside_margin, fps,
+                 recorder=None, incremental=True, instruments=None, tick_rate=None, interpolate=False,
+                 view_width=None, view_height=None):
+        super().__init__(cells_width, cells_height, segment_size, segment_margin, outside_margin, fps,
+                         recorder, incremental, instruments, tick_rate, interpolate, view_width, view_height)
+
+        self.game = TwoPlayerGame(cells_width, cells_height, instruments=instruments)
         self.winner = 3
 
     def go(self):
@@ -200,11 +530,19 @@ class TwoPlayerUI(GridUI):
         self.play()
 
     def play(self):
-        self.game = TwoPlayerGame(self.cells_width, self.cells_height)
+        self.game = TwoPlayerGame(self.cells_width, self.cells_height, instruments=self.instruments)
+        self.start_loop()
+        if self.recorder:
+            self.recorder.begin(self.game)
         while self.winner == 0:
             self.update()
-        while self.winner == 1 or self.winner == 2:
-            self.draw_text("Player " + str(self.winner) + " wins! Press 'r' to play again or press 'q' to quit!", 10)
+        if self.recorder:
+            self.recorder.end()
+        while self.winner in (1, 2, DRAW):
+            if self.winner == DRAW:
+                self.draw_text("Draw! Press 'r' to play again or press 'q' to quit!", 10)
+            else:
+                self.draw_text("Player " + str(self.winner) + " wins! Press 'r' to play again or press 'q' to quit!", 10)
             for event in pygame.event.get():
                 if event.type == pygame.QUIT: sys.exit(0)
                 elif event.type == pygame.KEYDOWN:
@@ -215,50 +553,18 @@ class TwoPlayerUI(GridUI):
                         sys.exit(0)
         self.play()
 
-    def update(self):
-        # This function should be run every repetition
-        # Reset screen
-        self.screen.fill(BGCOLOR)
-        self.draw_grid()
+    def snakes(self):
+        return [(self.game.get_snake_1(), SNAKE_COLOR), (self.game.get_snake_2(), SNAKE2_COLOR)]
 
-        direction_1 = False
-        direction_2 = False
+    def last_direction(self, player):
+        return self.game.last_directions[player]
 
-        # Check for events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: sys.exit(0)
-            if event.type == pygame.KEYDOWN:
-                if event.key == QUIT:
-                    sys.exit(0)
-                elif event.key == UP:
-                    direction_1 = Direction.UP
-                elif event.key == DOWN:
-                    direction_1 = Direction.DOWN
-                elif event.key == LEFT:
-                    direction_1 = Direction.LEFT
-                elif event.key == RIGHT:
-                    direction_1 = Direction.RIGHT
-                elif event.key == UP2:
-                    direction_2 = Direction.UP
-                elif event.key == DOWN2:
-                    direction_2 = Direction.DOWN
-                elif event.key == LEFT2:
-                    direction_2 = Direction.LEFT
-                elif event.key == RIGHT2:
-                    direction_2 = Direction.RIGHT
-
-        self.draw_apple(self.game.get_apple(), APPLE_COLOR)
-        self.draw_snake(self.game.get_snake_1(), SNAKE_COLOR)
-        self.draw_snake(self.game.get_snake_2(), SNAKE2_COLOR)
-
-        if not self.game.update(direction_1, direction_2):
-            if self.game.alive_s1 and not self.game.alive_s2:
-                self.winner = 1
-            elif self.game.alive_s2 and not self.game.alive_s1:
-                self.winner = 2
-        else:
-            self.winner = 0
+    def tick(self):
+        direction_1 = self.next_direction(0)
+        direction_2 = self.next_direction(1)
+        running = self.game.update(direction_1, direction_2)
+        if self.recorder:
+            self.recorder.record(self.game, direction_1, direction_2)
 
-            pygame.display.flip()
-
-        self.fps_clock.tick(self.fps)
+        if not running:
+            self.winner = self.game.winner() or DRAW
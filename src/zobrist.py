@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""zobrist.py: Zobrist keys for game positions and an LRU transposition cache"""
+
+from collections import OrderedDict
+import random
+
+__author__ = "Wesley Soo-Hoo"
+__license__ = "MIT"
+
+# Direction from a segment to the next one towards the head, indexed by (dx, dy). A
+# doubled-up tail segment points at its own cell.
+LINKS = {
+    (0, -1): 0,
+    (0, 1): 1,
+    (-1, 0): 2,
+    (1, 0): 3,
+    (0, 0): 4,
+}
+
+TABLE_SEED = 0x5EED5
+# Boards with more cells than this get their keys from LazyKeys instead of lists
+LAZY_AREA = 1 << 18
+
+MASK = (1 << 64) - 1
+
+
+class LazyKeys:
+    """Random 64 bit keys worked out from their index when asked for, the splitmix64 mix of
+    seed and index, so a huge board costs no memory for keys it never uses."""
+
+    __slots__ = ("seed",)
+
+    def __init__(self, seed):
+        self.seed = seed
+
+    def __getitem__(self, index):
+        key = (self.seed + (index + 1) * 0x9E3779B97F4A7C15) & MASK
+        key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+        key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & MASK
+        return key ^ (key >> 31)
+
+
+class ZobristTable:
+    """Random 64 bit keys for every feature of a position on one board size.
+
+    A snake is hashed as its head cell plus, for every other segment, its cell together with
+    the direction to the next segment. That pins down the whole body, and moving the snake
+    only changes the keys at the two ends.
+    """
+
+    def __init__(self, width, height, players, seed=TABLE_SEED):
+        rng = random.Random(seed)
+        area = width * height
+        self.width = width
+        self.height = height
+        if area > LAZY_AREA:
+            self.heads = [LazyKeys(rng.getrandbits(64)) for _ in range(players)]
+            self.links = [LazyKeys(rng.getrandbits(64)) for _ in range(players)]
+        else:
+            self.heads = [[rng.getrandbits(64) for _ in range(area)] for _ in range(players)]
+            self.links = [[rng.getrandbits(64) for _ in range(area * 5)] for _ in range(players)]
+        self.directions = [[rng.getrandbits(64) for _ in range(4)] for _ in range(players)]
+        self.growing = [rng.getrandbits(64) for _ in range(players)]
+        self.dead = [rng.getrandbits(64) for _ in range(players)]
+        if area > LAZY_AREA:
+            self.apples = LazyKeys(rng.getrandbits(64))
+        else:
+            self.apples = [rng.getrandbits(64) for _ in range(area)]
+
+    def head_key(self, player, pos):
+        x, y = pos
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.heads[player][y * self.width + x]
+        # Only a dead snake's head leaves the board
+        return self.dead[player]
+
+    def link_key(self, player, pos, next_pos):
+        x, y = pos
+        return self.links[player][(y * self.width + x) * 5 + LINKS[next_pos[0] - x, next_pos[1] - y]]
+
+    def apple_key(self, pos):
+        return self.apples[pos[1] * self.width + pos[0]]
+
+    def snake_key(self, player, positions):
+        # positions run from head to tail, as in Snake.get_positions()
+        key = 0
+        next_pos = None
+        for pos in positions:
+            if next_pos is None:
+                key = self.head_key(player, pos)
+            else:
+                key ^= self.link_key(player, pos, next_pos)
+            next_pos = pos
+        return key
+
+    def state_key(self, player, heading, growing, alive):
+        # heading is the Direction.value the player last moved in
+        key = self.directions[player][heading]
+        if growing:
+            key ^= self.growing[player]
+        if not alive:
+            key ^= self.dead[player]
+        return key
+
+
+tables = {}
+
+
+def get_table(width, height, players):
+    # Tables are shared by every game on the same board size
+    key = (width, height, players)
+    if key not in tables:
+        tables[key] = ZobristTable(width, height, players)
+    return tables[key]
+
+
+class TranspositionCache:
+    """Bounded least-recently-used map from position hashes to results."""
+
+    def __init__(self, maxsize=1 << 16):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def lookup(self, game, compute):
+        """Return compute(game), memoized on the game's Zobrist hash."""
+        key = game.zobrist_hash()
+        value = self.get(key, self)
+        if value is self:
+            value = compute(game)
+            self.put(key, value)
+        return value
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate(),
+        }